@@ -0,0 +1,5 @@
+"""Performance benchmarks for the primitives, handshake and tunnel.
+
+Run ``python -m benchmarks run`` (or ``make bench``) to write a JSON report
+and ``python -m benchmarks compare BASELINE RESULTS`` to flag regressions.
+"""
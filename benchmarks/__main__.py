@@ -0,0 +1,81 @@
+"""Command-line entry point: ``python -m benchmarks {run,compare}``."""
+
+from __future__ import annotations
+
+import argparse
+import sys
+
+from . import handshake, primitives, tunnel
+from .harness import compare_reports, load_report, write_report
+
+SUITES = {
+    "primitives": primitives,
+    "handshake": handshake,
+    "tunnel": tunnel,
+}
+
+
+def _run(args: argparse.Namespace) -> int:
+    results = []
+    for name in args.suite or list(SUITES):
+        print(f"[bench] running {name}", file=sys.stderr)
+        results.extend(SUITES[name].run(quick=args.quick, min_time=args.min_time))
+    write_report(args.output, results)
+    for result in results:
+        print(f"{result.key:<48} {result.value:>12.3f} {result.unit}")
+    print(f"[bench] results written to {args.output}", file=sys.stderr)
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    rows = compare_reports(
+        load_report(args.baseline), load_report(args.current), threshold=args.threshold
+    )
+    regressions = 0
+    for row in rows:
+        marker = "REGRESSION" if row["regression"] else ""
+        regressions += row["regression"]
+        print(
+            f"{row['key']:<48} {row['baseline']:>12.3f} -> {row['current']:>12.3f} "
+            f"{row['unit']:<13} {row['change']:+7.1%} {marker}"
+        )
+    if regressions:
+        print(f"[bench] {regressions} regression(s) beyond {args.threshold:.0%}")
+        return 1
+    print("[bench] no regressions")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Parse arguments and dispatch to the run or compare command."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run benchmark suites and write JSON")
+    run.add_argument("--output", default="bench_results.json")
+    run.add_argument(
+        "--suite", action="append", choices=sorted(SUITES), help="Repeatable"
+    )
+    run.add_argument("--quick", action="store_true", help="Fewer payload sizes")
+    run.add_argument(
+        "--min-time", type=float, default=0.5, help="Seconds per timing round"
+    )
+    run.set_defaults(func=_run)
+
+    compare = commands.add_parser("compare", help="Flag regressions against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Allowed slowdown as a fraction (default 0.10)",
+    )
+    compare.set_defaults(func=_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
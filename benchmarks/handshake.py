@@ -0,0 +1,46 @@
+"""Full and resumed handshakes completed per second (both roles)."""
+
+from __future__ import annotations
+
+import os
+
+from src.protocol.handshake import HandshakeClient, HandshakeServer
+from src.protocol.resumption import TicketIssuer
+
+from .harness import Result, measure
+
+
+def run(*, quick: bool = False, min_time: float = 0.5) -> list[Result]:
+    """Time complete client + server handshakes in a single thread."""
+    psk = os.urandom(32)
+    issuer = TicketIssuer()
+
+    def full() -> HandshakeClient:
+        client = HandshakeClient(psk)
+        server = HandshakeServer(psk, ticket_issuer=issuer)
+        reply, _ = server.process_client_hello(client.build_hello())
+        client.process_server_hello(reply)
+        return client
+
+    # Every resumption hands out a fresh ticket, which the next one redeems.
+    state = [full().ticket]
+
+    def resumed() -> None:
+        client = HandshakeClient(psk)
+        server = HandshakeServer(psk, ticket_issuer=issuer)
+        reply, _ = server.process_client_hello(client.build_resume_hello(state[0]))
+        client.process_server_hello(reply)
+        state[0] = client.ticket
+
+    return [
+        Result(
+            "handshake_full",
+            1.0 / measure(full, min_time=min_time),
+            "handshakes/s",
+        ),
+        Result(
+            "handshake_resumed",
+            1.0 / measure(resumed, min_time=min_time),
+            "handshakes/s",
+        ),
+    ]
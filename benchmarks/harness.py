@@ -0,0 +1,134 @@
+"""Timing loop, result records and baseline comparison shared by suites."""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+
+@dataclass
+class Result:
+    name: str
+    value: float
+    unit: str
+    params: dict = field(default_factory=dict)
+    higher_is_better: bool = True
+
+    @property
+    def key(self) -> str:
+        """Identity used to match results across runs."""
+        suffix = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.name}[{suffix}]" if suffix else self.name
+
+
+def measure(
+    fn: Callable[[], object], *, min_time: float = 0.5, rounds: int = 3
+) -> float:
+    """Return the best observed seconds per call of ``fn``.
+
+    Each round calls ``fn`` until ``min_time`` has elapsed; the fastest round
+    is reported to filter out scheduler noise.
+    """
+    best = float("inf")
+    for _ in range(rounds):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+
+def throughput(name: str, size: int, seconds_per_call: float, **params) -> Result:
+    """Build an MB/s result for a call that processes ``size`` bytes."""
+    return Result(
+        name=name,
+        value=size / seconds_per_call / 1e6,
+        unit="MB/s",
+        params={"size": size, **params},
+    )
+
+
+def _git_commit() -> str | None:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def host_metadata() -> dict:
+    """Describe the machine and interpreter the numbers were taken on."""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "git_commit": _git_commit(),
+    }
+
+
+def write_report(path: str, results: list[Result]) -> dict:
+    """Write results plus host metadata as JSON and return the report."""
+    report = {
+        "host": host_metadata(),
+        "results": [dict(asdict(result), key=result.key) for result in results],
+    }
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+        handle.write("\n")
+    return report
+
+
+def load_report(path: str) -> dict:
+    """Read a report written by ``write_report``."""
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def compare_reports(
+    baseline: dict, current: dict, *, threshold: float = 0.10
+) -> list[dict]:
+    """Return one row per shared benchmark with its relative change.
+
+    A row is flagged as a regression when the result moved in the wrong
+    direction by more than ``threshold`` (a fraction of the baseline).
+    """
+    old = {entry["key"]: entry for entry in baseline["results"]}
+    rows = []
+    for entry in current["results"]:
+        before = old.get(entry["key"])
+        if before is None or not before["value"]:
+            continue
+        change = (entry["value"] - before["value"]) / before["value"]
+        worse = -change if entry.get("higher_is_better", True) else change
+        rows.append(
+            {
+                "key": entry["key"],
+                "unit": entry["unit"],
+                "baseline": before["value"],
+                "current": entry["value"],
+                "change": change,
+                "regression": worse > threshold,
+            }
+        )
+    return rows
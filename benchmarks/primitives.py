@@ -0,0 +1,50 @@
+"""Throughput of the pure-Python cryptographic primitives."""
+
+from __future__ import annotations
+
+import os
+
+from src.crypto.chacha20 import chacha20_encrypt
+from src.crypto.chacha20_poly1305 import (
+    chacha20_poly1305_decrypt,
+    chacha20_poly1305_encrypt,
+)
+from src.crypto.hmac_sha256 import hmac_sha256
+from src.crypto.poly1305 import poly1305_mac
+from src.crypto.sha256 import sha256, sha256_many
+
+from .harness import Result, measure, throughput
+
+SIZES = (64, 1024, 16384)
+QUICK_SIZES = (64, 1024)
+# Messages hashed per sha256_many call.
+MANY = 64
+
+
+def run(*, quick: bool = False, min_time: float = 0.5) -> list[Result]:
+    """Measure MB/s for each primitive across the payload sizes."""
+    key = os.urandom(32)
+    nonce = os.urandom(12)
+    results = []
+    for size in QUICK_SIZES if quick else SIZES:
+        data = os.urandom(size)
+        ciphertext, tag = chacha20_poly1305_encrypt(key, nonce, data, b"")
+        cases = {
+            "sha256": lambda: sha256(data),
+            "hmac_sha256": lambda: hmac_sha256(key, data),
+            "chacha20_encrypt": lambda: chacha20_encrypt(key, nonce, 1, data),
+            "poly1305_mac": lambda: poly1305_mac(key, data),
+            "aead_encrypt": lambda: chacha20_poly1305_encrypt(key, nonce, data, b""),
+            "aead_decrypt": lambda: chacha20_poly1305_decrypt(
+                key, nonce, ciphertext, b"", tag
+            ),
+        }
+        for name, fn in cases.items():
+            results.append(throughput(name, size, measure(fn, min_time=min_time)))
+        messages = [os.urandom(size) for _ in range(MANY)]
+        seconds = measure(lambda: sha256_many(messages), min_time=min_time)
+        # Reported per message size so it lines up with the sha256 rows.
+        result = throughput("sha256_many", size * MANY, seconds, messages=MANY)
+        result.params["size"] = size
+        results.append(result)
+    return results
@@ -60,11 +60,31 @@ def _chacha_block(key: bytes, counter: int, nonce: bytes) -> bytes:
     return b"".join(word.to_bytes(4, "little") for word in output)
 
 
-def chacha20_encrypt(key: bytes, nonce: bytes, counter: int, data: bytes) -> bytes:
-    """Encrypt or decrypt data with ChaCha20 (symmetric stream cipher)."""
+def chacha20_keystream(
+    key: bytes, nonce: bytes, counter: int, length: int
+) -> bytearray:
+    """Return ``length`` keystream bytes starting at block ``counter``."""
     keystream = bytearray()
     block_counter = counter
-    for offset in range(0, len(data), 64):
+    for _ in range(0, length, 64):
         keystream.extend(_chacha_block(key, block_counter, nonce))
         block_counter += 1
+    del keystream[length:]
+    return keystream
+
+
+def xor_keystream(data: bytes, keystream) -> bytes:
+    """XOR ``data`` with the first ``len(data)`` bytes of ``keystream``."""
+    size = len(data)
+    if size == 0:
+        return b""
+    mixed = int.from_bytes(data, "little") ^ int.from_bytes(
+        keystream[:size], "little"
+    )
+    return mixed.to_bytes(size, "little")
+
+
+def chacha20_encrypt(key: bytes, nonce: bytes, counter: int, data: bytes) -> bytes:
+    """Encrypt or decrypt data with ChaCha20 (symmetric stream cipher)."""
+    keystream = chacha20_keystream(key, nonce, counter, len(data))
     return bytes(a ^ b for a, b in zip(data, keystream))
@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-from .chacha20 import chacha20_encrypt
+from .chacha20 import chacha20_encrypt, chacha20_keystream, xor_keystream
 from .poly1305 import poly1305_mac
 
 
@@ -16,17 +16,22 @@ def _encode_length(value: int) -> bytes:
     return value.to_bytes(8, "little")
 
 
+def _mac_data(aad: bytes, ciphertext: bytes) -> bytes:
+    """Lay out AAD and ciphertext (padded) plus their lengths for Poly1305."""
+    mac_data = aad + b"\x00" * ((16 - len(aad) % 16) % 16)
+    mac_data += ciphertext + b"\x00" * ((16 - len(ciphertext) % 16) % 16)
+    mac_data += _encode_length(len(aad))
+    mac_data += _encode_length(len(ciphertext))
+    return mac_data
+
+
 def chacha20_poly1305_encrypt(
     key: bytes, nonce: bytes, plaintext: bytes, aad: bytes
 ) -> tuple[bytes, bytes]:
     """Encrypt plaintext and produce authentication tag for the given AAD."""
     poly_key = _poly_key(key, nonce)
     ciphertext = chacha20_encrypt(key, nonce, 1, plaintext)
-    mac_data = aad + b"\x00" * ((16 - len(aad) % 16) % 16)
-    mac_data += ciphertext + b"\x00" * ((16 - len(ciphertext) % 16) % 16)
-    mac_data += _encode_length(len(aad))
-    mac_data += _encode_length(len(ciphertext))
-    tag = poly1305_mac(poly_key, mac_data)
+    tag = poly1305_mac(poly_key, _mac_data(aad, ciphertext))
     return ciphertext, tag
 
 
@@ -35,16 +40,50 @@ def chacha20_poly1305_decrypt(
 ) -> bytes:
     """Decrypt ciphertext after verifying the Poly1305 tag."""
     poly_key = _poly_key(key, nonce)
-    mac_data = aad + b"\x00" * ((16 - len(aad) % 16) % 16)
-    mac_data += ciphertext + b"\x00" * ((16 - len(ciphertext) % 16) % 16)
-    mac_data += _encode_length(len(aad))
-    mac_data += _encode_length(len(ciphertext))
-    expected_tag = poly1305_mac(poly_key, mac_data)
+    expected_tag = poly1305_mac(poly_key, _mac_data(aad, ciphertext))
     if not _constant_time_eq(expected_tag, tag):
         raise ValueError("Invalid authentication tag")
     return chacha20_encrypt(key, nonce, 1, ciphertext)
 
 
+def chacha20_poly1305_keystream(
+    key: bytes, nonce: bytes, length: int
+) -> tuple[bytearray, bytearray]:
+    """Precompute the Poly1305 key and ``length`` bytes of payload keystream.
+
+    Together they let ``chacha20_poly1305_seal``/``_open`` process a payload
+    of up to ``length`` bytes with only an XOR and a MAC.
+    """
+    block = chacha20_keystream(key, nonce, 0, 64 + length)
+    poly_key = block[:32]
+    keystream = block[64:]
+    block[:] = bytes(len(block))
+    return poly_key, keystream
+
+
+def chacha20_poly1305_seal(
+    poly_key: bytes, keystream, plaintext: bytes, aad: bytes
+) -> tuple[bytes, bytes]:
+    """Encrypt with precomputed material; same output as the keyed encrypt."""
+    if len(plaintext) > len(keystream):
+        raise ValueError("Keystream shorter than plaintext")
+    ciphertext = xor_keystream(plaintext, keystream)
+    tag = poly1305_mac(bytes(poly_key), _mac_data(aad, ciphertext))
+    return ciphertext, tag
+
+
+def chacha20_poly1305_open(
+    poly_key: bytes, keystream, ciphertext: bytes, aad: bytes, tag: bytes
+) -> bytes:
+    """Verify and decrypt with precomputed material."""
+    if len(ciphertext) > len(keystream):
+        raise ValueError("Keystream shorter than ciphertext")
+    expected_tag = poly1305_mac(bytes(poly_key), _mac_data(aad, bytes(ciphertext)))
+    if not _constant_time_eq(expected_tag, tag):
+        raise ValueError("Invalid authentication tag")
+    return xor_keystream(ciphertext, keystream)
+
+
 def _constant_time_eq(a: bytes, b: bytes) -> bool:
     """Compare two byte strings without leaking timing information."""
     if len(a) != len(b):
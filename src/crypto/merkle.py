@@ -0,0 +1,74 @@
+"""Incremental SHA-256 Merkle tree over fixed-size data chunks."""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+from .sha256 import sha256
+
+# Domain separation keeps leaves and interior nodes from being confused.
+_LEAF_PREFIX = b"\x00"
+_NODE_PREFIX = b"\x01"
+
+
+def leaf_hash(chunk: bytes) -> bytes:
+    """Hash one data chunk as a Merkle leaf."""
+    return sha256(_LEAF_PREFIX + chunk)
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    """Hash two child digests into their parent node."""
+    return sha256(_NODE_PREFIX + left + right)
+
+
+class MerkleBuilder:
+    """Fold leaves into a Merkle root as they arrive, in O(log n) memory.
+
+    A lone node at the end of a level is promoted unchanged, so the root of
+    a single leaf is that leaf's hash.
+    """
+
+    def __init__(self):
+        """Start an empty tree."""
+        # _stack[i] holds the root of a complete subtree of 2**i leaves.
+        self._stack: list[bytes | None] = []
+        self.count = 0
+
+    def add_leaf(self, digest: bytes) -> None:
+        """Append an already hashed leaf."""
+        node = digest
+        level = 0
+        while level < len(self._stack) and self._stack[level] is not None:
+            node = node_hash(self._stack[level], node)
+            self._stack[level] = None
+            level += 1
+        if level == len(self._stack):
+            self._stack.append(node)
+        else:
+            self._stack[level] = node
+        self.count += 1
+
+    def add_chunk(self, chunk: bytes) -> bytes:
+        """Hash and append a data chunk, returning its leaf digest."""
+        digest = leaf_hash(chunk)
+        self.add_leaf(digest)
+        return digest
+
+    def root(self) -> bytes:
+        """Return the root over every leaf added so far."""
+        if not self.count:
+            return leaf_hash(b"")
+        node = None
+        for subtree in self._stack:
+            if subtree is None:
+                continue
+            node = subtree if node is None else node_hash(subtree, node)
+        return node
+
+
+def merkle_root(leaves: Iterable[bytes]) -> bytes:
+    """Compute the Merkle root of a sequence of leaf digests."""
+    builder = MerkleBuilder()
+    for digest in leaves:
+        builder.add_leaf(digest)
+    return builder.root()
@@ -3,15 +3,17 @@
 from __future__ import annotations
 
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from ..crypto.hmac_sha256 import hmac_sha256, hkdf_expand, hkdf_extract
 from ..crypto.sha256 import sha256
 from .diffie_hellman import (
     derive_shared,
-    generate_keypair,
     public_from_private,
+    random_exponent,
 )
+from .options import encode_options, negotiate
+from .resumption import ResumptionTicket, TicketIssuer, binder_key
 
 
 @dataclass
@@ -21,6 +23,8 @@ class HandshakeKeys:
     client_mac: bytes
     server_mac: bytes
     base_nonce: bytes
+    resumption_secret: bytes
+    options: dict[str, int] = field(default_factory=dict)
 
 
 class HandshakeParticipant:
@@ -32,33 +36,59 @@ class HandshakeParticipant:
         *,
         private_key: int | None = None,
         nonce: bytes | None = None,
+        options: dict[str, int] | None = None,
     ):
-        """Prepare deterministic or random key/nonce pairs for a role."""
+        """Prepare deterministic or random key/nonce pairs for a role.
+
+        ``options`` are the session options this role offers (client) or
+        supports (server); see ``protocol.options``.
+        """
         self.psk = psk
-        if private_key is None:
-            self.priv, self.pub = generate_keypair()
-        else:
-            self.priv = private_key
-            self.pub = public_from_private(private_key)
+        self.options = dict(options or {})
+        self.priv = private_key if private_key is not None else random_exponent()
+        self._pub: int | None = None
         self.nonce = nonce if nonce is not None else os.urandom(12)
 
+    @property
+    def pub(self) -> int:
+        """Public DH value, computed on first use so resumption skips modexp."""
+        if self._pub is None:
+            self._pub = public_from_private(self.priv)
+        return self._pub
+
     def _transcript_hash(self, parts: list[bytes]) -> bytes:
         return sha256(b"".join(parts))
 
     def _derive_keys(self, shared_secret: bytes, nonces: bytes) -> HandshakeKeys:
         """Expand the Diffie-Hellman secret and nonces into tunnel keys."""
         prk = hkdf_extract(self.psk, shared_secret)
-        okm = hkdf_expand(prk, nonces, 128)
+        okm = hkdf_expand(prk, nonces, 160)
         return HandshakeKeys(
             client_enc=okm[0:32],
             server_enc=okm[32:64],
             client_mac=okm[64:96],
             server_mac=okm[96:128],
             base_nonce=sha256(nonces)[:12],
+            resumption_secret=okm[128:160],
         )
 
+    def _serialize(self, payload: dict) -> bytes:
+        """Serialize role/public key/nonce/ticket/options for HMAC coverage."""
+        data = payload["role"].encode()
+        if "pub" in payload:
+            data += payload["pub"].to_bytes(256, "big")
+        data += payload["nonce"]
+        if "ticket" in payload:
+            data += payload["ticket"]
+        if "options" in payload:
+            data += encode_options(payload["options"])
+        return data
+
 
 class HandshakeClient(HandshakeParticipant):
+    resuming: ResumptionTicket | None = None
+    ticket: ResumptionTicket | None = None
+
     def build_hello(self) -> dict:
         """Return the first handshake message (ClientHello + MAC)."""
         payload = {
@@ -66,34 +96,76 @@ class HandshakeClient(HandshakeParticipant):
             "pub": self.pub,
             "nonce": self.nonce,
         }
+        if self.options:
+            payload["options"] = self.options
         mac = hmac_sha256(self.psk, self._serialize(payload))
         return {"payload": payload, "mac": mac}
 
     def process_server_hello(self, server_msg: dict) -> HandshakeKeys:
         """Validate the server response and derive session keys."""
         payload = server_msg["payload"]
+        if payload.get("reject"):
+            raise ValueError("Server rejected session resumption")
         mac = server_msg["mac"]
-        expected = hmac_sha256(self.psk, self._serialize(payload))
-        if expected != mac:
-            raise ValueError("Server authentication failed")
-        shared = derive_shared(payload["pub"], self.priv)
         nonces = self.nonce + payload["nonce"]
-        return self._derive_keys(shared, nonces)
-
-    def _serialize(self, payload: dict) -> bytes:
-        """Serialize the role/public key/nonce tuple for HMAC coverage."""
-        return (
-            payload["role"].encode()
-            + payload["pub"].to_bytes(256, "big")
-            + payload["nonce"]
-        )
+        if self.resuming is not None:
+            if "pub" in payload:
+                raise ValueError("Unexpected full handshake reply to resumption")
+            expected = hmac_sha256(
+                binder_key(self.resuming.secret), self._serialize(payload)
+            )
+            if expected != mac:
+                raise ValueError("Server authentication failed")
+            keys = self._derive_keys(self.resuming.secret, nonces)
+        else:
+            expected = hmac_sha256(self.psk, self._serialize(payload))
+            if expected != mac:
+                raise ValueError("Server authentication failed")
+            shared = derive_shared(payload["pub"], self.priv)
+            keys = self._derive_keys(shared, nonces)
+        keys.options = payload.get("options", {})
+        if any(name not in self.options for name in keys.options):
+            raise ValueError("Server agreed to an option that was not offered")
+        if "ticket" in payload:
+            self.ticket = ResumptionTicket(
+                ticket=payload["ticket"], secret=keys.resumption_secret
+            )
+        return keys
+
+    def build_resume_hello(self, state: ResumptionTicket) -> dict:
+        """Return a ClientHello that resumes a previous session from a ticket."""
+        self.resuming = state
+        payload = {
+            "role": "client",
+            "nonce": self.nonce,
+            "ticket": state.ticket,
+        }
+        if self.options:
+            payload["options"] = self.options
+        mac = hmac_sha256(binder_key(state.secret), self._serialize(payload))
+        return {"payload": payload, "mac": mac}
 
 
 class HandshakeServer(HandshakeParticipant):
+    def __init__(
+        self,
+        psk: bytes,
+        *,
+        private_key: int | None = None,
+        nonce: bytes | None = None,
+        ticket_issuer: TicketIssuer | None = None,
+        options: dict[str, int] | None = None,
+    ):
+        """Prepare the server role, optionally issuing resumption tickets."""
+        super().__init__(psk, private_key=private_key, nonce=nonce, options=options)
+        self.ticket_issuer = ticket_issuer
+
     def process_client_hello(self, client_msg: dict) -> tuple[dict, HandshakeKeys]:
         """Validate ClientHello, derive keys, and craft ServerHello reply."""
         payload = client_msg["payload"]
         mac = client_msg["mac"]
+        if "ticket" in payload:
+            return self._process_resume_hello(payload, mac)
         expected = hmac_sha256(self.psk, self._serialize(payload))
         if expected != mac:
             raise ValueError("Client authentication failed")
@@ -107,13 +179,44 @@ class HandshakeServer(HandshakeParticipant):
             "pub": self.pub,
             "nonce": self.nonce,
         }
+        if self.ticket_issuer is not None:
+            response_payload["ticket"] = self.ticket_issuer.issue(
+                keys.resumption_secret
+            )
+        self._agree_options(payload, response_payload, keys)
         response_mac = hmac_sha256(self.psk, self._serialize(response_payload))
         return {"payload": response_payload, "mac": response_mac}, keys
 
-    def _serialize(self, payload: dict) -> bytes:
-        """Serialize payload to keep MAC inputs consistent."""
-        return (
-            payload["role"].encode()
-            + payload["pub"].to_bytes(256, "big")
-            + payload["nonce"]
-        )
+    def _process_resume_hello(
+        self, payload: dict, mac: bytes
+    ) -> tuple[dict, HandshakeKeys]:
+        """Redeem a ticket and derive fresh keys without any modexp."""
+        if self.ticket_issuer is None:
+            raise ValueError("Session resumption is not enabled")
+        opened = self.ticket_issuer.open(payload["ticket"])
+        secret = opened.secret
+        mac_key = binder_key(secret)
+        if hmac_sha256(mac_key, self._serialize(payload)) != mac:
+            raise ValueError("Client authentication failed")
+        # Spend the ticket only once the binder proves the client holds it.
+        self.ticket_issuer.commit(opened)
+
+        nonces = payload["nonce"] + self.nonce
+        keys = self._derive_keys(secret, nonces)
+        response_payload = {
+            "role": "server",
+            "nonce": self.nonce,
+            "ticket": self.ticket_issuer.issue(keys.resumption_secret),
+        }
+        self._agree_options(payload, response_payload, keys)
+        response_mac = hmac_sha256(mac_key, self._serialize(response_payload))
+        return {"payload": response_payload, "mac": response_mac}, keys
+
+    def _agree_options(
+        self, payload: dict, response_payload: dict, keys: HandshakeKeys
+    ) -> None:
+        """Answer the client's option offer and record the agreed values."""
+        agreed = negotiate(payload.get("options", {}), self.options)
+        if agreed:
+            response_payload["options"] = agreed
+        keys.options = agreed
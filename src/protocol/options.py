@@ -0,0 +1,84 @@
+"""Session options carried (and authenticated) inside the handshake.
+
+Options are a small ``{name: u32}`` mapping.  The client offers values, the
+server answers with the agreed value for every option it understands, using
+the negotiation rule registered for that option name.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import Callable
+
+_ENTRY = struct.Struct("!B")
+_VALUE = struct.Struct("!I")
+MAX_OPTIONS = 32
+
+
+def _lowest_common_bit(offered: int, supported: int) -> int:
+    """Pick the preferred (lowest) algorithm bit both sides support."""
+    common = offered & supported
+    return common & -common
+
+
+def _smaller_group(offered: int, supported: int) -> int:
+    """Agree on the smaller FEC group and parity count; 0 disables FEC."""
+    data = min(offered >> 8, supported >> 8)
+    parity = min(offered & 0xFF, supported & 0xFF)
+    return (data << 8) | parity if data and parity else 0
+
+
+def _smaller_value(offered: int, supported: int) -> int:
+    """Agree on the smaller of two limits."""
+    return min(offered, supported)
+
+
+# Negotiation rule per option: (client offer, server setting) -> agreed value.
+NEGOTIATORS: dict[str, Callable[[int, int], int]] = {
+    "compression": _lowest_common_bit,
+    "fec": _smaller_group,
+    "mtu": _smaller_value,
+}
+
+
+def negotiate(offered: dict[str, int], supported: dict[str, int]) -> dict[str, int]:
+    """Return the agreed value for each offered option the server supports."""
+    agreed = {}
+    for name, value in offered.items():
+        rule = NEGOTIATORS.get(name)
+        if rule is not None and name in supported:
+            agreed[name] = rule(value, supported[name])
+    return agreed
+
+
+def encode_options(options: dict[str, int]) -> bytes:
+    """Serialize options canonically (sorted by name) for wire and MAC use."""
+    parts = []
+    for name in sorted(options):
+        raw = name.encode("ascii")
+        parts.append(_ENTRY.pack(len(raw)) + raw + _VALUE.pack(options[name]))
+    return b"".join(parts)
+
+
+def decode_options(blob: bytes) -> dict[str, int]:
+    """Parse an options block, rejecting malformed or duplicate entries."""
+    view = memoryview(blob)
+    options: dict[str, int] = {}
+    offset = 0
+    while offset < len(view):
+        if len(options) >= MAX_OPTIONS:
+            raise ValueError("Too many handshake options")
+        (name_len,) = _ENTRY.unpack_from(view, offset)
+        offset += _ENTRY.size
+        end = offset + name_len
+        if name_len == 0 or end + _VALUE.size > len(view):
+            raise ValueError("Truncated handshake option")
+        try:
+            name = bytes(view[offset:end]).decode("ascii")
+        except UnicodeDecodeError:
+            raise ValueError("Invalid handshake option name") from None
+        if name in options:
+            raise ValueError(f"Duplicate handshake option {name}")
+        (options[name],) = _VALUE.unpack_from(view, end)
+        offset = end + _VALUE.size
+    return options
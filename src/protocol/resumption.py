@@ -0,0 +1,158 @@
+"""Encrypted session resumption tickets and a bounded anti-replay cache."""
+
+from __future__ import annotations
+
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+from ..crypto.chacha20_poly1305 import (
+    chacha20_poly1305_decrypt,
+    chacha20_poly1305_encrypt,
+)
+from ..crypto.hmac_sha256 import hkdf_expand
+
+TICKET_KEY_SIZE = 32
+SECRET_SIZE = 32
+
+_TICKET_AAD = b"cryptotunnel resumption ticket v1"
+_TICKET_NONCE_SIZE = 12
+_TICKET_TIMES = struct.Struct("!dd")
+TICKET_SIZE = _TICKET_NONCE_SIZE + _TICKET_TIMES.size + SECRET_SIZE + 16
+
+
+@dataclass
+class ResumptionTicket:
+    """Client-side view of a ticket: the opaque blob plus its secret."""
+
+    ticket: bytes
+    secret: bytes
+
+
+@dataclass
+class OpenedTicket:
+    """Server-side view of a decrypted ticket that is not yet spent."""
+
+    nonce: bytes
+    issued_at: float
+    expires_at: float
+    secret: bytes
+
+
+def binder_key(secret: bytes) -> bytes:
+    """Derive the MAC key that proves possession of a resumption secret."""
+    return hkdf_expand(secret, b"resumption binder", 32)
+
+
+def encode_ticket_state(state: ResumptionTicket) -> bytes:
+    """Serialize a client ticket so it can be stored between runs."""
+    return state.secret + state.ticket
+
+
+def decode_ticket_state(blob: bytes) -> ResumptionTicket:
+    """Parse a ticket previously written with ``encode_ticket_state``."""
+    if len(blob) != SECRET_SIZE + TICKET_SIZE:
+        raise ValueError("Malformed resumption ticket state")
+    return ResumptionTicket(ticket=blob[SECRET_SIZE:], secret=blob[:SECRET_SIZE])
+
+
+class TicketIssuer:
+    """Seal resumption secrets into tickets and redeem each one at most once.
+
+    Tickets are ChaCha20-Poly1305 encrypted under a server-only key, so the
+    server keeps no per-client state until a ticket is presented.  Redeemed
+    ticket nonces are remembered until they expire; when the cache is full the
+    oldest entry is evicted and every ticket issued before it is rejected, so
+    a bounded cache never re-opens a replay window.
+    """
+
+    def __init__(
+        self,
+        *,
+        key: bytes | None = None,
+        lifetime: float = 300.0,
+        replay_cache_size: int = 4096,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Create an issuer with a random or caller-supplied ticket key."""
+        if key is None:
+            key = os.urandom(TICKET_KEY_SIZE)
+        if len(key) != TICKET_KEY_SIZE:
+            raise ValueError("Ticket key must be 32 bytes")
+        if replay_cache_size < 1:
+            raise ValueError("Replay cache must hold at least one ticket")
+        self._key = key
+        self.lifetime = lifetime
+        self.replay_cache_size = replay_cache_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._seen: OrderedDict[bytes, tuple[float, float]] = OrderedDict()
+        self._reject_before = float("-inf")
+
+    def issue(self, secret: bytes) -> bytes:
+        """Encrypt the resumption secret with its validity window."""
+        if len(secret) != SECRET_SIZE:
+            raise ValueError("Resumption secret must be 32 bytes")
+        issued_at = self._clock()
+        nonce = os.urandom(_TICKET_NONCE_SIZE)
+        plaintext = _TICKET_TIMES.pack(issued_at, issued_at + self.lifetime) + secret
+        ciphertext, tag = chacha20_poly1305_encrypt(
+            self._key, nonce, plaintext, _TICKET_AAD
+        )
+        return nonce + ciphertext + tag
+
+    def open(self, ticket: bytes) -> OpenedTicket:
+        """Decrypt and check a ticket without spending it.
+
+        The ticket travels in clear, so only ``commit`` it once the client
+        has proven possession of its secret; otherwise anyone who saw it
+        could burn it with a forged hello.
+        """
+        if len(ticket) != TICKET_SIZE:
+            raise ValueError("Malformed resumption ticket")
+        nonce = ticket[:_TICKET_NONCE_SIZE]
+        plaintext = chacha20_poly1305_decrypt(
+            self._key, nonce, ticket[_TICKET_NONCE_SIZE:-16], _TICKET_AAD, ticket[-16:]
+        )
+        issued_at, expires_at = _TICKET_TIMES.unpack(plaintext[: _TICKET_TIMES.size])
+        opened = OpenedTicket(
+            nonce, issued_at, expires_at, plaintext[_TICKET_TIMES.size :]
+        )
+        with self._lock:
+            self._check(opened, self._clock())
+        return opened
+
+    def commit(self, opened: OpenedTicket) -> None:
+        """Spend an opened ticket so it cannot be redeemed again."""
+        with self._lock:
+            self._check(opened, self._clock())
+            self._seen[opened.nonce] = (opened.issued_at, opened.expires_at)
+            while len(self._seen) > self.replay_cache_size:
+                _, (evicted_issued_at, _) = self._seen.popitem(last=False)
+                self._reject_before = max(self._reject_before, evicted_issued_at)
+
+    def redeem(self, ticket: bytes) -> bytes:
+        """Return the secret sealed in a ticket, rejecting reuse and expiry."""
+        opened = self.open(ticket)
+        self.commit(opened)
+        return opened.secret
+
+    def _check(self, opened: OpenedTicket, now: float) -> None:
+        """Reject an expired or already spent ticket."""
+        if now >= opened.expires_at:
+            raise ValueError("Resumption ticket expired")
+        self._purge_expired(now)
+        if opened.issued_at <= self._reject_before or opened.nonce in self._seen:
+            raise ValueError("Resumption ticket replayed")
+
+    def _purge_expired(self, now: float) -> None:
+        """Drop leading cache entries whose tickets can no longer be used."""
+        while self._seen:
+            nonce, (_, expires_at) = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            del self._seen[nonce]
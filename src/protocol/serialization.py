@@ -1,29 +1,185 @@
-"""Helper utilities to serialize handshake messages over the network."""
+"""Helper utilities to serialize handshake messages over the network.
+
+The default wire format is a compact, versioned binary layout::
+
+    magic (1) | version (1) | message type (1) | DH group id (1)
+    followed by the type's fields, each prefixed with a big-endian u16 length
+
+The original JSON/hex encoding is still available with ``legacy_json=True``
+for peers that predate the binary format.
+"""
 
 from __future__ import annotations
 
 import json
+import struct
+
+from .diffie_hellman import P
+from .options import decode_options, encode_options
+from .resumption import TICKET_SIZE
+
+MAGIC = 0xC7
+VERSION = 1
+GROUP_MODP_2048 = 14
+
+MSG_CLIENT_HELLO = 1
+MSG_SERVER_HELLO = 2
+MSG_RESUME_HELLO = 3
+MSG_RESUME_REPLY = 4
+MSG_REJECT = 5
+
+_HEADER = struct.Struct("!BBBB")
+_LENGTH = struct.Struct("!H")
+
+# Field order per message type; optional fields may be sent with length 0.
+_LAYOUTS = {
+    MSG_CLIENT_HELLO: ("pub", "nonce", "options?", "mac"),
+    MSG_SERVER_HELLO: ("pub", "nonce", "ticket?", "options?", "mac"),
+    MSG_RESUME_HELLO: ("nonce", "ticket", "options?", "mac"),
+    MSG_RESUME_REPLY: ("nonce", "ticket", "options?", "mac"),
+    MSG_REJECT: (),
+}
+
+_FIELD_SIZES = {
+    "pub": 256,
+    "nonce": 12,
+    "ticket": TICKET_SIZE,
+    "mac": 32,
+}
+
+
+def _message_type(msg: dict) -> int:
+    """Infer the wire message type from the fields present in the payload."""
+    payload = msg["payload"]
+    if payload.get("reject"):
+        return MSG_REJECT
+    if payload["role"] == "client":
+        return MSG_RESUME_HELLO if "ticket" in payload else MSG_CLIENT_HELLO
+    return MSG_SERVER_HELLO if "pub" in payload else MSG_RESUME_REPLY
+
+
+def encode_handshake_message(msg: dict, *, legacy_json: bool = False) -> bytes:
+    """Serialize a handshake message for network transport."""
+    if legacy_json:
+        return _encode_json(msg)
+    msg_type = _message_type(msg)
+    payload = msg["payload"]
+    parts = [_HEADER.pack(MAGIC, VERSION, msg_type, GROUP_MODP_2048)]
+    for field in _LAYOUTS[msg_type]:
+        name = field.rstrip("?")
+        if name == "mac":
+            value = msg["mac"]
+        elif name == "pub":
+            value = payload["pub"].to_bytes(256, "big")
+        elif name == "options":
+            value = encode_options(payload.get("options", {}))
+        else:
+            value = payload.get(name, b"")
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(value)
+    return b"".join(parts)
+
+
+def encode_handshake_reject(*, legacy_json: bool = False) -> bytes:
+    """Serialize the server's refusal of a resumption attempt."""
+    return encode_handshake_message(
+        {"payload": {"role": "server", "reject": True}, "mac": b""},
+        legacy_json=legacy_json,
+    )
+
+
+def decode_handshake_message(blob: bytes, *, legacy_json: bool = False) -> dict:
+    """Decode a handshake message into the original dictionary.
+
+    Any malformed input raises ``ValueError``.
+    """
+    if legacy_json:
+        return _decode_json(blob)
+    view = memoryview(blob)
+    if len(view) < _HEADER.size:
+        raise ValueError("Truncated handshake message")
+    magic, version, msg_type, group = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a handshake message")
+    if version != VERSION:
+        raise ValueError(f"Unsupported handshake version {version}")
+    if group != GROUP_MODP_2048:
+        raise ValueError(f"Unsupported Diffie-Hellman group {group}")
+    layout = _LAYOUTS.get(msg_type)
+    if layout is None:
+        raise ValueError(f"Unknown handshake message type {msg_type}")
+
+    fields = {}
+    offset = _HEADER.size
+    for field in layout:
+        if offset + _LENGTH.size > len(view):
+            raise ValueError("Truncated handshake message")
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        end = offset + length
+        if end > len(view):
+            raise ValueError("Truncated handshake message")
+        name = field.rstrip("?")
+        if name == "options":
+            if length:
+                fields[name] = decode_options(view[offset:end])
+        elif not (field.endswith("?") and length == 0):
+            if length != _FIELD_SIZES[name]:
+                raise ValueError(f"Invalid handshake field length for {name}")
+            fields[name] = bytes(view[offset:end])
+        offset = end
+    if offset != len(view):
+        raise ValueError("Trailing bytes after handshake message")
+
+    if msg_type == MSG_REJECT:
+        return {"payload": {"role": "server", "reject": True}, "mac": b""}
+    role = "client" if msg_type in (MSG_CLIENT_HELLO, MSG_RESUME_HELLO) else "server"
+    payload = {"role": role, "nonce": fields["nonce"]}
+    if "pub" in fields:
+        pub = int.from_bytes(fields["pub"], "big")
+        if not 1 < pub < P - 1:
+            raise ValueError("Invalid Diffie-Hellman public value")
+        payload["pub"] = pub
+    if "ticket" in fields:
+        payload["ticket"] = fields["ticket"]
+    if "options" in fields:
+        payload["options"] = fields["options"]
+    return {"payload": payload, "mac": fields["mac"]}
 
 
-def encode_handshake_message(msg: dict) -> bytes:
-    """Serialize a handshake message as JSON/hex for network transport."""
+def _encode_json(msg: dict) -> bytes:
+    """Serialize a handshake message as JSON/hex (legacy format)."""
     payload = msg["payload"]
+    if payload.get("reject"):
+        return json.dumps({"role": payload["role"], "reject": True}).encode("utf-8")
     data = {
         "role": payload["role"],
-        "pub": payload["pub"].to_bytes(256, "big").hex(),
         "nonce": payload["nonce"].hex(),
         "mac": msg["mac"].hex(),
     }
+    if "pub" in payload:
+        data["pub"] = payload["pub"].to_bytes(256, "big").hex()
+    if "ticket" in payload:
+        data["ticket"] = payload["ticket"].hex()
+    if "options" in payload:
+        data["options"] = payload["options"]
     return json.dumps(data).encode("utf-8")
 
 
-def decode_handshake_message(blob: bytes) -> dict:
-    """Decode JSON/hex handshake message into the original dictionary."""
+def _decode_json(blob: bytes) -> dict:
+    """Decode JSON/hex handshake message (legacy format)."""
     data = json.loads(blob.decode("utf-8"))
+    if data.get("reject"):
+        return {"payload": {"role": data["role"], "reject": True}, "mac": b""}
     payload = {
         "role": data["role"],
-        "pub": int(data["pub"], 16),
         "nonce": bytes.fromhex(data["nonce"]),
     }
+    if "pub" in data:
+        payload["pub"] = int(data["pub"], 16)
+    if "ticket" in data:
+        payload["ticket"] = bytes.fromhex(data["ticket"])
+    if "options" in data:
+        payload["options"] = data["options"]
     mac = bytes.fromhex(data["mac"])
     return {"payload": payload, "mac": mac}
@@ -3,17 +3,53 @@
 from __future__ import annotations
 
 import argparse
+import mmap
+import os
 import socket
+import time
+from functools import partial
 
 from ..protocol.handshake import HandshakeClient
+from ..protocol.resumption import decode_ticket_state, encode_ticket_state
 from ..protocol.serialization import (
     decode_handshake_message,
     encode_handshake_message,
 )
-from .tunnel import SecureTunnel, SessionKeys
+from .compression import compressor_for, parse_algorithms
+from .delta import send_file_delta
+from .fec import fec_for, parse_fec
+from .forwarder import forward_tun
+from .metrics import MetricsRegistry, TunnelMetrics, handshake_timer, serve_metrics
+from .pmtu import MIN_DATAGRAM, ChunkSizer, max_chunk_size, probe_path_mtu
+from .prefetch import PrefetchPolicy
+from .profiling import (
+    SPAN_HANDSHAKE,
+    SpanTracer,
+    add_arguments as add_profiling_arguments,
+    profiling,
+    traced,
+    tracer_from_args,
+)
+from .resumable import send_file_resumable
+from .scheduler import SendScheduler
+from .tunnel import (
+    FRAME_CLOSE,
+    FRAME_DATA,
+    FRAME_END,
+    FRAME_OPEN,
+    CoalescePolicy,
+    RekeyPolicy,
+    SecureTunnel,
+    SessionKeys,
+    StreamMetadata,
+    encode_data_body,
+)
 
 
 CHUNK_SIZE = 2048
+MAX_STREAMS_IN_FLIGHT = 4
+# Chunks read ahead into each stream's scheduler queue.
+STREAM_QUEUE_DEPTH = 8
 
 
 def load_psk(path: str) -> bytes:
@@ -22,30 +58,360 @@ def load_psk(path: str) -> bytes:
         return handle.read()
 
 
-def perform_handshake(sock: socket.socket, psk: bytes) -> SessionKeys:
-    """Execute client-side handshake over the given socket."""
-    client = HandshakeClient(psk)
-    message = encode_handshake_message(client.build_hello())
-    sock.sendall(message)
-    response = sock.recv(4096)
-    server_msg = decode_handshake_message(response)
-    keys = client.process_server_hello(server_msg)
+def _exchange_hello(
+    sock: socket.socket,
+    client: HandshakeClient,
+    hello: dict,
+    legacy_json: bool,
+    metrics: MetricsRegistry | None = None,
+):
+    """Send one ClientHello and process the server's answer."""
+    with handshake_timer(metrics, "round_trip"):
+        sock.sendall(encode_handshake_message(hello, legacy_json=legacy_json))
+        response = sock.recv(4096)
+    with handshake_timer(metrics, "client_finish"):
+        server_msg = decode_handshake_message(response, legacy_json=legacy_json)
+        return client.process_server_hello(server_msg)
+
+
+def _load_ticket(path: str | None):
+    """Return the stored resumption ticket, or None when unusable."""
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as handle:
+        try:
+            return decode_ticket_state(handle.read())
+        except ValueError:
+            return None
+
+
+def _store_ticket(path: str, client: HandshakeClient) -> None:
+    """Persist the newest ticket (or drop a spent one) for the next run."""
+    if client.ticket is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(encode_ticket_state(client.ticket))
+
+
+def perform_handshake(
+    sock: socket.socket,
+    psk: bytes,
+    *,
+    ticket_file: str | None = None,
+    legacy_json: bool = False,
+    options: dict[str, int] | None = None,
+    metrics: MetricsRegistry | None = None,
+) -> SessionKeys:
+    """Execute client-side handshake, resuming from a stored ticket if possible.
+
+    With a ``metrics`` registry the hello construction, the network round
+    trip and the processing of the reply are timed separately.
+    """
+    keys = None
+    state = _load_ticket(ticket_file)
+    if state is not None:
+        client = HandshakeClient(psk, options=options)
+        with handshake_timer(metrics, "client_hello"):
+            hello = client.build_resume_hello(state)
+        try:
+            keys = _exchange_hello(sock, client, hello, legacy_json, metrics)
+        except ValueError:
+            keys = None
+    if keys is None:
+        client = HandshakeClient(psk, options=options)
+        with handshake_timer(metrics, "client_hello"):
+            hello = client.build_hello()
+        keys = _exchange_hello(sock, client, hello, legacy_json, metrics)
+    if ticket_file is not None:
+        _store_ticket(ticket_file, client)
     return SessionKeys(
         enc_key=keys.client_enc,
         mac_key=keys.client_mac,
         base_nonce=keys.base_nonce,
+        options=keys.options,
+        recv_key=keys.server_enc,
     )
 
 
-def send_file(tunnel: SecureTunnel, path: str) -> None:
-    """Read a file and stream its contents through the encrypted tunnel."""
-    with open(path, "rb") as handle:
+class _MappedFile:
+    """Read-only memory map of a file handing out zero-copy chunk views."""
+
+    def __init__(self, path: str, sizer: ChunkSizer | None = None):
+        """Open and map the file (empty files are not mapped).
+
+        Chunks are ``CHUNK_SIZE`` bytes unless a ``sizer`` adapts them.
+        """
+        self._sizer = sizer
+        self._handle = open(path, "rb")
+        self.info = os.fstat(self._handle.fileno())
+        self._map = None
+        if self.info.st_size:
+            self._map = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._chunks = self._iter_chunks()
+
+    def _iter_chunks(self):
+        if self._map is None:
+            return
+        with memoryview(self._map) as view:
+            offset = 0
+            while offset < len(view):
+                size = CHUNK_SIZE if self._sizer is None else self._sizer.size
+                # Each slice is released as soon as the caller asks for the next.
+                with view[offset : offset + size] as chunk:
+                    yield offset, chunk
+                offset += size
+
+    def next_chunk(self):
+        """Return ``(offset, memoryview)`` for the next chunk, or None at EOF."""
+        return next(self._chunks, None)
+
+    def close(self) -> None:
+        """Release the views, the mapping and the file handle."""
+        self._chunks.close()
+        if self._map is not None:
+            self._map.close()
+        self._handle.close()
+
+    def __enter__(self) -> "_MappedFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _open_stream(
+    tunnel: SecureTunnel,
+    stream_id: int,
+    path: str,
+    name: str,
+    sizer: ChunkSizer | None = None,
+) -> _MappedFile:
+    """Announce a file on a new stream and return its mapping."""
+    mapped = _MappedFile(path, sizer)
+    tunnel.send_frame(FRAME_OPEN, stream_id, _stream_metadata(mapped, name))
+    return mapped
+
+
+def _stream_metadata(mapped: _MappedFile, name: str) -> bytes:
+    """Encode the FRAME_OPEN body describing a mapped file."""
+    metadata = StreamMetadata(
+        path=name, size=mapped.info.st_size, mode=mapped.info.st_mode
+    )
+    return metadata.encode()
+
+
+def _send_chunk(
+    tunnel: SecureTunnel, stream_id: int, item, sizer: ChunkSizer | None
+) -> None:
+    """Send one mapped chunk, feeding its send time to the sizer."""
+    if sizer is None:
+        tunnel.send_data(stream_id, *item)
+        return
+    start = time.perf_counter()
+    tunnel.send_data(stream_id, *item)
+    sizer.record(len(item[1]), time.perf_counter() - start)
+
+
+def send_file(
+    tunnel: SecureTunnel, path: str, sizer: ChunkSizer | None = None
+) -> None:
+    """Map a file and stream its contents through the encrypted tunnel."""
+    with _open_stream(tunnel, 1, path, os.path.basename(path), sizer) as mapped:
         while True:
-            chunk = handle.read(CHUNK_SIZE)
-            if not chunk:
+            item = mapped.next_chunk()
+            if item is None:
                 break
-            tunnel.send_packet(chunk)
-    tunnel.send_packet(b"END")
+            _send_chunk(tunnel, 1, item, sizer)
+    tunnel.send_frame(FRAME_END, 1)
+    tunnel.send_frame(FRAME_CLOSE, 0)
+
+
+def _walk_files(root: str) -> list[str]:
+    """List regular files below root as sorted, '/'-separated relative paths."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            full = os.path.join(dirpath, name)
+            if os.path.isfile(full) and not os.path.islink(full):
+                found.append(os.path.relpath(full, root).replace(os.sep, "/"))
+    return found
+
+
+def _data_sender(tunnel: SecureTunnel, stream_id: int, sizer: ChunkSizer | None):
+    """Return a scheduler send callable for one stream's FRAME_DATA bodies."""
+
+    def send(body: bytes) -> None:
+        start = time.perf_counter()
+        tunnel.send_frame(FRAME_DATA, stream_id, body)
+        if sizer is not None:
+            sizer.record(len(body), time.perf_counter() - start)
+
+    return send
+
+
+def send_directory(
+    tunnel: SecureTunnel,
+    root: str,
+    *,
+    max_in_flight: int = MAX_STREAMS_IN_FLIGHT,
+    sizer: ChunkSizer | None = None,
+    scheduler: SendScheduler | None = None,
+    weights: dict[str, float] | None = None,
+) -> int:
+    """Send every file below root, interleaving up to max_in_flight streams.
+
+    Each stream is a flow of ``scheduler`` named ``"<stream id>:<path>"``;
+    ``weights``, keyed by relative path, split the tunnel between concurrent
+    files. FRAME_OPEN goes out as a control packet ahead of queued data.
+    """
+    if scheduler is None:
+        scheduler = SendScheduler(quantum=CHUNK_SIZE)
+    weights = weights or {}
+    pending = iter(_walk_files(root))
+    # Streams still being read, and the flow of every stream not yet ended.
+    active: dict[int, _MappedFile] = {}
+    flows: dict[int, str] = {}
+    finished: set[int] = set()
+    next_id = 1
+    sent = 0
+
+    def open_next() -> None:
+        nonlocal next_id
+        name = next(pending, None)
+        if name is None:
+            return
+        mapped = _MappedFile(os.path.join(root, *name.split("/")), sizer)
+        stream_id = next_id
+        next_id += 1
+        active[stream_id] = mapped
+        flow = f"{stream_id}:{name}"
+        scheduler.add_flow(
+            flow,
+            _data_sender(tunnel, stream_id, sizer),
+            weight=weights.get(name, 1.0),
+            limit=STREAM_QUEUE_DEPTH,
+        )
+        flows[stream_id] = flow
+        scheduler.submit_control(
+            _stream_metadata(mapped, name),
+            partial(tunnel.send_frame, FRAME_OPEN, stream_id),
+        )
+
+    for _ in range(max_in_flight):
+        open_next()
+    try:
+        while flows:
+            for stream_id, mapped in list(active.items()):
+                name = flows[stream_id]
+                while scheduler.queued(name) < STREAM_QUEUE_DEPTH:
+                    item = mapped.next_chunk()
+                    if item is None:
+                        active.pop(stream_id).close()
+                        # Queued behind the stream's data, so it stays last.
+                        scheduler.submit(
+                            name, b"", partial(tunnel.send_frame, FRAME_END, stream_id)
+                        )
+                        finished.add(stream_id)
+                        open_next()
+                        break
+                    scheduler.submit(name, encode_data_body(*item))
+            # Refilled queues never run dry mid-round, so weights hold.
+            scheduler.dispatch(STREAM_QUEUE_DEPTH // 2)
+            for stream_id in list(finished):
+                if scheduler.queued(flows[stream_id]) == 0:
+                    scheduler.remove_flow(flows.pop(stream_id))
+                    finished.discard(stream_id)
+                    sent += 1
+    finally:
+        for mapped in active.values():
+            mapped.close()
+        for name in flows.values():
+            scheduler.remove_flow(name)
+    tunnel.send_frame(FRAME_CLOSE, 0)
+    return sent
+
+
+def _run(args: argparse.Namespace, tracer: SpanTracer | None) -> None:
+    """Perform the handshake and transfer selected on the command line."""
+    psk = load_psk(args.psk_file)
+    registry = MetricsRegistry()
+    if args.metrics_port is not None:
+        serve_metrics(registry, args.metrics_host, args.metrics_port)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((args.server_host, args.server_port))
+
+    offer = {}
+    if args.compression:
+        offer["compression"] = parse_algorithms(args.compression)
+    if args.fec:
+        offer["fec"] = parse_fec(args.fec)
+    if args.mtu:
+        offer["mtu"] = args.mtu
+    with traced(tracer, SPAN_HANDSHAKE):
+        session_keys = perform_handshake(
+            sock,
+            psk,
+            ticket_file=args.ticket_file,
+            legacy_json=args.json_handshake,
+            options=offer,
+            metrics=registry,
+        )
+    rekey = None
+    if args.rekey_packets or args.rekey_bytes or args.rekey_seconds:
+        rekey = RekeyPolicy(
+            max_packets=args.rekey_packets,
+            max_bytes=args.rekey_bytes,
+            max_age=args.rekey_seconds,
+        )
+    tunnel = SecureTunnel(
+        sock,
+        session_keys,
+        rekey=rekey,
+        compressor=compressor_for(session_keys.options),
+        metrics=TunnelMetrics(registry),
+        tracer=tracer,
+        prefetch=PrefetchPolicy(args.prefetch_bytes) if args.prefetch_bytes else None,
+        # The forwarder flushes after each burst it reads from the device.
+        coalesce=CoalescePolicy(max_delay=None) if args.tun else None,
+    )
+    tunnel = fec_for(tunnel, session_keys.options)
+    sizer = None
+    streaming = not (args.resumable or args.delta or args.tun)
+    if "mtu" in session_keys.options and streaming:
+        probe = probe_path_mtu(tunnel)
+        sizer = ChunkSizer(max_chunk_size(tunnel, probe.datagram_size))
+        sizer.record_loss(probe.probes_sent - probe.probes_acked, probe.probes_sent)
+        print(
+            f"path MTU: {probe.datagram_size}-byte datagrams "
+            f"(agreed {tunnel.max_datagram}, probe loss {probe.loss:.0%})"
+        )
+    if args.tun:
+        forward_tun(tunnel, args.tun)
+    elif args.resumable:
+        send_file_resumable(tunnel, args.input_file, CHUNK_SIZE)
+    elif args.delta:
+        delta = send_file_delta(tunnel, args.input_file)
+        print(
+            f"delta: {delta.literal_bytes} literal bytes sent, "
+            f"{delta.copied_bytes} bytes reused from the server's copy"
+        )
+    elif args.input_dir:
+        send_directory(tunnel, args.input_dir, sizer=sizer)
+    else:
+        send_file(tunnel, args.input_file, sizer)
+    if tunnel.compressor is not None:
+        stats = tunnel.compressor.stats
+        print(
+            f"compression: {stats.bytes_in} -> {stats.bytes_out} bytes "
+            f"(ratio {stats.ratio:.2f}x, {stats.compressed_packets}/"
+            f"{stats.packets} packets compressed, {stats.cpu_seconds:.3f}s CPU)"
+        )
+    tunnel.close()
+    sock.close()
 
 
 def main() -> None:
@@ -54,17 +420,82 @@ def main() -> None:
     parser.add_argument("--server-host", required=True)
     parser.add_argument("--server-port", type=int, required=True)
     parser.add_argument("--psk-file", required=True)
-    parser.add_argument("--input-file", required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-file")
+    source.add_argument(
+        "--input-dir", help="Send every file below this directory"
+    )
+    source.add_argument(
+        "--tun",
+        metavar="NAME",
+        help="Forward IP packets of a new TUN interface, e.g. cryptotun%%d",
+    )
+    parser.add_argument(
+        "--ticket-file",
+        help="Store/reuse a session resumption ticket to skip Diffie-Hellman",
+    )
+    parser.add_argument(
+        "--json-handshake",
+        action="store_true",
+        help="Use the legacy JSON/hex handshake encoding",
+    )
+    parser.add_argument(
+        "--rekey-packets", type=int, help="Ratchet the key after N packets"
+    )
+    parser.add_argument(
+        "--rekey-bytes", type=int, help="Ratchet the key after N payload bytes"
+    )
+    parser.add_argument(
+        "--rekey-seconds", type=float, help="Ratchet the key after N seconds"
+    )
+    parser.add_argument(
+        "--compression",
+        default="",
+        help="Offer compression algorithms, e.g. zlib,lzma,bz2",
+    )
+    parser.add_argument(
+        "--mtu",
+        type=int,
+        default=0,
+        help="Offer datagrams up to N bytes, then probe the path and adapt chunks",
+    )
+    parser.add_argument(
+        "--fec",
+        default="",
+        help="Offer forward error correction as K:M (M parity per K packets)",
+    )
+    parser.add_argument(
+        "--resumable",
+        action="store_true",
+        help="Send a Merkle manifest and serve only the chunks the server lacks",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Send only the differences from the server's existing output file",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Expose Prometheus metrics on this port while the client runs",
+    )
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    parser.add_argument(
+        "--prefetch-bytes",
+        type=int,
+        default=0,
+        help="Precompute keystream for upcoming packets in up to N bytes",
+    )
+    add_profiling_arguments(parser)
     args = parser.parse_args()
-
-    psk = load_psk(args.psk_file)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.connect((args.server_host, args.server_port))
-
-    session_keys = perform_handshake(sock, psk)
-    tunnel = SecureTunnel(sock, session_keys)
-    send_file(tunnel, args.input_file)
-    sock.close()
+    if (args.input_dir or args.tun) and (args.resumable or args.delta):
+        parser.error("--resumable and --delta require --input-file")
+    if args.tun and args.fec:
+        parser.error("--fec applies to file transfers, not --tun")
+    if args.mtu and args.mtu < MIN_DATAGRAM:
+        parser.error(f"--mtu must be at least {MIN_DATAGRAM}")
+    with profiling(args.profile):
+        _run(args, tracer_from_args(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+"""Adaptive per-packet compression applied before encryption.
+
+The algorithm is negotiated in the handshake through the ``compression``
+option (a bitmask of the ids below).  Each packet carries a flag telling the
+receiver whether its payload was compressed, so the sender is free to skip
+compression whenever a sample shows the data does not shrink.
+"""
+
+from __future__ import annotations
+
+import bz2
+import lzma
+import time
+import zlib
+from dataclasses import dataclass
+
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSION_BZ2 = 4
+
+ALGORITHMS = {
+    "zlib": COMPRESSION_ZLIB,
+    "lzma": COMPRESSION_LZMA,
+    "bz2": COMPRESSION_BZ2,
+}
+
+# Upper bound on a decompressed payload, guarding against decompression bombs.
+MAX_DECOMPRESSED_SIZE = 1 << 16
+
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 1}]
+
+
+@dataclass
+class CompressionStats:
+    packets: int = 0
+    compressed_packets: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    cpu_seconds: float = 0.0
+
+    @property
+    def ratio(self) -> float:
+        """Input bytes per output byte (1.0 when nothing was saved)."""
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+
+def parse_algorithms(spec: str) -> int:
+    """Turn a comma-separated list such as ``"zlib,lzma"`` into a bitmask."""
+    mask = 0
+    for name in filter(None, (part.strip() for part in spec.split(","))):
+        if name not in ALGORITHMS:
+            raise ValueError(f"Unknown compression algorithm {name!r}")
+        mask |= ALGORITHMS[name]
+    return mask
+
+
+def compressor_for(options: dict[str, int]) -> "Compressor | None":
+    """Build the compressor agreed in the handshake, if any."""
+    algorithm = options.get("compression", 0)
+    return Compressor(algorithm) if algorithm else None
+
+
+class Compressor:
+    """Compress outgoing payloads adaptively and decompress incoming ones."""
+
+    def __init__(
+        self,
+        algorithm: int,
+        *,
+        level: int = 6,
+        sample_size: int = 512,
+        min_saving: float = 0.1,
+        backoff: int = 32,
+        min_size: int = 64,
+    ):
+        """Configure the codec and the incompressibility heuristic.
+
+        Payloads longer than ``sample_size`` are probed by compressing their
+        first ``sample_size`` bytes; if that saves less than ``min_saving``
+        the payload is sent raw and the next ``backoff`` payloads skip the
+        probe entirely.  Payloads below ``min_size`` (control frames) are
+        always sent raw, and payloads up to ``sample_size`` are compressed
+        when it pays off; neither says enough about the data to back off.
+        """
+        if algorithm not in ALGORITHMS.values():
+            raise ValueError(f"Unsupported compression algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.level = level
+        self.sample_size = sample_size
+        self.min_saving = min_saving
+        self.backoff = backoff
+        self.min_size = min_size
+        self.stats = CompressionStats()
+        self._skip = 0
+
+    def _pack(self, data: bytes) -> bytes:
+        if self.algorithm == COMPRESSION_ZLIB:
+            packer = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            return packer.compress(data) + packer.flush()
+        if self.algorithm == COMPRESSION_LZMA:
+            return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+        return bz2.compress(data, max(1, min(self.level, 9)))
+
+    def _worth_it(self, original: int, packed: int) -> bool:
+        return packed <= original * (1.0 - self.min_saving)
+
+    def compress(self, data: bytes) -> tuple[bool, bytes]:
+        """Return ``(compressed, payload)`` for one outgoing packet."""
+        start = time.thread_time()
+        compressed, result = False, data
+        if len(data) < self.min_size:
+            pass
+        elif len(data) <= self.sample_size:
+            packed = self._pack(data)
+            if self._worth_it(len(data), len(packed)):
+                compressed, result = True, packed
+        elif self._skip:
+            self._skip -= 1
+        else:
+            sample = data[: self.sample_size]
+            if not self._worth_it(len(sample), len(self._pack(sample))):
+                self._skip = self.backoff
+            else:
+                packed = self._pack(data)
+                if self._worth_it(len(data), len(packed)):
+                    compressed, result = True, packed
+                else:
+                    self._skip = self.backoff
+
+        stats = self.stats
+        stats.packets += 1
+        stats.compressed_packets += compressed
+        stats.bytes_in += len(data)
+        stats.bytes_out += len(result)
+        stats.cpu_seconds += time.thread_time() - start
+        return compressed, result
+
+    def decompress(self, data: bytes) -> bytes:
+        """Inflate a payload flagged as compressed, bounding its size."""
+        try:
+            if self.algorithm == COMPRESSION_ZLIB:
+                unpacker = zlib.decompressobj(-15)
+                result = unpacker.decompress(data, MAX_DECOMPRESSED_SIZE)
+                done = unpacker.eof and not unpacker.unconsumed_tail
+            elif self.algorithm == COMPRESSION_LZMA:
+                unpacker = lzma.LZMADecompressor(
+                    format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS
+                )
+                result = unpacker.decompress(data, MAX_DECOMPRESSED_SIZE)
+                done = unpacker.eof
+            else:
+                unpacker = bz2.BZ2Decompressor()
+                result = unpacker.decompress(data, MAX_DECOMPRESSED_SIZE)
+                done = unpacker.eof
+        except (zlib.error, lzma.LZMAError, OSError, EOFError) as exc:
+            raise ValueError("Corrupt compressed payload") from exc
+        if not done:
+            raise ValueError("Compressed payload is truncated or too large")
+        return result
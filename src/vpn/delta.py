@@ -0,0 +1,286 @@
+"""rsync-style delta transfer against a file the receiver already has.
+
+The receiver splits its current copy into fixed-size blocks and sends one
+signature per block: a rolling weak checksum plus a SHA-256 digest.  The
+sender slides a window over its file, confirms weak hits with SHA-256, and
+emits copy instructions for matched blocks and literal data for everything
+else, so the bytes encrypted and sent scale with how much actually changed.
+
+Both sides fold one digest per instruction (the block's SHA-256 for copies,
+a Merkle leaf hash for literals) into a Merkle root; the receiver only
+replaces its file once the roots and sizes agree.
+
+Messages (one per tunnel packet, big-endian)::
+
+    SIG_HEADER  type | block size u32 | blocks u32       (receiver -> sender)
+    SIGNATURES  type | first index u32 | (weak u32, sha256)...
+    COPY        type | first block u32 | blocks u32      (sender -> receiver)
+    LITERAL     type | data
+    END         type | file size u64 | Merkle root
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from typing import Iterator
+
+from ..crypto.merkle import leaf_hash, merkle_root
+from ..crypto.sha256 import LANE_BATCH, sha256, sha256_many
+from .pmtu import max_payload_size
+from .tunnel import SecureTunnel
+
+MSG_SIG_HEADER = 1
+MSG_SIGNATURES = 2
+MSG_COPY = 3
+MSG_LITERAL = 4
+MSG_END = 5
+
+_TYPE = struct.Struct("!B")
+_SIG_HEADER = struct.Struct("!BII")
+_INDEX = struct.Struct("!BI")
+_SIGNATURE = struct.Struct("!I32s")
+_COPY = struct.Struct("!BII")
+_END = struct.Struct("!BQ32s")
+
+SIGNATURES_PER_PACKET = 56
+MAX_LITERAL = 2048
+
+
+@dataclass
+class DeltaStats:
+    literal_bytes: int = 0
+    copied_bytes: int = 0
+    instructions: int = 0
+
+
+def weak_checksum(block: bytes) -> tuple[int, int]:
+    """Return the rsync (a, b) rolling checksum components of a block."""
+    a = b = 0
+    length = len(block)
+    for offset, byte in enumerate(block):
+        a += byte
+        b += (length - offset) * byte
+    return a & 0xFFFF, b & 0xFFFF
+
+
+def block_signatures(data: bytes, block_size: int) -> Iterator[tuple[int, bytes]]:
+    """Yield (weak, strong) signatures for every full block of data.
+
+    Blocks are copied and hashed ``LANE_BATCH`` at a time, so a large
+    memory-mapped basis is never held in memory as a whole.
+    """
+    end = len(data) - block_size + 1
+    step = block_size * LANE_BATCH
+    for first in range(0, max(end, 0), step):
+        blocks = [
+            data[start : start + block_size]
+            for start in range(first, min(first + step, end), block_size)
+        ]
+        for block, strong in zip(blocks, sha256_many(blocks)):
+            a, b = weak_checksum(block)
+            yield a | (b << 16), strong
+
+
+def compute_delta(
+    data: bytes,
+    block_size: int,
+    signatures: list[tuple[int, bytes]],
+    max_literal: int = MAX_LITERAL,
+) -> Iterator[tuple]:
+    """Yield ``("copy", first, count)`` and ``("literal", bytes)`` steps.
+
+    ``data`` may be any sliceable buffer (bytes or an mmap); literals are
+    split into pieces of at most ``max_literal`` bytes.
+    """
+    table: dict[int, list[tuple[bytes, int]]] = {}
+    for index, (weak, strong) in enumerate(signatures):
+        table.setdefault(weak, []).append((strong, index))
+
+    size = len(data)
+    literal_start = 0
+    pending: list[int] | None = None  # [first, count] of a run of copies
+    pos = 0
+    a = b = 0
+    if table and size >= block_size:
+        a, b = weak_checksum(data[:block_size])
+    while table and pos + block_size <= size:
+        match = None
+        candidates = table.get(a | (b << 16))
+        if candidates:
+            strong = sha256(data[pos : pos + block_size])
+            for candidate, index in candidates:
+                if candidate == strong:
+                    match = index
+                    break
+        if match is not None:
+            if literal_start < pos:
+                if pending:
+                    yield ("copy", pending[0], pending[1])
+                    pending = None
+                yield from _literals(data, literal_start, pos, max_literal)
+            if pending and pending[0] + pending[1] == match:
+                pending[1] += 1
+            else:
+                if pending:
+                    yield ("copy", pending[0], pending[1])
+                pending = [match, 1]
+            pos += block_size
+            literal_start = pos
+            if pos + block_size <= size:
+                a, b = weak_checksum(data[pos : pos + block_size])
+            continue
+        if pos + block_size < size:
+            outgoing = data[pos]
+            a = (a - outgoing + data[pos + block_size]) & 0xFFFF
+            b = (b - block_size * outgoing + a) & 0xFFFF
+        pos += 1
+    if pending:
+        yield ("copy", pending[0], pending[1])
+    yield from _literals(data, literal_start, size, max_literal)
+
+
+def _literals(data, start: int, end: int, max_literal: int) -> Iterator[tuple]:
+    for offset in range(start, end, max_literal):
+        yield ("literal", bytes(data[offset : min(offset + max_literal, end)]))
+
+
+def _recv(tunnel: SecureTunnel) -> bytes:
+    """Receive one message; timeouts propagate and abort the transfer."""
+    while True:
+        try:
+            message = tunnel.receive_packet()
+        except ValueError:
+            continue
+        if message:
+            return message
+
+
+def _receive_signatures(tunnel: SecureTunnel) -> tuple[int, list]:
+    header = None
+    received: dict[int, tuple[int, bytes]] = {}
+    while header is None or len(received) < header[1]:
+        message = _recv(tunnel)
+        if message[0] == MSG_SIG_HEADER and len(message) == _SIG_HEADER.size:
+            _, block_size, count = _SIG_HEADER.unpack(message)
+            if block_size == 0:
+                raise ValueError("Invalid delta block size")
+            header = (block_size, count)
+        elif message[0] == MSG_SIGNATURES and len(message) >= _INDEX.size:
+            _, first = _INDEX.unpack_from(message)
+            body = message[_INDEX.size :]
+            for offset in range(0, len(body) - _SIGNATURE.size + 1, _SIGNATURE.size):
+                index = first + offset // _SIGNATURE.size
+                received[index] = _SIGNATURE.unpack_from(body, offset)
+    block_size, count = header
+    if any(index not in received for index in range(count)):
+        raise ValueError("Delta signatures do not cover every block")
+    return block_size, [received[index] for index in range(count)]
+
+
+def send_file_delta(
+    tunnel: SecureTunnel, path: str, *, timeout: float = 10.0
+) -> DeltaStats:
+    """Wait for the receiver's signatures and stream the delta of ``path``."""
+    tunnel.sock.settimeout(timeout)
+    block_size, signatures = _receive_signatures(tunnel)
+    max_literal = min(MAX_LITERAL, max_payload_size(tunnel) - _TYPE.size)
+    stats = DeltaStats()
+    digests = []
+    with open(path, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            for step in compute_delta(data, block_size, signatures, max_literal):
+                if step[0] == "copy":
+                    _, first, count = step
+                    tunnel.send_packet(_COPY.pack(MSG_COPY, first, count))
+                    digests.extend(signatures[first + i][1] for i in range(count))
+                    stats.copied_bytes += count * block_size
+                else:
+                    literal = step[1]
+                    tunnel.send_packet(_TYPE.pack(MSG_LITERAL) + literal)
+                    digests.append(leaf_hash(literal))
+                    stats.literal_bytes += len(literal)
+                stats.instructions += 1
+        finally:
+            if size:
+                data.close()
+    tunnel.send_packet(_END.pack(MSG_END, size, merkle_root(digests)))
+    return stats
+
+
+def receive_file_delta(
+    tunnel: SecureTunnel,
+    output_path: str,
+    *,
+    block_size: int = 2048,
+    timeout: float = 10.0,
+) -> DeltaStats:
+    """Send signatures of ``output_path`` and rebuild it from the delta."""
+    tunnel.sock.settimeout(timeout)
+    tmp_path = output_path + ".delta"
+    basis_handle = open(output_path, "rb") if os.path.exists(output_path) else None
+    basis = b""
+    try:
+        if basis_handle is not None and os.fstat(basis_handle.fileno()).st_size:
+            basis = mmap.mmap(basis_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        signatures = list(block_signatures(basis, block_size))
+        tunnel.send_packet(
+            _SIG_HEADER.pack(MSG_SIG_HEADER, block_size, len(signatures))
+        )
+        room = max_payload_size(tunnel) - _INDEX.size
+        per_packet = max(1, min(SIGNATURES_PER_PACKET, room // _SIGNATURE.size))
+        for first in range(0, len(signatures), per_packet):
+            batch = signatures[first : first + per_packet]
+            body = b"".join(_SIGNATURE.pack(weak, strong) for weak, strong in batch)
+            tunnel.send_packet(_INDEX.pack(MSG_SIGNATURES, first) + body)
+        with open(tmp_path, "wb") as out:
+            stats = _apply_delta(tunnel, basis, block_size, signatures, out)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        if isinstance(basis, mmap.mmap):
+            basis.close()
+        if basis_handle is not None:
+            basis_handle.close()
+    os.replace(tmp_path, output_path)
+    return stats
+
+
+def _apply_delta(
+    tunnel: SecureTunnel, basis, block_size: int, signatures: list, out
+) -> DeltaStats:
+    """Write copy/literal instructions to ``out`` until a verified END."""
+    stats = DeltaStats()
+    digests = []
+    written = 0
+    while True:
+        message = _recv(tunnel)
+        if message[0] == MSG_COPY and len(message) == _COPY.size:
+            _, first, count = _COPY.unpack(message)
+            if first + count > len(signatures):
+                raise ValueError("Delta copy refers to an unknown block")
+            start = first * block_size
+            out.write(basis[start : start + count * block_size])
+            digests.extend(signatures[first + i][1] for i in range(count))
+            written += count * block_size
+            stats.copied_bytes += count * block_size
+        elif message[0] == MSG_LITERAL:
+            literal = message[_TYPE.size :]
+            out.write(literal)
+            digests.append(leaf_hash(literal))
+            written += len(literal)
+            stats.literal_bytes += len(literal)
+        elif message[0] == MSG_END and len(message) == _END.size:
+            _, size, root = _END.unpack(message)
+            if size != written or merkle_root(digests) != root:
+                raise ValueError("Delta reconstruction failed verification")
+            return stats
+        else:
+            continue
+        stats.instructions += 1
@@ -2,10 +2,19 @@
 
 from __future__ import annotations
 
+import argparse
 import os
 import threading
 
 from ..protocol.handshake import HandshakeClient, HandshakeServer
+from .profiling import (
+    SPAN_HANDSHAKE,
+    SpanTracer,
+    add_arguments as add_profiling_arguments,
+    profiling,
+    traced,
+    tracer_from_args,
+)
 from .tunnel import SecureTunnel, SessionKeys
 from .memory_transport import memory_socketpair
 
@@ -38,7 +47,7 @@ def _recv_loop(tunnel: SecureTunnel, output: list[bytes], ready: threading.Event
         output.append(f"error:{exc}".encode())
 
 
-def demo_transfer(psk: bytes) -> list[bytes]:
+def demo_transfer(psk: bytes, *, tracer: SpanTracer | None = None) -> list[bytes]:
     """Run a full handshake + encrypted exchange over an in-memory link."""
     sock_a, sock_b = memory_socketpair()
 
@@ -46,9 +55,10 @@ def demo_transfer(psk: bytes) -> list[bytes]:
     client = HandshakeClient(psk)
     server = HandshakeServer(psk)
 
-    client_hello = client.build_hello()
-    server_hello, server_keys = server.process_client_hello(client_hello)
-    client_keys = client.process_server_hello(server_hello)
+    with traced(tracer, SPAN_HANDSHAKE):
+        client_hello = client.build_hello()
+        server_hello, server_keys = server.process_client_hello(client_hello)
+        client_keys = client.process_server_hello(server_hello)
 
     # Derive tunnel keys
     client_session = SessionKeys(
@@ -62,8 +72,8 @@ def demo_transfer(psk: bytes) -> list[bytes]:
         base_nonce=server_keys.base_nonce,
     )
 
-    client_tunnel = SecureTunnel(sock_a, client_session)
-    server_tunnel = SecureTunnel(sock_b, server_session)
+    client_tunnel = SecureTunnel(sock_a, client_session, tracer=tracer)
+    server_tunnel = SecureTunnel(sock_b, server_session, tracer=tracer)
 
     results: list[bytes] = []
     ready = threading.Event()
@@ -80,7 +90,16 @@ def demo_transfer(psk: bytes) -> list[bytes]:
     return results
 
 
-if __name__ == "__main__":
-    outputs = demo_transfer(b"psk-demo")
+def main() -> None:
+    """CLI entry point for the in-memory demo."""
+    parser = argparse.ArgumentParser(description="In-memory tunnel demo")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    with profiling(args.profile):
+        outputs = demo_transfer(b"psk-demo", tracer=tracer_from_args(args))
     for idx, item in enumerate(outputs):
         print(idx, item)
+
+
+if __name__ == "__main__":
+    main()
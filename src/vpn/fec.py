@@ -0,0 +1,369 @@
+"""Forward error correction between the chunker and ``SecureTunnel``.
+
+Payloads are grouped K at a time.  After the K data packets (or fewer when a
+stream boundary flushes the group) the sender emits M parity packets, so the
+receiver can rebuild up to M lost packets of a group without a round trip.
+With M == 1 the parity is a plain XOR; otherwise it is a systematic
+Reed-Solomon erasure code over GF(256) whose parity rows form a Cauchy
+matrix, which keeps every K-of-(K+M) subset decodable.
+
+Each FEC packet is an ordinary tunnel packet, so parity is encrypted and
+authenticated like data.  Its plaintext starts with::
+
+    group (u32) | index (u8) | data packets in group (u8) | parity packets (u8)
+
+Data packets carry the payload unchanged.  Parity packets cover every data
+payload of the group prefixed with its u16 length and zero-padded to the
+longest one, so rebuilt payloads recover their exact size.  The data count of
+a data packet is the nominal K; parity packets carry the actual count, which
+is smaller for groups cut short by ``flush``.
+
+The group size and parity count are negotiated in the handshake through the
+``fec`` option, ``(K << 8) | M``.
+"""
+
+from __future__ import annotations
+
+import socket
+import struct
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from .tunnel import (
+    FRAME_CLOSE,
+    FRAME_DATA,
+    FRAME_END,
+    Frame,
+    SecureTunnel,
+    decode_frame,
+    encode_data_body,
+    encode_frame,
+)
+
+_SHARD = struct.Struct("!IBBB")
+_LENGTH = struct.Struct("!H")
+MAX_SHARDS = 255
+
+# GF(2^8) with the polynomial x^8 + x^4 + x^3 + x^2 + 1 and generator 2.
+_POLY = 0x11D
+GF_EXP = bytearray(512)
+GF_LOG = [0] * 256
+_value = 1
+for _power in range(255):
+    GF_EXP[_power] = _value
+    GF_LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= _POLY
+for _power in range(255, 512):
+    GF_EXP[_power] = GF_EXP[_power - 255]
+del _value, _power
+
+
+def gf_mul(a: int, b: int) -> int:
+    """Multiply two field elements."""
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a: int) -> int:
+    """Return the multiplicative inverse of a non-zero element."""
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+@lru_cache(maxsize=256)
+def _mul_table(coefficient: int) -> bytes:
+    """Translation table multiplying every byte value by ``coefficient``."""
+    return bytes(gf_mul(coefficient, value) for value in range(256))
+
+
+def _combine(coefficients: list[int], blocks: list[bytes], size: int) -> bytes:
+    """Return sum(c * block) over GF(256), using C-speed translate and XOR."""
+    acc = 0
+    for coefficient, block in zip(coefficients, blocks):
+        if coefficient == 0:
+            continue
+        if coefficient != 1:
+            block = block.translate(_mul_table(coefficient))
+        acc ^= int.from_bytes(block, "little")
+    return acc.to_bytes(size, "little")
+
+
+@lru_cache(maxsize=64)
+def parity_matrix(data_shards: int, parity_shards: int) -> tuple[tuple[int, ...], ...]:
+    """Coefficient rows producing the parity shards from the data shards."""
+    if parity_shards == 1:
+        return ((1,) * data_shards,)
+    return tuple(
+        tuple(gf_inv((data_shards + i) ^ j) for j in range(data_shards))
+        for i in range(parity_shards)
+    )
+
+
+def _invert(matrix: list[list[int]]) -> list[list[int]]:
+    """Invert a square matrix over GF(256) by Gauss-Jordan elimination."""
+    size = len(matrix)
+    rows = [row[:] + [int(i == r) for i in range(size)] for r, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next((r for r in range(col, size) if rows[r][col]), None)
+        if pivot is None:
+            raise ValueError("FEC matrix is singular")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(scale, value) for value in rows[col]]
+        for r in range(size):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [
+                    value ^ gf_mul(factor, pivot_value)
+                    for value, pivot_value in zip(rows[r], rows[col])
+                ]
+    return [row[size:] for row in rows]
+
+
+def encode_parity(blocks: list[bytes], parity_shards: int) -> list[bytes]:
+    """Compute parity blocks for equally sized data blocks."""
+    size = len(blocks[0])
+    return [
+        _combine(list(row), blocks, size)
+        for row in parity_matrix(len(blocks), parity_shards)
+    ]
+
+
+def recover_blocks(
+    data_shards: int, parity_shards: int, available: dict[int, bytes]
+) -> dict[int, bytes]:
+    """Rebuild the missing data blocks from any ``data_shards`` available ones.
+
+    ``available`` maps shard index (data first, then parity) to its block.
+    """
+    missing = [index for index in range(data_shards) if index not in available]
+    if not missing:
+        return {}
+    if len(available) < data_shards:
+        raise ValueError("Not enough FEC shards to rebuild the group")
+    matrix = parity_matrix(data_shards, parity_shards)
+    chosen = sorted(available)[:data_shards]
+    rows = [
+        [int(index == col) for col in range(data_shards)]
+        if index < data_shards
+        else list(matrix[index - data_shards])
+        for index in chosen
+    ]
+    inverse = _invert(rows)
+    blocks = [available[index] for index in chosen]
+    size = len(blocks[0])
+    return {index: _combine(inverse[index], blocks, size) for index in missing}
+
+
+def parse_fec(spec: str) -> int:
+    """Turn ``"K:M"`` (e.g. ``"8:2"``) into the ``fec`` option value.
+
+    A zero on either side disables FEC.
+    """
+    try:
+        data, parity = (int(part) for part in spec.split(":"))
+    except ValueError:
+        raise ValueError(f"Invalid FEC setting {spec!r}; expected K:M") from None
+    if data < 0 or parity < 0 or data + parity > MAX_SHARDS:
+        raise ValueError(f"FEC group {spec!r} is out of range")
+    return (data << 8) | parity
+
+
+def fec_for(tunnel: SecureTunnel, options: dict[str, int]):
+    """Wrap ``tunnel`` in the FEC layer agreed in the handshake, if any."""
+    value = options.get("fec", 0)
+    data, parity = value >> 8, value & 0xFF
+    if not data or not parity:
+        return tunnel
+    return FecTunnel(tunnel, data, parity)
+
+
+@dataclass
+class FecStats:
+    groups: int = 0
+    parity_sent: int = 0
+    recovered: int = 0
+    lost: int = 0
+    # Refused by the tunnel (replayed, reordered or forged) and treated as lost.
+    rejected: int = 0
+
+
+@dataclass
+class _Group:
+    number: int
+    data_shards: int
+    parity_shards: int = 0
+    shards: dict[int, bytes] = field(default_factory=dict)
+    parity_size: int = 0
+    next_index: int = 0
+    done: bool = False
+
+
+def _block(payload: bytes, size: int) -> bytes:
+    """Length-prefix and zero-pad a payload to a parity block."""
+    return (_LENGTH.pack(len(payload)) + payload).ljust(size, b"\x00")
+
+
+class FecTunnel:
+    """``SecureTunnel`` stand-in that adds parity packets per group.
+
+    Exposes the tunnel's packet and frame API, so file transfer code can use
+    it unchanged; other attributes are forwarded to the wrapped tunnel.
+    Payloads are delivered in send order; after a loss, later payloads of
+    the group are held until parity rebuilds the gap or the group is given
+    up (a later group arrives or the socket times out).
+    """
+
+    def __init__(self, tunnel: SecureTunnel, data_shards: int, parity_shards: int):
+        """Group ``data_shards`` payloads and protect each group with parity."""
+        if data_shards < 1 or parity_shards < 1:
+            raise ValueError("FEC needs at least one data and one parity shard")
+        if data_shards + parity_shards > MAX_SHARDS:
+            raise ValueError("FEC group is too large")
+        self.tunnel = tunnel
+        # Extra bytes per datagram: shard header, plus the length in parity.
+        self.overhead = _SHARD.size + _LENGTH.size
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self.stats = FecStats()
+        self._send_group = 0
+        self._send_payloads: list[bytes] = []
+        self._ready: deque[bytes] = deque()
+        self._group: _Group | None = None
+        self._last_group = -1
+
+    def __getattr__(self, name: str):
+        return getattr(self.tunnel, name)
+
+    # Sending ------------------------------------------------------------
+
+    def send_packet(self, payload: bytes) -> None:
+        """Send one payload as the next data packet of the current group."""
+        payload = bytes(payload)
+        index = len(self._send_payloads)
+        header = _SHARD.pack(
+            self._send_group, index, self.data_shards, self.parity_shards
+        )
+        self.tunnel.send_packet(header + payload)
+        self._send_payloads.append(payload)
+        if len(self._send_payloads) == self.data_shards:
+            self.flush()
+
+    def flush(self) -> None:
+        """Close the current group early and send its parity packets."""
+        payloads = self._send_payloads
+        if not payloads:
+            return
+        size = _LENGTH.size + max(len(payload) for payload in payloads)
+        blocks = [_block(payload, size) for payload in payloads]
+        for offset, parity in enumerate(encode_parity(blocks, self.parity_shards)):
+            header = _SHARD.pack(
+                self._send_group,
+                len(payloads) + offset,
+                len(payloads),
+                self.parity_shards,
+            )
+            self.tunnel.send_packet(header + parity)
+            self.stats.parity_sent += 1
+        self.stats.groups += 1
+        self._send_group = (self._send_group + 1) & 0xFFFFFFFF
+        self._send_payloads = []
+
+    def send_frame(self, frame_type: int, stream_id: int, body: bytes = b"") -> None:
+        """Send a stream frame; stream boundaries flush the group."""
+        self.send_packet(encode_frame(frame_type, stream_id, body))
+        if frame_type in (FRAME_END, FRAME_CLOSE):
+            self.flush()
+
+    def send_data(self, stream_id: int, offset: int, data) -> None:
+        """Send stream bytes at ``offset``."""
+        self.send_frame(FRAME_DATA, stream_id, encode_data_body(offset, data))
+
+    # Receiving ----------------------------------------------------------
+
+    def receive_packet(self) -> bytes:
+        """Return the next payload, rebuilding lost ones from parity."""
+        while not self._ready:
+            try:
+                plaintext = self.tunnel.receive_packet()
+            except ValueError:
+                # A late datagram fails the replay check; parity covers it.
+                self.stats.rejected += 1
+                continue
+            except socket.timeout:
+                # Nothing more is coming for now: release what the group holds.
+                if self._group is not None and not self._group.done:
+                    self._finish_group()
+                if self._ready:
+                    break
+                raise
+            self._accept(plaintext)
+        return self._ready.popleft()
+
+    def receive_frame(self) -> Frame:
+        """Read the next payload as a stream frame."""
+        return decode_frame(self.receive_packet())
+
+    def _accept(self, plaintext: bytes) -> None:
+        if len(plaintext) < _SHARD.size:
+            raise ValueError("Truncated FEC packet")
+        number, index, data_shards, parity_shards = _SHARD.unpack_from(plaintext)
+        body = plaintext[_SHARD.size :]
+        if data_shards == 0 or index >= data_shards + parity_shards:
+            raise ValueError("Invalid FEC packet header")
+        group = self._group
+        if group is None or number != group.number:
+            if number <= self._last_group:
+                return  # late packet of a group already delivered
+            if group is not None and not group.done:
+                self._finish_group()
+            group = self._group = _Group(number, data_shards)
+            self._last_group = number
+        if group.done or index in group.shards:
+            return
+        if index >= data_shards or index >= group.data_shards:
+            # Parity carries the group's actual size.
+            group.data_shards = data_shards
+            group.parity_shards = parity_shards
+            group.parity_size = len(body)
+        group.shards[index] = body
+        self._advance(group)
+
+    def _advance(self, group: _Group) -> None:
+        """Deliver contiguous payloads and rebuild gaps when parity allows."""
+        shards = group.shards
+        while group.next_index < group.data_shards and group.next_index in shards:
+            self._ready.append(shards[group.next_index])
+            group.next_index += 1
+        if group.next_index >= group.data_shards:
+            group.done = True
+            return
+        if not group.parity_size or len(shards) < group.data_shards:
+            return
+        size = group.parity_size
+        available = {
+            index: body if index >= group.data_shards else _block(body, size)
+            for index, body in shards.items()
+        }
+        rebuilt = recover_blocks(group.data_shards, group.parity_shards, available)
+        for index, block in rebuilt.items():
+            (length,) = _LENGTH.unpack_from(block)
+            shards[index] = block[_LENGTH.size : _LENGTH.size + length]
+        self.stats.recovered += len(rebuilt)
+        self._advance(group)
+
+    def _finish_group(self) -> None:
+        """Give up on the current group, delivering whatever arrived."""
+        group = self._group
+        for index in range(group.next_index, group.data_shards):
+            if index in group.shards:
+                self._ready.append(group.shards[index])
+            else:
+                self.stats.lost += 1
+        group.next_index = group.data_shards
+        group.done = True
@@ -0,0 +1,168 @@
+"""Forward IP packets between a packet device and the secure tunnel.
+
+Any file descriptor that returns one packet per ``read`` works: a TUN
+interface from ``open_tun`` in production, or one end of
+``socket.socketpair(AF_UNIX, SOCK_SEQPACKET)`` in tests.  One ``selectors``
+loop (epoll on Linux) watches both the device and the tunnel socket:
+
+* device readable: up to ``batch`` packets are read and handed to the
+  tunnel, then the tunnel is flushed once, so a tunnel with a
+  ``CoalescePolicy(max_delay=None)`` seals the whole burst into as few AEAD
+  packets as its budget allows;
+* socket readable: up to ``batch`` tunnel packets (and every payload of a
+  coalesced one) are verified and written to the device.
+
+Like a router, the forwarder drops what it cannot deliver (oversized,
+unauthenticated, or a full device queue) and counts it instead of blocking.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import select
+import selectors
+import struct
+import threading
+from dataclasses import dataclass
+
+from .pmtu import max_payload_size
+from .tunnel import SecureTunnel
+
+# Largest IP packet a device read may return.
+MAX_PACKET = 65535
+DEFAULT_BATCH = 32
+
+_TUNSETIFF = 0x400454CA
+_IFF_TUN = 0x0001
+_IFF_NO_PI = 0x1000
+
+
+def open_tun(name: str = "cryptotun%d") -> tuple[int, str]:
+    """Create (or attach to) a TUN interface and return its fd and name.
+
+    Needs CAP_NET_ADMIN; configure the interface with ``ip`` afterwards.
+    """
+    fd = os.open("/dev/net/tun", os.O_RDWR)
+    try:
+        request = struct.pack("16sH", name.encode(), _IFF_TUN | _IFF_NO_PI)
+        reply = fcntl.ioctl(fd, _TUNSETIFF, request)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd, reply[:16].rstrip(b"\x00").decode()
+
+
+@dataclass
+class ForwarderStats:
+    # Device -> tunnel.
+    packets_out: int = 0
+    # Tunnel -> device.
+    packets_in: int = 0
+    # Wakeups that read at least one device packet.
+    batches: int = 0
+    dropped_oversize: int = 0
+    dropped_invalid: int = 0
+    dropped_device_full: int = 0
+
+
+class PacketForwarder:
+    """Bidirectional pump between a packet fd and a ``SecureTunnel``."""
+
+    def __init__(
+        self, tunnel: SecureTunnel, packet_fd: int, *, batch: int = DEFAULT_BATCH
+    ):
+        """Forward between ``packet_fd`` (made non-blocking) and ``tunnel``."""
+        if batch < 1:
+            raise ValueError("Batch size must be positive")
+        self.tunnel = tunnel
+        self.packet_fd = packet_fd
+        self.batch = batch
+        self.stats = ForwarderStats()
+        # A packet too big to share a coalesced batch is sealed on its own,
+        # so the limit is a plain packet's payload.
+        self.max_packet = min(MAX_PACKET, max_payload_size(tunnel))
+        self._stop = threading.Event()
+        os.set_blocking(packet_fd, False)
+
+    def stop(self) -> None:
+        """Ask ``run`` to return after its current wakeup."""
+        self._stop.set()
+
+    def run(self, poll_interval: float = 0.1) -> None:
+        """Forward packets until ``stop`` is called or the device closes."""
+        sock = self.tunnel.sock
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.packet_fd, selectors.EVENT_READ, self._from_device)
+            selector.register(sock, selectors.EVENT_READ, self._from_tunnel)
+            while not self._stop.is_set():
+                device_open = True
+                for key, _ in selector.select(poll_interval):
+                    if not key.data():
+                        device_open = False
+                if self.tunnel.pending_payloads:
+                    # Left over from a coalesced packet when the batch filled.
+                    self._from_tunnel()
+                if not device_open:
+                    # Deliver what was already decrypted before giving up.
+                    while self.tunnel.pending_payloads:
+                        self._from_tunnel()
+                    return
+
+    def _from_device(self) -> bool:
+        """Read a burst of device packets and send them through the tunnel."""
+        count = 0
+        while count < self.batch:
+            try:
+                packet = os.read(self.packet_fd, MAX_PACKET)
+            except BlockingIOError:
+                break
+            if not packet:
+                return False
+            count += 1
+            if len(packet) > self.max_packet:
+                self.stats.dropped_oversize += 1
+                continue
+            self.tunnel.send_packet(packet)
+            self.stats.packets_out += 1
+        if count:
+            self.tunnel.flush()
+            self.stats.batches += 1
+        return True
+
+    def _from_tunnel(self) -> bool:
+        """Verify waiting tunnel packets and write them to the device."""
+        received = 0
+        while received < self.batch:
+            try:
+                packet = self.tunnel.receive_packet()
+            except ValueError:
+                self.stats.dropped_invalid += 1
+                packet = None
+            received += 1
+            if packet:
+                try:
+                    os.write(self.packet_fd, packet)
+                    self.stats.packets_in += 1
+                except BlockingIOError:
+                    self.stats.dropped_device_full += 1
+            if not self.tunnel.pending_payloads and not _readable(self.tunnel.sock):
+                break
+        return True
+
+
+def _readable(sock) -> bool:
+    """Whether a datagram is waiting, without blocking."""
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+def forward_tun(tunnel: SecureTunnel, name: str) -> None:
+    """Attach ``tunnel`` to a new TUN interface and forward until interrupted."""
+    fd, ifname = open_tun(name)
+    print(f"forwarding packets on {ifname}")
+    try:
+        PacketForwarder(tunnel, fd).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,217 @@
+"""Handshake processing off the data path.
+
+``process_client_hello`` costs a modular exponentiation and several HMACs,
+tens of milliseconds in pure Python.  A server that runs it on the thread
+that decrypts packets stalls every live session whenever new clients
+arrive.  ``HandshakePool`` moves that work to dedicated worker threads fed
+by a bounded queue:
+
+* admission control: hellos beyond the queue bound, or repeated hellos from
+  a peer whose handshake is already queued, are refused immediately instead
+  of growing the backlog;
+* completed sessions are installed into a ``SessionTable`` before the reply
+  leaves, so the peer's first data packet always finds its keys, and a
+  re-handshake swaps the entry in one step;
+* queue depth, queueing delay, processing time and outcomes are exported
+  through a ``MetricsRegistry`` for sizing the pool.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Generic, Hashable, TypeVar
+
+from ..protocol.handshake import HandshakeServer
+from ..protocol.serialization import encode_handshake_message, encode_handshake_reject
+from .metrics import MetricsRegistry, handshake_timer
+from .tunnel import SessionKeys
+
+T = TypeVar("T")
+
+
+class SessionTable(Generic[T]):
+    """Live sessions by peer; installs and lookups are atomic."""
+
+    def __init__(self):
+        """Create an empty table."""
+        self._lock = threading.Lock()
+        self._sessions: dict[Hashable, T] = {}
+
+    def install(self, peer: Hashable, session: T) -> T | None:
+        """Publish ``session`` for ``peer`` and return the one it replaced."""
+        with self._lock:
+            previous = self._sessions.get(peer)
+            self._sessions[peer] = session
+            return previous
+
+    def get(self, peer: Hashable) -> T | None:
+        """Return the current session of ``peer``, if any."""
+        with self._lock:
+            return self._sessions.get(peer)
+
+    def remove(self, peer: Hashable) -> T | None:
+        """Forget ``peer`` and return its session."""
+        with self._lock:
+            return self._sessions.pop(peer, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+@dataclass
+class PoolStats:
+    completed: int = 0
+    failed: int = 0
+    # Refused by admission control (queue full or duplicate hello).
+    rejected: int = 0
+
+
+def session_keys(keys) -> SessionKeys:
+    """Server-side tunnel keys from the result of ``process_client_hello``."""
+    return SessionKeys(
+        enc_key=keys.server_enc,
+        mac_key=keys.server_mac,
+        base_nonce=keys.base_nonce,
+        options=keys.options,
+        recv_key=keys.client_enc,
+    )
+
+
+class HandshakePool:
+    """Worker threads answering client hellos from a bounded queue."""
+
+    def __init__(
+        self,
+        server_factory: Callable[[], HandshakeServer],
+        install: Callable[[Hashable, SessionKeys, Callable[[bytes], None]], None],
+        *,
+        workers: int = 2,
+        queue_size: int = 64,
+        registry: MetricsRegistry | None = None,
+        reject_overload: bool = True,
+    ):
+        """Start ``workers`` threads.
+
+        ``server_factory`` returns a fresh ``HandshakeServer`` per hello
+        (shared state such as a ticket issuer must be thread-safe).
+        ``install(peer, keys, reply)`` publishes a completed session and
+        runs before the ServerHello is sent.  With ``reject_overload`` a
+        hello refused because the queue is full is answered with a
+        handshake reject so the client can back off instead of timing out.
+        """
+        if workers < 1 or queue_size < 1:
+            raise ValueError("Handshake pool needs a worker and a queue slot")
+        self.server_factory = server_factory
+        self.install = install
+        self.reject_overload = reject_overload
+        self.stats = PoolStats()
+        self.registry = registry
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._queued: set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._depth = self._wait = None
+        self._outcomes = {}
+        if registry is not None:
+            self._depth = registry.gauge(
+                "cryptotunnel_handshake_queue_depth", "Hellos waiting for a worker"
+            )
+            self._wait = registry.histogram(
+                "cryptotunnel_handshake_queue_seconds",
+                "Time a hello waited for a handshake worker",
+            )
+            self._outcomes = {
+                result: registry.counter(
+                    "cryptotunnel_handshakes_total",
+                    "Client hellos by outcome",
+                    {"result": result},
+                )
+                for result in ("completed", "failed", "rejected")
+            }
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def depth(self) -> int:
+        """Hellos currently waiting for a worker."""
+        return self._queue.qsize()
+
+    def submit(
+        self, peer: Hashable, hello: dict, reply: Callable[[bytes], None]
+    ) -> bool:
+        """Queue a decoded hello; return False if admission control refused it."""
+        with self._lock:
+            if peer in self._queued:
+                # A retransmitted hello; the queued one will be answered.
+                self._count("rejected")
+                return False
+            try:
+                self._queue.put_nowait((peer, hello, reply, time.perf_counter()))
+            except queue.Full:
+                self._count("rejected")
+                full = True
+            else:
+                self._queued.add(peer)
+                full = False
+        if full:
+            if self.reject_overload:
+                reply(encode_handshake_reject())
+            return False
+        if self._depth is not None:
+            self._depth.set(self._queue.qsize())
+        return True
+
+    def drain(self) -> None:
+        """Wait until every admitted hello has been answered."""
+        self._queue.join()
+
+    def stop(self) -> None:
+        """Finish queued hellos and stop the workers."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _count(self, result: str) -> None:
+        """Record an outcome; the caller must hold ``self._lock``."""
+        setattr(self.stats, result, getattr(self.stats, result) + 1)
+        counter = self._outcomes.get(result)
+        if counter is not None:
+            counter.inc()
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._process(*job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, peer, hello: dict, reply, queued_at: float) -> None:
+        with self._lock:
+            self._queued.discard(peer)
+        if self._wait is not None:
+            self._wait.observe(time.perf_counter() - queued_at)
+            self._depth.set(self._queue.qsize())
+        try:
+            with handshake_timer(self.registry, "server_process"):
+                response, keys = self.server_factory().process_client_hello(hello)
+        except ValueError:
+            with self._lock:
+                self._count("failed")
+            return
+        self.install(peer, session_keys(keys), reply)
+        with self._lock:
+            self._count("completed")
+        try:
+            reply(encode_handshake_message(response))
+        except OSError:
+            pass
@@ -0,0 +1,656 @@
+"""Multi-client load generator and scaling harness.
+
+Spawns N simulated clients (threads, processes or asyncio tasks) against a
+multiplexing server over loopback UDP or the in-memory link.  Each client
+performs handshakes at a configurable rate and streams fixed-size packets at
+a configurable send rate; the run reports aggregate throughput seen by the
+server, handshake latency percentiles and error counts.  Passing several
+client counts sweeps N and prints one row per count (a scaling curve).
+
+    python3 -m src.vpn.loadgen --clients 1,8,64 --mode thread --duration 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+from ..protocol.handshake import HandshakeClient, HandshakeServer
+from ..protocol.serialization import (
+    MAGIC,
+    decode_handshake_message,
+    encode_handshake_message,
+)
+from .handshake_pool import HandshakePool, SessionTable
+from .memory_transport import LinkConditions, memory_socketpair
+from .metrics import MetricsRegistry
+from .tunnel import SecureTunnel, SessionKeys
+
+MODES = ("thread", "process", "asyncio")
+TRANSPORTS = ("udp", "memory")
+HANDSHAKE_TIMEOUT = 2.0
+# How long the server keeps draining after the last client has finished.
+DRAIN_GRACE = 0.2
+# Pause before retrying a handshake the server refused as overloaded.
+REFUSED_BACKOFF = 0.05
+
+
+@dataclass
+class LoadConfig:
+    clients: int = 1
+    mode: str = "thread"
+    transport: str = "udp"
+    duration: float = 5.0
+    # Handshakes per second per client; 0 handshakes once at start.
+    handshake_rate: float = 0.0
+    # Packets per second per client; 0 sends as fast as possible.
+    send_rate: float = 50.0
+    packet_size: int = 256
+    # Server threads processing hellos, and how many hellos may wait for them.
+    handshake_workers: int = 2
+    handshake_queue: int = 64
+    # Impairments for the in-memory link.
+    link: LinkConditions | None = None
+
+
+@dataclass
+class ClientReport:
+    handshakes: int = 0
+    handshake_latencies: list[float] = field(default_factory=list)
+    packets_sent: int = 0
+    bytes_sent: int = 0
+    errors: dict[str, int] = field(default_factory=dict)
+
+    def error(self, kind: str) -> None:
+        """Count one failure of the given kind."""
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+@dataclass
+class LoadReport:
+    clients: int
+    mode: str
+    transport: str
+    handshakes: int
+    handshake_p50: float
+    handshake_p95: float
+    handshake_p99: float
+    packets_sent: int
+    packets_received: int
+    bytes_received: int
+    seconds: float
+    errors: dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        """Payload MB/s delivered to the server."""
+        return self.bytes_received / self.seconds / 1e6 if self.seconds else 0.0
+
+    @property
+    def packet_rate(self) -> float:
+        """Packets per second delivered to the server."""
+        return self.packets_received / self.seconds if self.seconds else 0.0
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of ``values`` (0.0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class _PeerSocket:
+    """Socket stand-in feeding one datagram at a time to a server tunnel."""
+
+    def __init__(self, reply: Callable[[bytes], None]):
+        """Send replies through ``reply``; ``pending`` holds the next datagram."""
+        self.reply = reply
+        self.pending = b""
+
+    def sendall(self, data: bytes) -> None:
+        """Route outgoing packets back to the peer's transport."""
+        self.reply(data)
+
+    def recv(self, bufsize: int) -> bytes:
+        """Return the datagram the worker is currently processing."""
+        return self.pending[:bufsize]
+
+
+class LoadServer:
+    """Multiplexing server: one data worker plus a handshake pool.
+
+    Transports push ``(peer, datagram, reply)`` events onto one queue.  The
+    data worker decrypts packets with the peer's current session and hands
+    hellos to a ``HandshakePool``, whose workers install finished sessions
+    into the shared ``SessionTable``, so new clients never stall data.
+    """
+
+    def __init__(
+        self,
+        psk: bytes,
+        *,
+        handshake_workers: int = 2,
+        handshake_queue: int = 64,
+        registry: MetricsRegistry | None = None,
+    ):
+        """Create a stopped server for ``psk``."""
+        self.psk = psk
+        self.handshake_workers = handshake_workers
+        self.handshake_queue = handshake_queue
+        self.registry = registry
+        self.pool: HandshakePool | None = None
+        self.packets = 0
+        self.bytes = 0
+        self.errors: dict[str, int] = {}
+        self.first_packet: float | None = None
+        self.last_packet: float | None = None
+        self._events: queue.Queue = queue.Queue()
+        self.sessions: SessionTable[tuple[_PeerSocket, SecureTunnel]] = SessionTable()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._endpoints = []
+        self._sock: socket.socket | None = None
+
+    def _spawn(self, target, *args) -> None:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    @property
+    def handshakes(self) -> int:
+        """Handshakes completed so far."""
+        return self.pool.stats.completed if self.pool is not None else 0
+
+    def start(self) -> None:
+        """Start the handshake pool and the data worker."""
+        self.pool = HandshakePool(
+            lambda: HandshakeServer(self.psk),
+            self._install,
+            workers=self.handshake_workers,
+            queue_size=self.handshake_queue,
+            registry=self.registry,
+        )
+        self._spawn(self._work)
+
+    def serve_udp(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, int]:
+        """Bind a UDP socket, pump it into the worker and return its address."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        sock.settimeout(0.1)
+        self._sock = sock
+
+        def pump() -> None:
+            while not self._stop.is_set():
+                try:
+                    data, addr = sock.recvfrom(4096)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                self._events.put(
+                    (addr, data, lambda reply, addr=addr: sock.sendto(reply, addr))
+                )
+
+        self._spawn(pump)
+        return sock.getsockname()
+
+    def attach_memory(self, endpoint) -> None:
+        """Serve one in-memory endpoint (the other end belongs to a client)."""
+        self._endpoints.append(endpoint)
+
+        def pump() -> None:
+            while True:
+                try:
+                    data = endpoint.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                self._events.put((id(endpoint), data, endpoint.sendall))
+
+        self._spawn(pump)
+
+    def _error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def _work(self) -> None:
+        while True:
+            event = self._events.get()
+            try:
+                if event is None:
+                    return
+                self._handle(*event)
+            except OSError:
+                self._error("reply")
+            finally:
+                self._events.task_done()
+
+    def _handle(self, peer, data: bytes, reply: Callable[[bytes], None]) -> None:
+        if data[:1] == bytes([MAGIC]):
+            try:
+                hello = decode_handshake_message(data)
+            except ValueError:
+                hello = None
+            if hello is not None:
+                if not self.pool.submit(peer, hello, reply):
+                    self._error("handshake_refused")
+                return
+        session = self.sessions.get(peer)
+        if session is None:
+            self._error("unknown_peer")
+            return
+        peer_sock, tunnel = session
+        peer_sock.pending = data
+        try:
+            payload = tunnel.receive_packet()
+        except ValueError:
+            self._error("decrypt")
+            return
+        now = time.monotonic()
+        if self.first_packet is None:
+            self.first_packet = now
+        self.last_packet = now
+        self.packets += 1
+        self.bytes += len(payload)
+
+    def _install(self, peer, keys: SessionKeys, reply) -> None:
+        peer_sock = _PeerSocket(reply)
+        self.sessions.install(peer, (peer_sock, SecureTunnel(peer_sock, keys)))
+
+    def drain(self) -> None:
+        """Wait until every queued event and hello has been processed."""
+        self._events.join()
+        self.pool.drain()
+
+    def stop(self) -> None:
+        """Stop the transports and the worker."""
+        self._stop.set()
+        for endpoint in self._endpoints:
+            endpoint.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._events.put(None)
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self.pool.stop()
+
+
+class _Refused(ValueError):
+    """The server turned the hello away under load."""
+
+
+def _client_keys(client: HandshakeClient, reply: bytes) -> SessionKeys:
+    message = decode_handshake_message(reply)
+    if message["payload"].get("reject"):
+        raise _Refused("Handshake refused by server")
+    keys = client.process_server_hello(message)
+    return SessionKeys(
+        enc_key=keys.client_enc,
+        mac_key=keys.client_mac,
+        base_nonce=keys.base_nonce,
+        recv_key=keys.server_enc,
+    )
+
+
+def _next_handshake(config: LoadConfig, now: float) -> float:
+    if config.handshake_rate <= 0:
+        return float("inf")
+    return now + 1.0 / config.handshake_rate
+
+
+def run_client(sock, psk: bytes, config: LoadConfig) -> ClientReport:
+    """Drive one blocking client until ``config.duration`` has elapsed."""
+    report = ClientReport()
+    payload = os.urandom(config.packet_size)
+    interval = 1.0 / config.send_rate if config.send_rate > 0 else 0.0
+    start = time.monotonic()
+    deadline = start + config.duration
+    tunnel = None
+    next_handshake = start
+    next_packet = start
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if tunnel is None or now >= next_handshake:
+            client = HandshakeClient(psk)
+            began = time.perf_counter()
+            sock.settimeout(HANDSHAKE_TIMEOUT)
+            try:
+                sock.sendall(encode_handshake_message(client.build_hello()))
+                keys = _client_keys(client, sock.recv(4096))
+            except socket.timeout:
+                report.error("handshake_timeout")
+                continue
+            except _Refused:
+                report.error("handshake_refused")
+                time.sleep(REFUSED_BACKOFF)
+                continue
+            except (OSError, ValueError):
+                report.error("handshake")
+                continue
+            report.handshake_latencies.append(time.perf_counter() - began)
+            report.handshakes += 1
+            tunnel = SecureTunnel(sock, keys)
+            next_handshake = _next_handshake(config, time.monotonic())
+            continue
+        if interval:
+            wake = min(next_packet, next_handshake, deadline)
+            if wake > now:
+                time.sleep(wake - now)
+                continue
+            next_packet += interval
+        try:
+            tunnel.send_packet(payload)
+        except OSError:
+            report.error("send")
+            continue
+        report.packets_sent += 1
+        report.bytes_sent += len(payload)
+    return report
+
+
+async def _recv_async(sock) -> bytes:
+    """Await one datagram from a UDP socket or an in-memory endpoint."""
+    if isinstance(sock, socket.socket):
+        return await asyncio.get_running_loop().sock_recv(sock, 4096)
+    sock.settimeout(0)
+    while True:
+        try:
+            return sock.recv(4096)
+        except socket.timeout:
+            await asyncio.sleep(0.001)
+
+
+async def run_client_async(sock, psk: bytes, config: LoadConfig) -> ClientReport:
+    """Coroutine version of ``run_client`` that yields while waiting."""
+    report = ClientReport()
+    payload = os.urandom(config.packet_size)
+    interval = 1.0 / config.send_rate if config.send_rate > 0 else 0.0
+    start = time.monotonic()
+    deadline = start + config.duration
+    tunnel = None
+    next_handshake = start
+    next_packet = start
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if tunnel is None or now >= next_handshake:
+            client = HandshakeClient(psk)
+            began = time.perf_counter()
+            try:
+                sock.sendall(encode_handshake_message(client.build_hello()))
+                reply = await asyncio.wait_for(_recv_async(sock), HANDSHAKE_TIMEOUT)
+                keys = _client_keys(client, reply)
+            except asyncio.TimeoutError:
+                report.error("handshake_timeout")
+                continue
+            except _Refused:
+                report.error("handshake_refused")
+                await asyncio.sleep(REFUSED_BACKOFF)
+                continue
+            except (OSError, ValueError):
+                report.error("handshake")
+                continue
+            report.handshake_latencies.append(time.perf_counter() - began)
+            report.handshakes += 1
+            tunnel = SecureTunnel(sock, keys)
+            next_handshake = _next_handshake(config, time.monotonic())
+            continue
+        if interval:
+            wake = min(next_packet, next_handshake, deadline)
+            if wake > now:
+                await asyncio.sleep(wake - now)
+                continue
+            next_packet += interval
+        try:
+            tunnel.send_packet(payload)
+        except OSError:
+            report.error("send")
+            continue
+        report.packets_sent += 1
+        report.bytes_sent += len(payload)
+        if not interval:
+            await asyncio.sleep(0)
+    return report
+
+
+def _udp_client_socket(address: tuple[str, int], blocking: bool = True):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(address)
+    sock.setblocking(blocking)
+    return sock
+
+
+def _process_client(address: tuple[str, int], psk: bytes, config: LoadConfig):
+    """Entry point of one client process (UDP only)."""
+    sock = _udp_client_socket(address)
+    try:
+        return asdict(run_client(sock, psk, config))
+    finally:
+        sock.close()
+
+
+def _thread_clients(sockets, psk: bytes, config: LoadConfig) -> list[ClientReport]:
+    reports: list[ClientReport | None] = [None] * len(sockets)
+
+    def worker(index: int) -> None:
+        reports[index] = run_client(sockets[index], psk, config)
+
+    threads = [
+        threading.Thread(target=worker, args=(i,), daemon=True)
+        for i in range(len(sockets))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [report for report in reports if report is not None]
+
+
+async def _async_clients(sockets, psk: bytes, config: LoadConfig):
+    return await asyncio.gather(
+        *(run_client_async(sock, psk, config) for sock in sockets)
+    )
+
+
+def run_load(config: LoadConfig, psk: bytes | None = None) -> LoadReport:
+    """Run one load test with ``config.clients`` clients and summarize it."""
+    if config.mode not in MODES:
+        raise ValueError(f"Unknown client mode {config.mode!r}")
+    if config.transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {config.transport!r}")
+    if config.mode == "process" and config.transport != "udp":
+        raise ValueError("Process clients need the UDP transport")
+    psk = psk or os.urandom(32)
+    server = LoadServer(
+        psk,
+        handshake_workers=config.handshake_workers,
+        handshake_queue=config.handshake_queue,
+    )
+    server.start()
+    sockets = []
+    try:
+        if config.transport == "udp":
+            address = server.serve_udp()
+        else:
+            for _ in range(config.clients):
+                client_end, server_end = memory_socketpair(config.link)
+                server.attach_memory(server_end)
+                sockets.append(client_end)
+
+        if config.mode == "process":
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(config.clients) as pool:
+                raw = pool.starmap(
+                    _process_client,
+                    [(address, psk, config)] * config.clients,
+                )
+            reports = [
+                ClientReport(**{**item, "errors": dict(item["errors"])})
+                for item in raw
+            ]
+        else:
+            if config.transport == "udp":
+                blocking = config.mode == "thread"
+                sockets = [
+                    _udp_client_socket(address, blocking)
+                    for _ in range(config.clients)
+                ]
+            if config.mode == "thread":
+                reports = _thread_clients(sockets, psk, config)
+            else:
+                reports = asyncio.run(_async_clients(sockets, psk, config))
+        time.sleep(DRAIN_GRACE)
+        server.drain()
+    finally:
+        server.stop()
+        for sock in sockets:
+            sock.close()
+
+    latencies = [value for report in reports for value in report.handshake_latencies]
+    errors: dict[str, int] = {}
+    for report in reports:
+        for kind, count in report.errors.items():
+            errors[f"client_{kind}"] = errors.get(f"client_{kind}", 0) + count
+    for kind, count in server.errors.items():
+        errors[f"server_{kind}"] = count
+    if server.pool.stats.failed:
+        errors["server_handshake"] = server.pool.stats.failed
+    packets_sent = sum(report.packets_sent for report in reports)
+    lost = packets_sent - server.packets
+    if lost > 0:
+        errors["lost"] = lost
+    seconds = 0.0
+    if server.first_packet is not None:
+        seconds = max(server.last_packet - server.first_packet, 1e-9)
+    return LoadReport(
+        clients=config.clients,
+        mode=config.mode,
+        transport=config.transport,
+        handshakes=sum(report.handshakes for report in reports),
+        handshake_p50=percentile(latencies, 0.50),
+        handshake_p95=percentile(latencies, 0.95),
+        handshake_p99=percentile(latencies, 0.99),
+        packets_sent=packets_sent,
+        packets_received=server.packets,
+        bytes_received=server.bytes,
+        seconds=seconds,
+        errors=errors,
+    )
+
+
+def run_sweep(counts: list[int], config: LoadConfig) -> list[LoadReport]:
+    """Repeat ``run_load`` for each client count to build a scaling curve."""
+    reports = []
+    for count in counts:
+        config.clients = count
+        reports.append(run_load(config))
+    return reports
+
+
+def format_table(reports: list[LoadReport]) -> str:
+    """Render sweep results as a fixed-width table."""
+    lines = [
+        f"{'clients':>8} {'MB/s':>8} {'pkt/s':>9} {'hs':>6} "
+        f"{'hs p50 ms':>10} {'hs p99 ms':>10} {'errors':>7}"
+    ]
+    for report in reports:
+        lines.append(
+            f"{report.clients:>8} {report.throughput:>8.3f} "
+            f"{report.packet_rate:>9.1f} {report.handshakes:>6} "
+            f"{report.handshake_p50 * 1e3:>10.1f} {report.handshake_p99 * 1e3:>10.1f} "
+            f"{sum(report.errors.values()):>7}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """CLI entry point for the load generator."""
+    parser = argparse.ArgumentParser(description="Secure tunnel load generator")
+    parser.add_argument(
+        "--clients",
+        default="1",
+        help="Client count, or a comma-separated list to sweep (e.g. 1,8,64)",
+    )
+    parser.add_argument("--mode", choices=MODES, default="thread")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="udp")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--handshake-rate",
+        type=float,
+        default=0.0,
+        help="Handshakes per second per client (0: once at start)",
+    )
+    parser.add_argument(
+        "--send-rate",
+        type=float,
+        default=50.0,
+        help="Packets per second per client (0: as fast as possible)",
+    )
+    parser.add_argument("--packet-size", type=int, default=256)
+    parser.add_argument(
+        "--handshake-workers",
+        type=int,
+        default=2,
+        help="Server threads processing handshakes",
+    )
+    parser.add_argument(
+        "--handshake-queue",
+        type=int,
+        default=64,
+        help="Hellos that may wait for a worker before new ones are refused",
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="Memory link only")
+    parser.add_argument("--loss", type=float, default=0.0, help="Memory link only")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="Also write the reports to this JSON file")
+    args = parser.parse_args()
+
+    link = None
+    if args.latency or args.loss:
+        link = LinkConditions(latency=args.latency, loss=args.loss, seed=args.seed)
+    config = LoadConfig(
+        mode=args.mode,
+        transport=args.transport,
+        duration=args.duration,
+        handshake_rate=args.handshake_rate,
+        send_rate=args.send_rate,
+        packet_size=args.packet_size,
+        handshake_workers=args.handshake_workers,
+        handshake_queue=args.handshake_queue,
+        link=link,
+    )
+    counts = [int(part) for part in args.clients.split(",") if part.strip()]
+    reports = run_sweep(counts, config)
+    print(format_table(reports))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(
+                [
+                    dict(
+                        asdict(report),
+                        throughput=report.throughput,
+                        packet_rate=report.packet_rate,
+                    )
+                    for report in reports
+                ],
+                handle,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
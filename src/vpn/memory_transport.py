@@ -1,52 +1,217 @@
-"""In-memory duplex channel emulating socket send/recv APIs."""
+"""In-memory duplex datagram link emulating socket send/recv APIs.
+
+Every send is delivered as one datagram (never merged with or split across
+others), each direction holds at most ``capacity`` undelivered datagrams and
+blocks senders once full, and optional ``LinkConditions`` add latency,
+jitter, loss, duplication, reordering and a bandwidth cap driven by a seeded
+RNG, so impaired-network runs are reproducible without real networking.
+"""
 
 from __future__ import annotations
 
-import queue
+import heapq
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass
 from typing import Tuple
 
+DEFAULT_CAPACITY = 1024
+
+
+@dataclass
+class LinkConditions:
+    """Impairments applied to one direction of the link."""
+
+    latency: float = 0.0  # one-way delay in seconds
+    jitter: float = 0.0  # extra uniform delay in [0, jitter)
+    loss: float = 0.0  # probability a datagram is dropped
+    duplicate: float = 0.0  # probability a datagram is delivered twice
+    reorder: float = 0.0  # probability a datagram is held back
+    reorder_delay: float = 0.005  # how long a held-back datagram waits
+    bandwidth: float | None = None  # bytes per second, None for unlimited
+    seed: int | None = None
+
+
+@dataclass
+class LinkStats:
+    sent: int = 0
+    delivered: int = 0
+    dropped: int = 0
+    duplicated: int = 0
+    reordered: int = 0
+    # Sends that had to wait for room in the receiver's queue.
+    blocked: int = 0
+
 
 class _Endpoint:
-    def __init__(self):
-        self._queue = queue.Queue()
-        self._buffer = bytearray()
+    def __init__(
+        self,
+        conditions: LinkConditions | None = None,
+        capacity: int = DEFAULT_CAPACITY,
+    ):
+        """Create an unconnected endpoint sending under ``conditions``."""
+        if capacity < 1:
+            raise ValueError("Link capacity must be at least one datagram")
         self.peer: _Endpoint | None = None
+        self.conditions = conditions
+        self.capacity = capacity
+        self.stats = LinkStats()
+        self._rng = random.Random(conditions.seed if conditions else None)
+        self._timeout: float | None = None
+        self._closed = False
+        self._link_free_at = 0.0
+        # Incoming datagrams as (deliver_at, arrival order, data).
+        self._inbox: list[tuple[float, int, bytes]] = []
+        self._arrivals = 0
+        self._cond = threading.Condition()
 
-    def connect(self, other: "._Endpoint") -> None:
-        """Connect both endpoints so sendall enqueues into peer queue."""
+    def connect(self, other: "_Endpoint") -> None:
+        """Connect both endpoints so sends land in the peer's inbox."""
         self.peer = other
 
-    def sendall(self, data: bytes) -> None:
-        """Mimic socket.sendall by pushing bytes to the peer queue."""
+    def settimeout(self, timeout: float | None) -> None:
+        """Bound how long send and recv calls may block (None blocks forever)."""
+        self._timeout = timeout
+
+    def gettimeout(self) -> float | None:
+        """Return the current blocking timeout."""
+        return self._timeout
+
+    def _deadline(self) -> float | None:
+        if self._timeout is None:
+            return None
+        return time.monotonic() + self._timeout
+
+    def _schedule(self, size: int, now: float) -> list[float]:
+        """Return the delivery times of one datagram (empty when lost)."""
+        cond = self.conditions
+        if cond is None:
+            return [now]
+        stats = self.stats
+        rng = self._rng
+        if cond.loss and rng.random() < cond.loss:
+            stats.dropped += 1
+            return []
+        if cond.bandwidth:
+            self._link_free_at = max(self._link_free_at, now) + size / cond.bandwidth
+            departure = self._link_free_at
+        else:
+            departure = now
+        deliver_at = departure + cond.latency
+        if cond.jitter:
+            deliver_at += rng.uniform(0.0, cond.jitter)
+        if cond.reorder and rng.random() < cond.reorder:
+            deliver_at += cond.reorder_delay
+            stats.reordered += 1
+        times = [deliver_at]
+        if cond.duplicate and rng.random() < cond.duplicate:
+            times.append(deliver_at)
+            stats.duplicated += 1
+        return times
+
+    def _enqueue(self, data: bytes, deliver_at: float, deadline: float | None) -> bool:
+        """Add a datagram to this endpoint's inbox, waiting for room."""
+        with self._cond:
+            waited = False
+            while len(self._inbox) >= self.capacity and not self._closed:
+                waited = True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise socket.timeout("timed out waiting for link capacity")
+                self._cond.wait(remaining)
+            if self._closed:
+                raise ConnectionResetError("Peer endpoint closed")
+            heapq.heappush(self._inbox, (deliver_at, self._arrivals, data))
+            self._arrivals += 1
+            self._cond.notify_all()
+            return waited
+
+    def send(self, data) -> int:
+        """Send one datagram and return its length."""
         if not self.peer:
             raise RuntimeError("Peer not connected")
-        self.peer._queue.put(bytes(data))
+        if self._closed:
+            raise OSError("Endpoint is closed")
+        datagram = bytes(data)
+        deadline = self._deadline()
+        self.stats.sent += 1
+        for deliver_at in self._schedule(len(datagram), time.monotonic()):
+            if self.peer._enqueue(datagram, deliver_at, deadline):
+                self.stats.blocked += 1
+        return len(datagram)
+
+    def sendall(self, data) -> None:
+        """Mimic socket.sendall: the whole buffer travels as one datagram."""
+        self.send(data)
+
+    def sendmsg(self, buffers, ancdata=(), flags: int = 0, address=None) -> int:
+        """Gather ``buffers`` into a single datagram, like ``socket.sendmsg``."""
+        return self.send(b"".join(buffers))
+
+    def _next_datagram(self) -> bytes:
+        """Pop the next due datagram, or b"" once the peer has closed."""
+        deadline = self._deadline()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                if self._inbox:
+                    if self._inbox[0][0] <= now:
+                        data = heapq.heappop(self._inbox)[2]
+                        if self.peer is not None:
+                            self.peer.stats.delivered += 1
+                        self._cond.notify_all()
+                        return data
+                    wait = self._inbox[0][0] - now
+                elif self._closed:
+                    return b""
+                if deadline is not None:
+                    if deadline <= now:
+                        raise socket.timeout("timed out")
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
 
     def recv(self, bufsize: int) -> bytes:
-        """Return buffered data, blocking until at least one chunk arrives."""
-        while not self._buffer:
-            chunk = self._queue.get()
-            if chunk:
-                self._buffer.extend(chunk)
-            else:
-                return b""
-        if len(self._buffer) <= bufsize:
-            data = bytes(self._buffer)
-            self._buffer.clear()
-            return data
-        data = bytes(self._buffer[:bufsize])
-        del self._buffer[:bufsize]
-        return data
+        """Return the next datagram, truncated to ``bufsize`` like UDP."""
+        return self._next_datagram()[:bufsize]
+
+    def recv_into(self, buffer, nbytes: int = 0, flags: int = 0) -> int:
+        """Copy the next datagram into ``buffer`` and return its length."""
+        data = self._next_datagram()
+        view = memoryview(buffer).cast("B")
+        size = min(len(data), nbytes or len(view))
+        view[:size] = data[:size]
+        return size
 
     def close(self) -> None:
-        """Provided for API compatibility; nothing to clean up."""
-        pass
+        """Close both directions; the peer reads b"" once its queue drains."""
+        for endpoint in (self, self.peer):
+            if endpoint is None:
+                continue
+            with endpoint._cond:
+                endpoint._closed = True
+                endpoint._cond.notify_all()
+
 
+def memory_socketpair(
+    conditions: LinkConditions | None = None,
+    *,
+    reverse: LinkConditions | None = None,
+    capacity: int = DEFAULT_CAPACITY,
+) -> Tuple[_Endpoint, _Endpoint]:
+    """Return two connected in-memory endpoints with socket-like APIs.
 
-def memory_socketpair() -> Tuple[_Endpoint, _Endpoint]:
-    """Return two connected in-memory endpoints with socket-like APIs."""
-    a = _Endpoint()
-    b = _Endpoint()
+    ``conditions`` impair traffic from the first endpoint to the second and,
+    unless ``reverse`` is given, the opposite direction as well (with the
+    seed offset by one so the directions do not mirror each other).
+    """
+    if reverse is None and conditions is not None:
+        seed = None if conditions.seed is None else conditions.seed + 1
+        reverse = LinkConditions(**{**vars(conditions), "seed": seed})
+    a = _Endpoint(conditions, capacity)
+    b = _Endpoint(reverse, capacity)
     a.connect(b)
     b.connect(a)
     return a, b
@@ -0,0 +1,250 @@
+"""Path MTU discovery and adaptive chunk sizing.
+
+The largest datagram a session may use is agreed in the handshake through
+the ``mtu`` option (the smaller of both sides' limits).  Before streaming,
+the sender narrows that down to what the path actually carries:
+
+* on Linux the socket is switched to ``IP_PMTUDISC_PROBE``, so datagrams
+  carry the DF bit, oversized sends fail locally with ``EMSGSIZE`` instead
+  of being fragmented, and the kernel's cached path MTU (``IP_MTU``) caps
+  the search;
+* a binary search then sends authenticated ``FRAME_PROBE`` frames padded to
+  the candidate datagram size with random bytes, so a negotiated compressor
+  cannot shrink them; the receiver answers each with a small
+  ``FRAME_PROBE_ACK``, and a probe that stays unanswered counts as too big.
+
+``ChunkSizer`` then picks the file chunk size below that ceiling: it grows
+the chunk while measured send throughput improves, backs off when it drops,
+and halves it when losses are reported.
+"""
+
+from __future__ import annotations
+
+import errno
+import os
+import socket
+import struct
+import sys
+import time
+from dataclasses import dataclass
+
+from .tunnel import (
+    DATA_FRAME_OVERHEAD,
+    FRAME_PROBE,
+    FRAME_PROBE_ACK,
+    PACKET_OVERHEAD,
+    Frame,
+    encode_frame,
+)
+
+_PROBE = struct.Struct("!H")
+# Smallest IPv4 datagram every path must carry (576) minus IP and UDP headers.
+MIN_DATAGRAM = 548
+MAX_DATAGRAM = 65507
+IPV4_UDP_OVERHEAD = 28
+
+# Linux values, used when the socket module does not export them.
+_IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+_IP_PMTUDISC_PROBE = getattr(socket, "IP_PMTUDISC_PROBE", 3)
+_IP_MTU = getattr(socket, "IP_MTU", 14)
+
+
+def enable_path_mtu_discovery(sock) -> bool:
+    """Set DF on outgoing datagrams; return False where unsupported."""
+    if not sys.platform.startswith("linux") or not isinstance(sock, socket.socket):
+        return False
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER, _IP_PMTUDISC_PROBE)
+    except OSError:
+        return False
+    return True
+
+
+def kernel_path_mtu(sock) -> int | None:
+    """Largest UDP payload the kernel believes fits the connected path."""
+    if not sys.platform.startswith("linux") or not isinstance(sock, socket.socket):
+        return None
+    try:
+        mtu = sock.getsockopt(socket.IPPROTO_IP, _IP_MTU)
+    except OSError:
+        return None
+    return mtu - IPV4_UDP_OVERHEAD
+
+
+def max_payload_size(tunnel, datagram_size: int | None = None) -> int:
+    """Largest ``send_packet`` payload whose packet fits ``datagram_size``.
+
+    ``datagram_size`` defaults to the size agreed in the handshake; wrapping
+    layers such as FEC declare their extra bytes as ``overhead``.
+    """
+    datagram_size = datagram_size or tunnel.max_datagram
+    return max(1, datagram_size - PACKET_OVERHEAD - getattr(tunnel, "overhead", 0))
+
+
+def max_chunk_size(tunnel, datagram_size: int | None = None) -> int:
+    """Stream bytes per data frame that keep packets within ``datagram_size``."""
+    return max(1, max_payload_size(tunnel, datagram_size) - DATA_FRAME_OVERHEAD)
+
+
+@dataclass
+class ProbeResult:
+    datagram_size: int
+    probes_sent: int = 0
+    probes_acked: int = 0
+    kernel_mtu: int | None = None
+
+    @property
+    def loss(self) -> float:
+        """Fraction of probes at or below the final size that went unanswered."""
+        return 1.0 - self.probes_acked / self.probes_sent if self.probes_sent else 0.0
+
+
+def answer_probe(tunnel, frame: Frame) -> bool:
+    """Acknowledge a probe frame; return False for any other frame."""
+    if frame.frame_type != FRAME_PROBE:
+        return False
+    if len(frame.body) < _PROBE.size:
+        raise ValueError("Truncated path MTU probe")
+    tunnel.send_frame(FRAME_PROBE_ACK, 0, frame.body[: _PROBE.size])
+    return True
+
+
+def probe_path_mtu(
+    tunnel,
+    *,
+    low: int = MIN_DATAGRAM,
+    high: int | None = None,
+    timeout: float = 1.0,
+    attempts: int = 2,
+) -> ProbeResult:
+    """Find the largest datagram size the peer acknowledges.
+
+    The peer must pass incoming frames through ``answer_probe``.  ``low`` is
+    assumed to work unless it exceeds ``high``, which defaults to the size
+    agreed in the handshake.
+    """
+    high = min(high or tunnel.max_datagram, MAX_DATAGRAM)
+    low = min(low, high)
+    sock = tunnel.sock
+    enable_path_mtu_discovery(sock)
+    result = ProbeResult(datagram_size=low, kernel_mtu=kernel_path_mtu(sock))
+    if result.kernel_mtu is not None:
+        high = max(low, min(high, result.kernel_mtu))
+    header = len(encode_frame(FRAME_PROBE, 0)) + getattr(tunnel, "overhead", 0)
+
+    def probe(size: int) -> bool:
+        padding = size - PACKET_OVERHEAD - header - _PROBE.size
+        body = _PROBE.pack(size) + os.urandom(max(0, padding))
+        for attempt in range(1, attempts + 1):
+            try:
+                tunnel.send_frame(FRAME_PROBE, 0, body)
+                tunnel.flush()
+            except OSError as exc:
+                if exc.errno == errno.EMSGSIZE:
+                    return False
+                raise
+            if _await_ack(tunnel, size, timeout):
+                # Only sizes that fit count towards the loss estimate.
+                result.probes_sent += attempt
+                result.probes_acked += 1
+                return True
+        return False
+
+    previous = sock.gettimeout()
+    try:
+        if probe(high):
+            result.datagram_size = high
+        else:
+            lo, hi = low, high - 1
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if probe(mid):
+                    lo = mid
+                else:
+                    hi = mid - 1
+            result.datagram_size = lo
+    finally:
+        sock.settimeout(previous)
+    return result
+
+
+def _await_ack(tunnel, size: int, timeout: float) -> bool:
+    """Wait up to ``timeout`` for the acknowledgement of a ``size`` probe."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        tunnel.sock.settimeout(remaining)
+        try:
+            frame = tunnel.receive_frame()
+        except socket.timeout:
+            return False
+        except ValueError:
+            continue
+        if frame.frame_type == FRAME_PROBE_ACK and len(frame.body) >= _PROBE.size:
+            if _PROBE.unpack_from(frame.body)[0] == size:
+                return True
+
+
+class ChunkSizer:
+    """Hill-climbing chunk size bounded by the path, shrinking on loss.
+
+    Throughput is measured over windows of ``window`` chunks.  The size
+    moves by ``step`` in the current direction while throughput improves
+    and reverses when it falls.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        *,
+        min_size: int = 256,
+        initial: int | None = None,
+        window: int = 32,
+        step: float = 1.25,
+        loss_threshold: float = 0.02,
+    ):
+        """Start at ``initial`` (default: the maximum) within the bounds.
+
+        A ``min_size`` above ``max_size`` is lowered to it, so a small path
+        yields fixed-size chunks rather than an error.
+        """
+        min_size = min(min_size, max_size)
+        if min_size <= 0:
+            raise ValueError("Chunk size bounds are inconsistent")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = min(max(initial or max_size, min_size), max_size)
+        self.window = window
+        self.step = step
+        self.loss_threshold = loss_threshold
+        self._direction = -1 if self.size == max_size else 1
+        self._best: float | None = None
+        self._bytes = 0
+        self._seconds = 0.0
+        self._count = 0
+
+    def record(self, nbytes: int, seconds: float) -> None:
+        """Account for one chunk sent in ``seconds``."""
+        self._bytes += nbytes
+        self._seconds += seconds
+        self._count += 1
+        if self._count < self.window:
+            return
+        rate = self._bytes / self._seconds if self._seconds > 0 else float("inf")
+        self._bytes, self._seconds, self._count = 0, 0.0, 0
+        if self._best is not None and rate < self._best:
+            self._direction = -self._direction
+        self._best = rate
+        self._resize(self.step if self._direction > 0 else 1 / self.step)
+
+    def record_loss(self, lost: int, sent: int) -> None:
+        """Halve the chunk size when the loss rate exceeds the threshold."""
+        if sent and lost / sent > self.loss_threshold:
+            self._resize(0.5)
+            self._direction = -1
+            self._best = None
+
+    def _resize(self, factor: float) -> None:
+        self.size = min(max(int(self.size * factor), self.min_size), self.max_size)
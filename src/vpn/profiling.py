@@ -0,0 +1,287 @@
+"""Whole-run profiling and a per-packet span tracer.
+
+``--profile SPEC`` (or the ``CRYPTOTUNNEL_PROFILE`` environment variable)
+accepts ``cprofile:PATH`` (``pstats``-compatible output; a bare PATH means
+the same) or ``stacks:PATH``, which samples every thread's stack and writes
+the folded ``frame;frame;frame count`` format read by flamegraph.pl and
+speedscope.
+
+``SpanTracer`` records handshake, encrypt, send, recv, decrypt and write
+spans into a fixed-size binary ring buffer.  Each record is::
+
+    kind (u8) | packet sequence (u32) | start ns (u64) | duration ns (u32)
+
+little-endian, with durations clamped to about 4.3 s.  Dump files start with
+``TRACE_MAGIC`` and a u32 record count; ``python -m src.vpn.profiling FILE``
+prints a per-span summary.
+"""
+
+from __future__ import annotations
+
+import atexit
+import cProfile
+import collections
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+PROFILE_ENV = "CRYPTOTUNNEL_PROFILE"
+
+SPAN_HANDSHAKE = 1
+SPAN_ENCRYPT = 2
+SPAN_SEND = 3
+SPAN_RECV = 4
+SPAN_DECRYPT = 5
+SPAN_WRITE = 6
+
+SPAN_NAMES = {
+    SPAN_HANDSHAKE: "handshake",
+    SPAN_ENCRYPT: "encrypt",
+    SPAN_SEND: "send",
+    SPAN_RECV: "recv",
+    SPAN_DECRYPT: "decrypt",
+    SPAN_WRITE: "write",
+}
+
+TRACE_MAGIC = b"CTTRACE1"
+_RECORD = struct.Struct("<BIQI")
+_COUNT = struct.Struct("<I")
+_MAX_DURATION = 0xFFFFFFFF
+
+
+class SpanTracer:
+    """Fixed-capacity ring buffer of timed spans; oldest records are overwritten."""
+
+    def __init__(self, capacity: int = 65536):
+        """Preallocate room for ``capacity`` records."""
+        if capacity < 1:
+            raise ValueError("Trace capacity must be positive")
+        self.capacity = capacity
+        self._buffer = bytearray(capacity * _RECORD.size)
+        self._written = 0
+
+    def record(self, kind: int, seq: int, start_ns: int, end_ns: int) -> None:
+        """Store one span measured with ``time.perf_counter_ns``."""
+        slot = self._written % self.capacity
+        _RECORD.pack_into(
+            self._buffer,
+            slot * _RECORD.size,
+            kind,
+            seq & 0xFFFFFFFF,
+            start_ns,
+            min(end_ns - start_ns, _MAX_DURATION),
+        )
+        self._written += 1
+
+    @contextmanager
+    def span(self, kind: int, seq: int = 0) -> Iterator[None]:
+        """Record the duration of the ``with`` block."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(kind, seq, start, time.perf_counter_ns())
+
+    def records(self) -> list[tuple[int, int, int, int]]:
+        """Return the retained spans, oldest first."""
+        count = min(self._written, self.capacity)
+        first = self._written - count
+        return [
+            _RECORD.unpack_from(
+                self._buffer, ((first + i) % self.capacity) * _RECORD.size
+            )
+            for i in range(count)
+        ]
+
+    def dump(self, path: str) -> int:
+        """Write the retained spans to ``path`` and return how many."""
+        records = self.records()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(TRACE_MAGIC + _COUNT.pack(len(records)))
+            for record in records:
+                handle.write(_RECORD.pack(*record))
+        os.replace(tmp_path, path)
+        return len(records)
+
+
+def load_trace(path: str) -> list[tuple[int, int, int, int]]:
+    """Read spans written by ``SpanTracer.dump``."""
+    with open(path, "rb") as handle:
+        blob = handle.read()
+    header = len(TRACE_MAGIC) + _COUNT.size
+    if len(blob) < header or not blob.startswith(TRACE_MAGIC):
+        raise ValueError("Not a span trace file")
+    (count,) = _COUNT.unpack_from(blob, len(TRACE_MAGIC))
+    if len(blob) != header + count * _RECORD.size:
+        raise ValueError("Truncated span trace file")
+    return [
+        _RECORD.unpack_from(blob, header + i * _RECORD.size) for i in range(count)
+    ]
+
+
+@contextmanager
+def traced(tracer: SpanTracer | None, kind: int, seq: int = 0) -> Iterator[None]:
+    """Record a span when a tracer is configured, otherwise do nothing."""
+    if tracer is None:
+        yield
+        return
+    with tracer.span(kind, seq):
+        yield
+
+
+def install_trace_dump(
+    tracer: SpanTracer, path: str, signum: int | None = None
+) -> None:
+    """Dump the trace at interpreter exit and whenever ``signum`` arrives.
+
+    Signal handlers can only be installed from the main thread; ``signum``
+    defaults to SIGUSR1 where the platform has it.
+    """
+    atexit.register(tracer.dump, path)
+    if signum is None:
+        signum = getattr(signal, "SIGUSR1", None)
+    if signum is not None and threading.current_thread() is threading.main_thread():
+        signal.signal(signum, lambda *_: tracer.dump(path))
+
+
+class StackSampler:
+    """Sample every thread's Python stack at a fixed interval."""
+
+    def __init__(self, interval: float = 0.005):
+        """Configure the sampling period in seconds."""
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(
+                        f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                    )
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self) -> None:
+        """Begin sampling in a daemon thread."""
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampler thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path: str) -> None:
+        """Write samples in the folded stack format."""
+        with open(path, "w", encoding="utf-8") as handle:
+            for stack, count in self.stacks.most_common():
+                handle.write(f"{stack} {count}\n")
+
+
+def parse_profile_spec(spec: str) -> tuple[str, str]:
+    """Split ``MODE:PATH`` into its parts; a bare path selects cProfile."""
+    mode, sep, path = spec.partition(":")
+    if not sep or mode not in ("cprofile", "stacks"):
+        return "cprofile", spec
+    if not path:
+        raise ValueError(f"Missing output path in profile spec {spec!r}")
+    return mode, path
+
+
+@contextmanager
+def profiling(spec: str | None = None) -> Iterator[None]:
+    """Profile the ``with`` block as described by ``spec`` or the environment."""
+    if spec is None:
+        spec = os.environ.get(PROFILE_ENV) or None
+    if spec is None:
+        yield
+        return
+    mode, path = parse_profile_spec(spec)
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    else:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(path)
+
+
+def add_arguments(parser) -> None:
+    """Register the shared ``--profile`` and ``--trace`` CLI options."""
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help=(
+            "Profile the run: cprofile:PATH (or PATH) or stacks:PATH for "
+            f"folded flame-graph stacks (default: ${PROFILE_ENV})"
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record per-packet spans and dump them here on exit or SIGUSR1",
+    )
+    parser.add_argument(
+        "--trace-capacity",
+        type=int,
+        default=65536,
+        help="Spans kept in the trace ring buffer",
+    )
+
+
+def tracer_from_args(args) -> SpanTracer | None:
+    """Create and arm the span tracer requested on the command line."""
+    if not args.trace:
+        return None
+    tracer = SpanTracer(args.trace_capacity)
+    install_trace_dump(tracer, args.trace)
+    return tracer
+
+
+def summarize(records: list[tuple[int, int, int, int]]) -> str:
+    """Format count, mean, p50 and p99 duration per span kind."""
+    by_kind: dict[int, list[int]] = {}
+    for kind, _, _, duration in records:
+        by_kind.setdefault(kind, []).append(duration)
+    columns = ("count", "mean us", "p50 us", "p99 us")
+    lines = [f"{'span':<10} " + " ".join(f"{name:>10}" for name in columns)]
+    for kind, durations in sorted(by_kind.items()):
+        durations.sort()
+        mean = sum(durations) / len(durations)
+        p50 = durations[len(durations) // 2]
+        p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+        name = SPAN_NAMES.get(kind, str(kind))
+        lines.append(
+            f"{name:<10} {len(durations):>10} {mean / 1e3:>10.1f} "
+            f"{p50 / 1e3:>10.1f} {p99 / 1e3:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m src.vpn.profiling TRACE_FILE")
+    print(summarize(load_trace(sys.argv[1])))
@@ -0,0 +1,341 @@
+"""Resumable file transfer verified by a SHA-256 Merkle chunk manifest.
+
+The sender publishes a manifest (file size, chunk size, per-chunk leaf
+hashes and their Merkle root).  The receiver persists which chunks it has
+verified and repeatedly asks for the ranges it is still missing, so a
+transfer interrupted at any point restarts where it stopped; chunks kept
+from an earlier run are re-hashed first so corrupted ones are fetched again.
+The transfer ends once the digests of every chunk written reproduce the
+manifest's Merkle root.
+
+The receiver's state file is a fixed header (magic, chunk count, Merkle
+root) followed by one byte per chunk; progress is saved by rewriting only
+the bytes of chunks verified since the previous save.
+
+Messages (one per tunnel packet, big-endian)::
+
+    MANIFEST  type | file size u64 | chunk size u32 | chunks u32 | root
+    LEAVES    type | first index u32 | leaf hashes...
+    REQUEST   type | last u8 | (start u32, count u32)...
+    CHUNK     type | index u32 | data
+    DONE      type                       (requested chunks were all sent)
+    COMPLETE  type                       (root verified, sender may stop)
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from dataclasses import dataclass
+
+from ..crypto.merkle import MerkleBuilder, leaf_hash, merkle_root
+from .pmtu import max_payload_size
+from .tunnel import SecureTunnel
+
+MSG_MANIFEST = 1
+MSG_LEAVES = 2
+MSG_REQUEST = 3
+MSG_CHUNK = 4
+MSG_DONE = 5
+MSG_COMPLETE = 6
+
+_TYPE = struct.Struct("!B")
+_MANIFEST = struct.Struct("!BQII32s")
+_INDEX = struct.Struct("!BI")
+_REQUEST = struct.Struct("!BB")
+_RANGE = struct.Struct("!II")
+
+LEAVES_PER_PACKET = 64
+RANGES_PER_PACKET = 250
+STATE_SAVE_INTERVAL = 256
+
+# State file header: magic, chunk count, Merkle root.
+_STATE_HEADER = struct.Struct("!4sI32s")
+_STATE_MAGIC = b"CTR1"
+
+
+@dataclass
+class Manifest:
+    file_size: int
+    chunk_size: int
+    leaves: list[bytes]
+    root: bytes
+
+
+def build_manifest(path: str, chunk_size: int) -> Manifest:
+    """Hash a file chunk by chunk into its Merkle manifest."""
+    builder = MerkleBuilder()
+    leaves = []
+    size = 0
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            leaves.append(builder.add_chunk(chunk))
+            size += len(chunk)
+    return Manifest(size, chunk_size, leaves, builder.root())
+
+
+def _ranges(bitmap: bytearray) -> list[tuple[int, int]]:
+    """Collapse the indices of unset entries into (start, count) ranges."""
+    ranges = []
+    start = None
+    for index, done in enumerate(bitmap):
+        if not done and start is None:
+            start = index
+        elif done and start is not None:
+            ranges.append((start, index - start))
+            start = None
+    if start is not None:
+        ranges.append((start, len(bitmap) - start))
+    return ranges
+
+
+def _recv(tunnel: SecureTunnel) -> bytes | None:
+    """Receive one message, mapping timeouts and bad packets to None."""
+    try:
+        message = tunnel.receive_packet()
+    except (OSError, ValueError):
+        return None
+    return message or None
+
+
+def _per_packet(tunnel: SecureTunnel, header: int, item: int, limit: int) -> int:
+    """How many ``item``-byte entries fit one packet after ``header`` bytes."""
+    return max(1, min(limit, (max_payload_size(tunnel) - header) // item))
+
+
+def _send_manifest(tunnel: SecureTunnel, manifest: Manifest) -> None:
+    tunnel.send_packet(
+        _MANIFEST.pack(
+            MSG_MANIFEST,
+            manifest.file_size,
+            manifest.chunk_size,
+            len(manifest.leaves),
+            manifest.root,
+        )
+    )
+    per_packet = _per_packet(tunnel, _INDEX.size, 32, LEAVES_PER_PACKET)
+    for first in range(0, len(manifest.leaves), per_packet):
+        batch = manifest.leaves[first : first + per_packet]
+        tunnel.send_packet(_INDEX.pack(MSG_LEAVES, first) + b"".join(batch))
+
+
+def send_file_resumable(
+    tunnel: SecureTunnel,
+    path: str,
+    chunk_size: int,
+    *,
+    timeout: float = 2.0,
+    max_idle: int = 30,
+) -> None:
+    """Serve manifest and requested chunks until the receiver confirms.
+
+    ``chunk_size`` is lowered if a chunk would not fit the agreed datagram.
+    """
+    chunk_size = min(chunk_size, max_payload_size(tunnel) - _INDEX.size)
+    manifest = build_manifest(path, chunk_size)
+    tunnel.sock.settimeout(timeout)
+    _send_manifest(tunnel, manifest)
+    idle = 0
+    with open(path, "rb") as handle:
+        while True:
+            message = _recv(tunnel)
+            if message is None:
+                idle += 1
+                if idle > max_idle:
+                    raise TimeoutError("Receiver stopped responding")
+                _send_manifest(tunnel, manifest)
+                continue
+            idle = 0
+            msg_type = message[0]
+            if msg_type == MSG_COMPLETE:
+                return
+            if msg_type != MSG_REQUEST or len(message) < _REQUEST.size:
+                continue
+            _, last = _REQUEST.unpack_from(message)
+            body = message[_REQUEST.size :]
+            for offset in range(0, len(body) - _RANGE.size + 1, _RANGE.size):
+                start, count = _RANGE.unpack_from(body, offset)
+                end = min(start + count, len(manifest.leaves))
+                for index in range(start, end):
+                    handle.seek(index * chunk_size)
+                    chunk = handle.read(chunk_size)
+                    tunnel.send_packet(_INDEX.pack(MSG_CHUNK, index) + chunk)
+            if last:
+                tunnel.send_packet(_TYPE.pack(MSG_DONE))
+
+
+class _TransferState:
+    """Verified-chunk bitmap persisted next to the output file."""
+
+    def __init__(self, path: str, manifest: Manifest):
+        self.path = path
+        self.bitmap = bytearray(len(manifest.leaves))
+        # Indices whose entry changed since the last save.
+        self._dirty: set[int] = set()
+        header = _STATE_HEADER.pack(_STATE_MAGIC, len(self.bitmap), manifest.root)
+        if os.path.exists(path):
+            with open(path, "rb") as handle:
+                saved = handle.read(len(header) + len(self.bitmap) + 1)
+            if saved[: len(header)] == header:
+                bitmap = saved[len(header) :]
+                if len(bitmap) == len(self.bitmap):
+                    self.bitmap[:] = bitmap
+                    return
+        # New or stale state: start from an all-missing bitmap.
+        with open(path, "wb") as handle:
+            handle.write(header)
+            handle.truncate(len(header) + len(self.bitmap))
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def mark(self, index: int, done: bool = True) -> None:
+        """Record chunk ``index`` as verified (or as missing again)."""
+        self.bitmap[index] = int(done)
+        self._dirty.add(index)
+
+    def save(self) -> None:
+        """Write the entries changed since the last save and sync them."""
+        if not self._dirty:
+            return
+        dirty = sorted(self._dirty)
+        self._dirty.clear()
+        with open(self.path, "r+b") as handle:
+            start = previous = dirty[0]
+            for index in dirty[1:] + [None]:
+                if index == previous + 1:
+                    previous = index
+                    continue
+                handle.seek(_STATE_HEADER.size + start)
+                handle.write(self.bitmap[start : previous + 1])
+                if index is not None:
+                    start = previous = index
+            handle.flush()
+            os.fsync(handle.fileno())
+
+
+def _receive_manifest(tunnel: SecureTunnel, max_idle: int) -> Manifest:
+    """Collect MANIFEST and LEAVES packets and check them against the root."""
+    header = None
+    leaves: dict[int, bytes] = {}
+    idle = 0
+    while header is None or len(leaves) < header[2]:
+        message = _recv(tunnel)
+        if message is None:
+            idle += 1
+            if idle > max_idle:
+                raise TimeoutError("Sender never delivered a manifest")
+            continue
+        idle = 0
+        if message[0] == MSG_MANIFEST and len(message) == _MANIFEST.size:
+            _, file_size, chunk_size, count, root = _MANIFEST.unpack(message)
+            header = (file_size, chunk_size, count, root)
+        elif message[0] == MSG_LEAVES and len(message) >= _INDEX.size:
+            _, first = _INDEX.unpack_from(message)
+            body = message[_INDEX.size :]
+            for offset in range(0, len(body) - 31, 32):
+                leaves[first + offset // 32] = body[offset : offset + 32]
+    file_size, chunk_size, count, root = header
+    if any(index not in leaves for index in range(count)):
+        raise ValueError("Manifest leaves do not cover every chunk")
+    ordered = [leaves[index] for index in range(count)]
+    if merkle_root(ordered) != root:
+        raise ValueError("Manifest leaves do not match the announced root")
+    if chunk_size == 0 or -(-file_size // chunk_size) != count:
+        raise ValueError("Manifest size does not match its chunk count")
+    return Manifest(file_size, chunk_size, ordered, root)
+
+
+def _request_missing(tunnel: SecureTunnel, missing: list[tuple[int, int]]) -> None:
+    per_packet = _per_packet(tunnel, _REQUEST.size, _RANGE.size, RANGES_PER_PACKET)
+    for first in range(0, len(missing), per_packet):
+        batch = missing[first : first + per_packet]
+        last = first + per_packet >= len(missing)
+        body = b"".join(_RANGE.pack(start, count) for start, count in batch)
+        tunnel.send_packet(_REQUEST.pack(MSG_REQUEST, int(last)) + body)
+
+
+def _recheck_saved_chunks(
+    handle, manifest: Manifest, state: _TransferState, digests: list
+) -> None:
+    """Re-hash chunks kept from a previous run, unmarking corrupted ones."""
+    for index, done in enumerate(state.bitmap):
+        if not done:
+            continue
+        handle.seek(index * manifest.chunk_size)
+        digest = leaf_hash(handle.read(manifest.chunk_size))
+        if digest == manifest.leaves[index]:
+            digests[index] = digest
+        else:
+            state.mark(index, False)
+
+
+def receive_file_resumable(
+    tunnel: SecureTunnel,
+    output_path: str,
+    *,
+    state_path: str | None = None,
+    timeout: float = 2.0,
+    max_idle: int = 10,
+) -> Manifest:
+    """Fetch missing chunks until the output file matches the manifest root."""
+    if state_path is None:
+        state_path = output_path + ".state"
+    tunnel.sock.settimeout(timeout)
+    manifest = _receive_manifest(tunnel, max_idle)
+    state = _TransferState(state_path, manifest)
+    digests: list[bytes | None] = [None] * len(manifest.leaves)
+    mode = "r+b" if os.path.exists(output_path) else "w+b"
+    with open(output_path, mode) as handle:
+        handle.truncate(manifest.file_size)
+        _recheck_saved_chunks(handle, manifest, state, digests)
+        idle = 0
+        while True:
+            missing = _ranges(state.bitmap)
+            if not missing:
+                break
+            _request_missing(tunnel, missing)
+            received = 0
+            while True:
+                message = _recv(tunnel)
+                if message is None:
+                    idle += 1
+                    if idle > max_idle:
+                        raise TimeoutError("Sender stopped responding")
+                    break
+                idle = 0
+                if message[0] == MSG_DONE:
+                    break
+                if message[0] != MSG_CHUNK or len(message) < _INDEX.size:
+                    continue
+                _, index = _INDEX.unpack_from(message)
+                chunk = message[_INDEX.size :]
+                if index >= len(manifest.leaves) or state.bitmap[index]:
+                    continue
+                digest = leaf_hash(chunk)
+                if digest != manifest.leaves[index]:
+                    continue
+                digests[index] = digest
+                handle.seek(index * manifest.chunk_size)
+                handle.write(chunk)
+                state.mark(index)
+                received += 1
+                if received % STATE_SAVE_INTERVAL == 0:
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                    state.save()
+            handle.flush()
+            os.fsync(handle.fileno())
+            state.save()
+    if merkle_root(digests) != manifest.root:
+        raise ValueError("Received chunks do not reproduce the manifest root")
+    # The sender stops on the first COMPLETE; repeat it in case one is lost.
+    for _ in range(3):
+        try:
+            tunnel.send_packet(_TYPE.pack(MSG_COMPLETE))
+        except OSError:
+            break
+    os.remove(state_path)
+    return manifest
@@ -0,0 +1,227 @@
+"""Weighted fair sharing of one sender between flows.
+
+Packets leave a socket in the order they are handed to it, so a bulk
+transfer queued ahead of an ACK delays the ACK by its whole backlog.
+``SendScheduler`` sits in front of the send calls instead:
+
+* each flow (a tunnel, or one stream inside a tunnel) has its own bounded
+  FIFO; a packet that finds its queue full is dropped rather than growing
+  the backlog;
+* flows share the sender by deficit round robin: every round a flow earns
+  ``quantum * weight`` bytes of credit and sends while the credit covers
+  its next packet, so bandwidth splits by weight whatever the packet sizes;
+* control packets (ACKs, handshake replies) bypass the flows with strict
+  priority and leave before the next data packet;
+* the time every packet spent queued is recorded per flow in ``FlowStats``
+  and, given a ``MetricsRegistry``, in ``cryptotunnel_flow_queue_seconds``.
+
+Payloads are handed to the flow's ``send`` callable only when dispatched,
+so a flow over ``SecureTunnel.send_packet`` is sealed in dispatch order and
+its sequence numbers stay increasing.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Callable
+
+from .metrics import Histogram, MetricsRegistry
+
+DEFAULT_QUANTUM = 1500
+CONTROL_FLOW = "control"
+
+Send = Callable[[bytes], object]
+
+
+@dataclass
+class FlowStats:
+    enqueued: int = 0
+    sent: int = 0
+    bytes_sent: int = 0
+    # Refused because the flow's queue was full.
+    dropped: int = 0
+    delay_total: float = 0.0
+    delay_max: float = 0.0
+
+    @property
+    def mean_delay(self) -> float:
+        """Average seconds a sent packet waited in the queue."""
+        return self.delay_total / self.sent if self.sent else 0.0
+
+
+class _Flow:
+    def __init__(self, name: str, send: Send | None, weight: float, limit: int):
+        self.name = name
+        self.send = send
+        self.weight = weight
+        self.limit = limit
+        self.deficit = 0.0
+        # (payload, send, enqueued at)
+        self.queue: deque[tuple[bytes, Send, float]] = deque()
+        self.stats = FlowStats()
+        self.delay: Histogram | None = None
+        self.drops = None
+
+
+class SendScheduler:
+    """Deficit round robin over per-flow queues, control packets first.
+
+    Any thread may submit; ``dispatch`` should be called by the one thread
+    that owns the sender, which keeps every flow's packets in order.
+    """
+
+    def __init__(
+        self,
+        *,
+        quantum: int = DEFAULT_QUANTUM,
+        control_limit: int = 256,
+        clock: Callable[[], float] = time.monotonic,
+        registry: MetricsRegistry | None = None,
+    ):
+        """Create a scheduler granting ``quantum`` bytes per unit of weight."""
+        if quantum < 1:
+            raise ValueError("Scheduler quantum must be positive")
+        self.quantum = quantum
+        self.clock = clock
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._flows: dict[str, _Flow] = {}
+        # Flows with queued packets, in round-robin order.
+        self._active: deque[_Flow] = deque()
+        self._control = self._new_flow(CONTROL_FLOW, None, 1.0, control_limit)
+
+    def _new_flow(self, name: str, send, weight: float, limit: int) -> _Flow:
+        if weight <= 0 or limit < 1:
+            raise ValueError("Flow weight and queue limit must be positive")
+        flow = _Flow(name, send, weight, limit)
+        if self.registry is not None:
+            labels = {"flow": name}
+            flow.delay = self.registry.histogram(
+                "cryptotunnel_flow_queue_seconds",
+                "Time a packet waited in its flow's send queue",
+                labels,
+            )
+            flow.drops = self.registry.counter(
+                "cryptotunnel_flow_dropped_total",
+                "Packets refused because the flow's queue was full",
+                labels,
+            )
+        return flow
+
+    def add_flow(
+        self, name: str, send: Send, *, weight: float = 1.0, limit: int = 64
+    ) -> None:
+        """Register a flow sending through ``send`` with the given share."""
+        with self._lock:
+            if name in self._flows or name == CONTROL_FLOW:
+                raise ValueError(f"Flow {name!r} already exists")
+            self._flows[name] = self._new_flow(name, send, weight, limit)
+
+    def remove_flow(self, name: str) -> int:
+        """Forget a flow and return how many queued packets were discarded."""
+        with self._lock:
+            flow = self._flows.pop(name)
+            if flow in self._active:
+                self._active.remove(flow)
+            return len(flow.queue)
+
+    def set_weight(self, name: str, weight: float) -> None:
+        """Change a flow's share from its next round on."""
+        if weight <= 0:
+            raise ValueError("Flow weight must be positive")
+        with self._lock:
+            self._flows[name].weight = weight
+
+    def stats(self, name: str) -> FlowStats:
+        """Snapshot of a flow's counters, or of control's for ``CONTROL_FLOW``."""
+        with self._lock:
+            flow = self._control if name == CONTROL_FLOW else self._flows[name]
+            return replace(flow.stats)
+
+    def queued(self, name: str) -> int:
+        """Packets waiting in one flow's queue."""
+        with self._lock:
+            flow = self._control if name == CONTROL_FLOW else self._flows[name]
+            return len(flow.queue)
+
+    @property
+    def pending(self) -> int:
+        """Packets waiting in every queue."""
+        with self._lock:
+            flows = [self._control, *self._active]
+            return sum(len(flow.queue) for flow in flows)
+
+    def submit(self, name: str, payload: bytes, send: Send | None = None) -> bool:
+        """Queue a data packet; return False if the flow's queue is full.
+
+        ``send`` overrides the flow's callable for this packet only, e.g. to
+        end a stream with a different frame type after its queued data.
+        """
+        with self._lock:
+            flow = self._flows[name]
+            if not self._enqueue(flow, payload, send or flow.send):
+                return False
+            if len(flow.queue) == 1:
+                # Joining the round: the first turn comes with its credit.
+                flow.deficit = self.quantum * flow.weight
+                self._active.append(flow)
+            return True
+
+    def submit_control(self, payload: bytes, send: Send) -> bool:
+        """Queue a control packet to leave ahead of every data packet."""
+        with self._lock:
+            return self._enqueue(self._control, payload, send)
+
+    def _enqueue(self, flow: _Flow, payload: bytes, send: Send) -> bool:
+        if len(flow.queue) >= flow.limit:
+            flow.stats.dropped += 1
+            if flow.drops is not None:
+                flow.drops.inc()
+            return False
+        flow.queue.append((bytes(payload), send, self.clock()))
+        flow.stats.enqueued += 1
+        return True
+
+    def dispatch(self, limit: int | None = None) -> int:
+        """Send up to ``limit`` queued packets (all by default); return the count."""
+        sent = 0
+        while limit is None or sent < limit:
+            with self._lock:
+                picked = self._next()
+            if picked is None:
+                break
+            flow, payload, send, queued_at = picked
+            delay = self.clock() - queued_at
+            send(payload)
+            with self._lock:
+                stats = flow.stats
+                stats.sent += 1
+                stats.bytes_sent += len(payload)
+                stats.delay_total += delay
+                stats.delay_max = max(stats.delay_max, delay)
+                if flow.delay is not None:
+                    flow.delay.observe(delay)
+            sent += 1
+        return sent
+
+    def _next(self) -> tuple[_Flow, bytes, Send, float] | None:
+        if self._control.queue:
+            return (self._control, *self._control.queue.popleft())
+        while self._active:
+            flow = self._active[0]
+            payload = flow.queue[0][0]
+            if len(payload) <= flow.deficit:
+                flow.deficit -= len(payload)
+                item = flow.queue.popleft()
+                if not flow.queue:
+                    # An idle flow does not bank credit.
+                    self._active.popleft()
+                    flow.deficit = 0.0
+                return (flow, *item)
+            # Turn over: back of the round with the next turn's credit.
+            self._active.rotate(-1)
+            flow.deficit += self.quantum * flow.weight
+        return None
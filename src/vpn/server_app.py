@@ -3,14 +3,44 @@
 from __future__ import annotations
 
 import argparse
+import os
 import socket
 
 from ..protocol.handshake import HandshakeServer
+from ..protocol.resumption import TICKET_KEY_SIZE, TicketIssuer
 from ..protocol.serialization import (
     decode_handshake_message,
     encode_handshake_message,
+    encode_handshake_reject,
+)
+from .compression import compressor_for, parse_algorithms
+from .delta import receive_file_delta
+from .fec import fec_for, parse_fec
+from .forwarder import forward_tun
+from .metrics import MetricsRegistry, TunnelMetrics, handshake_timer, serve_metrics
+from .pmtu import MAX_DATAGRAM, MIN_DATAGRAM, answer_probe
+from .prefetch import PrefetchPolicy
+from .profiling import (
+    SPAN_HANDSHAKE,
+    SPAN_WRITE,
+    SpanTracer,
+    add_arguments as add_profiling_arguments,
+    profiling,
+    traced,
+    tracer_from_args,
+)
+from .resumable import receive_file_resumable
+from .tunnel import (
+    FRAME_CLOSE,
+    FRAME_DATA,
+    FRAME_END,
+    FRAME_OPEN,
+    CoalescePolicy,
+    Frame,
+    SecureTunnel,
+    SessionKeys,
+    StreamMetadata,
 )
-from .tunnel import SecureTunnel, SessionKeys
 
 
 def load_psk(path: str) -> bytes:
@@ -19,50 +49,296 @@ def load_psk(path: str) -> bytes:
         return handle.read()
 
 
-def receive_handshake(sock: socket.socket, psk: bytes) -> tuple[SessionKeys, tuple[str, int]]:
+def load_ticket_key(path: str) -> bytes:
+    """Read the ticket-sealing key, creating it on first use.
+
+    Sharing the key across restarts keeps issued tickets valid; the replay
+    cache is per process, which is harmless because a replayed resumption
+    hello still needs the ticket secret to derive the session keys.
+    """
+    if not os.path.exists(path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(os.urandom(TICKET_KEY_SIZE))
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def receive_handshake(
+    sock: socket.socket,
+    psk: bytes,
+    *,
+    ticket_issuer: TicketIssuer | None = None,
+    legacy_json: bool = False,
+    options: dict[str, int] | None = None,
+    metrics: MetricsRegistry | None = None,
+    tracer: SpanTracer | None = None,
+) -> tuple[SessionKeys, tuple[str, int]]:
     """Process client hello, respond, and return session keys plus address."""
-    server = HandshakeServer(psk)
-    data, addr = sock.recvfrom(4096)
-    client_msg = decode_handshake_message(data)
-    response, keys = server.process_client_hello(client_msg)
-    sock.sendto(encode_handshake_message(response), addr)
+    server = HandshakeServer(psk, ticket_issuer=ticket_issuer, options=options)
+    while True:
+        data, addr = sock.recvfrom(4096)
+        client_msg = decode_handshake_message(data, legacy_json=legacy_json)
+        try:
+            with handshake_timer(metrics, "server_process"), traced(
+                tracer, SPAN_HANDSHAKE
+            ):
+                response, keys = server.process_client_hello(client_msg)
+        except ValueError:
+            if "ticket" not in client_msg["payload"]:
+                raise
+            # Unusable ticket: ask the client to fall back to a full handshake.
+            sock.sendto(encode_handshake_reject(legacy_json=legacy_json), addr)
+            continue
+        break
+    sock.sendto(encode_handshake_message(response, legacy_json=legacy_json), addr)
     session = SessionKeys(
-        enc_key=keys.client_enc,
-        mac_key=keys.client_mac,
+        enc_key=keys.server_enc,
+        mac_key=keys.server_mac,
         base_nonce=keys.base_nonce,
+        options=keys.options,
+        recv_key=keys.client_enc,
     )
     return session, addr
 
 
+def _create_output(path: str, size: int, mode: int = 0o644) -> int:
+    """Create the output file with its final size preallocated."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, mode)
+    if size:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # No posix_fallocate here, or unsupported by the filesystem.
+            os.ftruncate(fd, size)
+    return fd
+
+
+def _write_at(fd: int, metadata: StreamMetadata, frame: Frame) -> int:
+    """Write a data frame at its offset, refusing writes past the stream end."""
+    if frame.offset + len(frame.body) > metadata.size:
+        raise ValueError(f"{metadata.path}: data beyond the announced size")
+    return os.pwrite(fd, frame.body, frame.offset)
+
+
 def receive_file(tunnel: SecureTunnel, output_path: str) -> None:
-    """Write decrypted chunks from the tunnel into a file."""
-    with open(output_path, "wb") as handle:
+    """Write each decrypted chunk of the stream at its offset in a file."""
+    fd = None
+    metadata = None
+    written = 0
+    try:
         while True:
-            chunk = tunnel.receive_packet()
-            if chunk == b"END":
+            frame = tunnel.receive_frame()
+            if answer_probe(tunnel, frame):
+                continue
+            if frame.frame_type == FRAME_OPEN:
+                metadata = StreamMetadata.decode(frame.body)
+                fd = _create_output(output_path, metadata.size)
+            elif frame.frame_type == FRAME_DATA:
+                if fd is None:
+                    raise ValueError("Data received before the stream was opened")
+                with traced(tunnel.tracer, SPAN_WRITE, tunnel.recv_seq - 1):
+                    written += _write_at(fd, metadata, frame)
+            elif frame.frame_type in (FRAME_END, FRAME_CLOSE):
                 break
-            handle.write(chunk)
+    finally:
+        if fd is not None:
+            os.close(fd)
+    if metadata is None:
+        raise ValueError("Session closed without a file stream")
+    if written != metadata.size:
+        raise ValueError(
+            f"Stream ended after {written} of {metadata.size} bytes"
+        )
 
 
-def main() -> None:
-    """CLI entry point for the secure tunnel server."""
-    parser = argparse.ArgumentParser(description="Secure tunnel server")
-    parser.add_argument("--listen-host", default="0.0.0.0")
-    parser.add_argument("--listen-port", type=int, required=True)
-    parser.add_argument("--psk-file", required=True)
-    parser.add_argument("--output-file", required=True)
-    args = parser.parse_args()
+def _safe_join(root: str, name: str) -> str:
+    """Resolve a stream path below root, refusing absolute or '..' paths."""
+    parts = name.split("/")
+    if name.startswith("/") or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Unsafe stream path {name!r}")
+    return os.path.join(root, *parts)
+
+
+def receive_directory(tunnel: SecureTunnel, output_dir: str) -> list[str]:
+    """Recreate every streamed file below output_dir until the session closes."""
+    # stream id -> [fd, metadata, bytes written]
+    streams: dict[int, list] = {}
+    received = []
+    try:
+        while True:
+            frame = tunnel.receive_frame()
+            if answer_probe(tunnel, frame):
+                continue
+            if frame.frame_type == FRAME_CLOSE:
+                break
+            if frame.frame_type == FRAME_OPEN:
+                if frame.stream_id in streams:
+                    raise ValueError(f"Stream {frame.stream_id} opened twice")
+                metadata = StreamMetadata.decode(frame.body)
+                path = _safe_join(output_dir, metadata.path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd = _create_output(path, metadata.size, metadata.mode & 0o777)
+                streams[frame.stream_id] = [fd, metadata, 0]
+                continue
+            if frame.stream_id not in streams:
+                raise ValueError(f"Frame for unknown stream {frame.stream_id}")
+            state = streams[frame.stream_id]
+            fd, metadata, written = state
+            if frame.frame_type == FRAME_DATA:
+                with traced(tunnel.tracer, SPAN_WRITE, tunnel.recv_seq - 1):
+                    state[2] += _write_at(fd, metadata, frame)
+            elif frame.frame_type == FRAME_END:
+                del streams[frame.stream_id]
+                os.fchmod(fd, metadata.mode & 0o777)
+                os.close(fd)
+                if written != metadata.size:
+                    raise ValueError(
+                        f"{metadata.path}: got {written} of {metadata.size} bytes"
+                    )
+                received.append(metadata.path)
+    finally:
+        for fd, _, _ in streams.values():
+            os.close(fd)
+    return received
+
 
+def _run(args: argparse.Namespace, tracer: SpanTracer | None) -> None:
+    """Perform the handshake and transfer selected on the command line."""
     psk = load_psk(args.psk_file)
+    registry = MetricsRegistry()
+    if args.metrics_port is not None:
+        serve_metrics(registry, args.metrics_host, args.metrics_port)
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((args.listen_host, args.listen_port))
 
-    session_keys, client_addr = receive_handshake(sock, psk)
+    ticket_issuer = None
+    if args.ticket_key_file:
+        ticket_issuer = TicketIssuer(
+            key=load_ticket_key(args.ticket_key_file),
+            lifetime=args.ticket_lifetime,
+        )
+    session_keys, client_addr = receive_handshake(
+        sock,
+        psk,
+        ticket_issuer=ticket_issuer,
+        legacy_json=args.json_handshake,
+        options={
+            "compression": parse_algorithms(args.compression),
+            # FEC groups would hold forwarded packets back; files only.
+            "fec": 0 if args.tun else parse_fec(args.fec),
+            "mtu": args.mtu,
+        },
+        metrics=registry,
+        tracer=tracer,
+    )
     sock.connect(client_addr)
-    tunnel = SecureTunnel(sock, session_keys)
-    receive_file(tunnel, args.output_file)
+    tunnel = SecureTunnel(
+        sock,
+        session_keys,
+        compressor=compressor_for(session_keys.options),
+        metrics=TunnelMetrics(registry),
+        tracer=tracer,
+        prefetch=PrefetchPolicy(args.prefetch_bytes) if args.prefetch_bytes else None,
+        coalesce=CoalescePolicy(max_delay=None) if args.tun else None,
+    )
+    tunnel = fec_for(tunnel, session_keys.options)
+    if args.tun:
+        forward_tun(tunnel, args.tun)
+    elif args.resumable:
+        receive_file_resumable(
+            tunnel, args.output_file, state_path=args.state_file
+        )
+    elif args.output_dir:
+        receive_directory(tunnel, args.output_dir)
+    elif args.delta:
+        receive_file_delta(
+            tunnel, args.output_file, block_size=args.delta_block_size
+        )
+    else:
+        receive_file(tunnel, args.output_file)
+    tunnel.close()
     sock.close()
 
 
+def main() -> None:
+    """CLI entry point for the secure tunnel server."""
+    parser = argparse.ArgumentParser(description="Secure tunnel server")
+    parser.add_argument("--listen-host", default="0.0.0.0")
+    parser.add_argument("--listen-port", type=int, required=True)
+    parser.add_argument("--psk-file", required=True)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output-file")
+    target.add_argument(
+        "--output-dir", help="Receive a directory tree sent with --input-dir"
+    )
+    target.add_argument(
+        "--tun",
+        metavar="NAME",
+        help="Forward IP packets of a new TUN interface, e.g. cryptotun%%d",
+    )
+    parser.add_argument(
+        "--ticket-key-file",
+        help="Enable session resumption tickets sealed with this key file",
+    )
+    parser.add_argument("--ticket-lifetime", type=float, default=300.0)
+    parser.add_argument(
+        "--json-handshake",
+        action="store_true",
+        help="Use the legacy JSON/hex handshake encoding",
+    )
+    parser.add_argument(
+        "--compression",
+        default="zlib,lzma,bz2",
+        help="Compression algorithms to accept (empty to disable)",
+    )
+    parser.add_argument(
+        "--mtu",
+        type=int,
+        default=MAX_DATAGRAM,
+        help="Largest datagram to accept when the client asks to probe the path",
+    )
+    parser.add_argument(
+        "--fec",
+        default="16:4",
+        help="Largest FEC group K:M to accept (0:0 to disable)",
+    )
+    parser.add_argument(
+        "--resumable",
+        action="store_true",
+        help="Verify chunks against the client's Merkle manifest and resume",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="Progress file for --resumable (default: <output-file>.state)",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Update the existing output file from a delta sent by the client",
+    )
+    parser.add_argument("--delta-block-size", type=int, default=2048)
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Expose Prometheus metrics on this port while the server runs",
+    )
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    parser.add_argument(
+        "--prefetch-bytes",
+        type=int,
+        default=0,
+        help="Precompute keystream for upcoming packets in up to N bytes",
+    )
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    if (args.output_dir or args.tun) and (args.resumable or args.delta):
+        parser.error("--resumable and --delta require --output-file")
+    if args.mtu < MIN_DATAGRAM:
+        parser.error(f"--mtu must be at least {MIN_DATAGRAM}")
+    with profiling(args.profile):
+        _run(args, tracer_from_args(args))
+
+
 if __name__ == "__main__":
     main()
@@ -5,12 +5,55 @@ from __future__ import annotations
 import os
 import socket
 import struct
-from dataclasses import dataclass
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
 
 from ..crypto.chacha20_poly1305 import (
     chacha20_poly1305_decrypt,
     chacha20_poly1305_encrypt,
+    chacha20_poly1305_open,
+    chacha20_poly1305_seal,
 )
+from ..crypto.hmac_sha256 import hkdf_expand
+from .compression import Compressor
+from .metrics import TunnelMetrics
+from .prefetch import LANE_RECV, LANE_SEND, KeystreamPrefetcher, PrefetchPolicy, wipe
+from .profiling import SPAN_DECRYPT, SPAN_ENCRYPT, SPAN_RECV, SPAN_SEND, SpanTracer
+
+# Packet header: key epoch (u16) + flags (u8) + per-epoch sequence number
+# (u64).  The header is authenticated as part of the AEAD associated data.
+_HEADER = struct.Struct("!HBQ")
+_TAG_SIZE = 16
+PACKET_OVERHEAD = _HEADER.size + _TAG_SIZE
+# Receive buffer unless the handshake agreed on an "mtu" option.
+DEFAULT_MAX_DATAGRAM = 4096
+FLAG_COMPRESSED = 0x01
+FLAG_FRAMED = 0x02
+FLAG_COALESCED = 0x04
+_KNOWN_FLAGS = FLAG_COMPRESSED | FLAG_FRAMED | FLAG_COALESCED
+MAX_EPOCH = 0xFFFF
+# How many epochs the receiver may ratchet forward when whole epochs were lost.
+MAX_EPOCH_SKIP = 4
+
+# Stream frames (packets flagged FLAG_FRAMED): type (u8) + stream id (u32).
+_FRAME = struct.Struct("!BI")
+FRAME_OPEN = 1  # body: StreamMetadata
+FRAME_DATA = 2  # body: byte offset (u64) + stream bytes
+FRAME_END = 3  # end of one stream
+FRAME_CLOSE = 4  # no further streams in this session
+FRAME_PROBE = 5  # stream 0, body: datagram size (u16) + padding
+FRAME_PROBE_ACK = 6  # stream 0, body: datagram size (u16) of the probe
+_STREAM_META = struct.Struct("!QH")
+_DATA_OFFSET = struct.Struct("!Q")
+# Bytes a FRAME_DATA frame adds around its stream bytes.
+DATA_FRAME_OVERHEAD = _FRAME.size + _DATA_OFFSET.size
+
+# Coalesced packets (FLAG_COALESCED) hold several payloads, each prefixed
+# with its own flags (u8, FLAG_FRAMED only) and length (u16).
+_SUBFRAME = struct.Struct("!BH")
 
 
 @dataclass
@@ -18,44 +61,505 @@ class SessionKeys:
     enc_key: bytes
     mac_key: bytes
     base_nonce: bytes
+    options: dict[str, int] = field(default_factory=dict)
+    # Key for the peer-to-us direction; None means the same key both ways.
+    recv_key: bytes | None = None
+
+
+@dataclass
+class Frame:
+    frame_type: int
+    stream_id: int
+    body: bytes
+    # Position of a FRAME_DATA body within its stream.
+    offset: int = 0
+
+
+@dataclass
+class StreamMetadata:
+    """Describes the file carried by a stream: relative path, size, mode."""
+
+    path: str
+    size: int
+    mode: int
+
+    def encode(self) -> bytes:
+        """Serialize as size (u64), permission bits (u16), UTF-8 path."""
+        return _STREAM_META.pack(self.size, self.mode & 0o7777) + self.path.encode()
+
+    @classmethod
+    def decode(cls, body: bytes) -> "StreamMetadata":
+        """Parse the body of a FRAME_OPEN frame."""
+        if len(body) <= _STREAM_META.size:
+            raise ValueError("Truncated stream metadata")
+        size, mode = _STREAM_META.unpack_from(body)
+        try:
+            path = body[_STREAM_META.size :].decode()
+        except UnicodeDecodeError:
+            raise ValueError("Invalid stream path") from None
+        return cls(path=path, size=size, mode=mode)
+
+
+@dataclass
+class RekeyPolicy:
+    """Thresholds after which the sender ratchets to a new epoch key."""
+
+    max_packets: int | None = None
+    max_bytes: int | None = None
+    max_age: float | None = None
+
+    def due(self, packets: int, nbytes: int, age: float) -> bool:
+        """Return True once any configured threshold has been reached."""
+        return (
+            (self.max_packets is not None and packets >= self.max_packets)
+            or (self.max_bytes is not None and nbytes >= self.max_bytes)
+            or (self.max_age is not None and age >= self.max_age)
+        )
+
+
+@dataclass
+class CoalescePolicy:
+    """Budget for batching small payloads into one sealed packet."""
+
+    # Plaintext bytes per coalesced packet, sub-frame headers included;
+    # None fills the datagram size agreed in the handshake.
+    max_bytes: int | None = None
+    # Longest a buffered payload may wait; None waits for the budget or flush().
+    max_delay: float | None = 0.002
+
+
+def encode_frame(frame_type: int, stream_id: int, body: bytes = b"") -> bytes:
+    """Serialize a stream frame (the plaintext of a FLAG_FRAMED packet)."""
+    return _FRAME.pack(frame_type, stream_id) + body
+
+
+def encode_data_body(offset: int, data) -> bytes:
+    """Build the body of a FRAME_DATA frame from any buffer."""
+    return _DATA_OFFSET.pack(offset) + data
+
+
+def decode_frame(plaintext: bytes) -> Frame:
+    """Parse a stream frame, splitting off the offset of data frames."""
+    if len(plaintext) < _FRAME.size:
+        raise ValueError("Expected a stream frame")
+    frame_type, stream_id = _FRAME.unpack_from(plaintext)
+    if frame_type != FRAME_DATA:
+        return Frame(frame_type, stream_id, plaintext[_FRAME.size :])
+    if len(plaintext) < _FRAME.size + _DATA_OFFSET.size:
+        raise ValueError("Truncated data frame")
+    (offset,) = _DATA_OFFSET.unpack_from(plaintext, _FRAME.size)
+    body = plaintext[_FRAME.size + _DATA_OFFSET.size :]
+    return Frame(frame_type, stream_id, body, offset)
+
+
+def derive_nonce(base_nonce: bytes, seq: int) -> bytes:
+    """Mix the base nonce with the sequence to obtain a unique nonce."""
+    seq_bytes = seq.to_bytes(12, "big")
+    return bytes(a ^ b for a, b in zip(base_nonce, seq_bytes))
+
+
+def ratchet_key(key: bytes, epoch: int) -> bytes:
+    """Derive the key for ``epoch`` from the key of the preceding epoch."""
+    return hkdf_expand(key, b"cryptotunnel rekey" + epoch.to_bytes(2, "big"), 32)
 
 
 class SecureTunnel:
-    def __init__(self, sock: socket.socket, keys: SessionKeys):
-        """Wrap a socket-like object with encryption/authentication."""
+    def __init__(
+        self,
+        sock: socket.socket,
+        keys: SessionKeys,
+        *,
+        rekey: RekeyPolicy | None = None,
+        epoch_grace: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+        compressor: Compressor | None = None,
+        metrics: TunnelMetrics | None = None,
+        tracer: SpanTracer | None = None,
+        coalesce: CoalescePolicy | None = None,
+        prefetch: PrefetchPolicy | None = None,
+    ):
+        """Wrap a socket-like object with encryption/authentication.
+
+        With a ``rekey`` policy the sender moves to a new key epoch whenever a
+        threshold is hit; the receiver follows the epoch carried in each
+        header and keeps the previous key for ``epoch_grace`` seconds so
+        packets still in flight remain decryptable.
+
+        A ``compressor`` (normally built from the handshake options) shrinks
+        payloads before encryption and inflates flagged packets on receipt.
+
+        With ``metrics`` every packet updates traffic counters, drop and
+        authentication-failure counts, and AEAD/socket latency histograms;
+        a ``tracer`` records encrypt/send/recv/decrypt spans per packet.
+
+        With a ``coalesce`` policy, payloads small enough to share a packet
+        are buffered and sealed together once the byte budget fills, the
+        delay expires, ``flush()`` is called or the tunnel starts waiting
+        for a packet; the receiver splits them back apart transparently.
+
+        With ``prefetch`` a background worker precomputes keystream for the
+        next packets in both directions; call ``close()`` to stop it.
+        """
         self.sock = sock
         self.keys = keys
+        # Largest datagram either side may send, as agreed in the handshake.
+        self.max_datagram = keys.options.get("mtu") or DEFAULT_MAX_DATAGRAM
+        self.compressor = compressor
+        self.metrics = metrics
+        self.tracer = tracer
+        self._instrumented = metrics is not None or tracer is not None
+        self.rekey = rekey
+        self.epoch_grace = epoch_grace
+        self._clock = clock
+
+        self.send_epoch = 0
         self.send_seq = 0
+        self._send_key = keys.enc_key
+        self._send_bytes = 0
+        self._send_epoch_started = clock()
+
+        self.recv_epoch = 0
         self.recv_seq = 0
+        self._recv_key = keys.recv_key if keys.recv_key is not None else keys.enc_key
+        # (epoch, key, next expected seq, expiry) of the superseded epoch.
+        self._prev_recv: tuple[int, bytes, int, float] | None = None
+
+        self.coalesce = coalesce
+        self._batch_budget = self.max_datagram - PACKET_OVERHEAD
+        if coalesce is not None and coalesce.max_bytes is not None:
+            self._batch_budget = min(coalesce.max_bytes, self._batch_budget)
+        self._batch: list[tuple[int, bytes]] = []
+        self._batch_size = 0
+        # Monotonic time by which the buffered batch must leave.
+        self._batch_deadline: float | None = None
+        # Serializes sends with the flusher thread.
+        self._send_lock = threading.RLock()
+        self._flush_wakeup = threading.Condition(self._send_lock)
+        self._flusher: threading.Thread | None = None
+        self._closed = False
+        # Payloads split from a coalesced packet, not yet returned.
+        self._pending: deque[tuple[int, bytes]] = deque()
+
+        self.prefetcher: KeystreamPrefetcher | None = None
+        if prefetch is not None:
+            self.prefetcher = KeystreamPrefetcher(self._derive_nonce, prefetch)
+            self.prefetcher.position(LANE_SEND, self._send_key, 0)
+            self.prefetcher.position(LANE_RECV, self._recv_key, 0)
 
     def _derive_nonce(self, seq: int) -> bytes:
         """Mix the base nonce with the sequence to obtain a unique nonce."""
-        seq_bytes = seq.to_bytes(12, "big")
-        return bytes(a ^ b for a, b in zip(self.keys.base_nonce, seq_bytes))
+        return derive_nonce(self.keys.base_nonce, seq)
+
+    def close(self) -> None:
+        """Send buffered payloads and stop the worker threads (not the socket)."""
+        with self._send_lock:
+            self._flush_batch()
+            self._closed = True
+            self._flush_wakeup.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+
+    def _seal(self, payload: bytes, aad: bytes) -> tuple[bytes, bytes]:
+        """Encrypt the next outgoing packet, using prefetched keystream if ready."""
+        if self.prefetcher is not None:
+            entry = self.prefetcher.take(
+                LANE_SEND, self._send_key, self.send_seq, len(payload)
+            )
+            if entry is not None:
+                try:
+                    return chacha20_poly1305_seal(*entry, payload, aad)
+                finally:
+                    wipe(*entry)
+        return chacha20_poly1305_encrypt(
+            self._send_key, self._derive_nonce(self.send_seq), payload, aad
+        )
+
+    def _advance_send_epoch(self) -> None:
+        """Ratchet the sending key and restart the per-epoch counters."""
+        if self.send_epoch >= MAX_EPOCH:
+            raise ValueError("Rekey epoch space exhausted; perform a new handshake")
+        self.send_epoch += 1
+        self._send_key = ratchet_key(self._send_key, self.send_epoch)
+        self.send_seq = 0
+        self._send_bytes = 0
+        self._send_epoch_started = self._clock()
+        if self.metrics is not None:
+            self.metrics.rekeys.inc()
+            self.metrics.send_epoch.set(self.send_epoch)
 
     def send_packet(self, payload: bytes, aad: bytes = b"") -> None:
         """Encrypt payload, append tag, and push it through the socket."""
-        nonce = self._derive_nonce(self.send_seq)
-        ciphertext, tag = chacha20_poly1305_encrypt(
-            self.keys.enc_key, nonce, payload, aad
+        self._submit(payload, aad, 0)
+
+    def send_frame(self, frame_type: int, stream_id: int, body: bytes = b"") -> None:
+        """Send one stream frame as its own authenticated packet."""
+        self._submit(encode_frame(frame_type, stream_id, body), b"", FLAG_FRAMED)
+
+    def send_data(self, stream_id: int, offset: int, data) -> None:
+        """Send stream bytes (any buffer, e.g. an mmap slice) at ``offset``."""
+        self.send_frame(FRAME_DATA, stream_id, encode_data_body(offset, data))
+
+    @property
+    def pending_payloads(self) -> int:
+        """Payloads of a received coalesced packet not yet returned."""
+        return len(self._pending)
+
+    def flush(self) -> None:
+        """Seal and send any payloads buffered by the coalescing policy."""
+        with self._send_lock:
+            self._flush_batch()
+
+    def _submit(self, payload: bytes, aad: bytes, flags: int) -> None:
+        """Send a payload now, or buffer it when coalescing applies."""
+        if self.coalesce is None:
+            self._send(payload, aad, flags)
+            return
+        size = _SUBFRAME.size + len(payload)
+        with self._send_lock:
+            if aad or size > self._batch_budget:
+                # Keep send order: whatever is buffered goes out first.
+                self._flush_batch()
+                self._send(payload, aad, flags)
+                return
+            if self._batch_size + size > self._batch_budget or self._overdue():
+                self._flush_batch()
+            self._batch.append((flags, bytes(payload)))
+            self._batch_size += size
+            if len(self._batch) == 1 and self.coalesce.max_delay is not None:
+                self._batch_deadline = time.monotonic() + self.coalesce.max_delay
+                if self._flusher is None:
+                    self._flusher = threading.Thread(
+                        target=self._flush_on_deadline, daemon=True
+                    )
+                    self._flusher.start()
+                self._flush_wakeup.notify()
+
+    def _overdue(self) -> bool:
+        deadline = self._batch_deadline
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _flush_on_deadline(self) -> None:
+        """Flusher thread: send each batch whose ``max_delay`` has run out."""
+        with self._send_lock:
+            while not self._closed:
+                if self._batch_deadline is None:
+                    self._flush_wakeup.wait()
+                    continue
+                remaining = self._batch_deadline - time.monotonic()
+                if remaining > 0:
+                    self._flush_wakeup.wait(remaining)
+                    continue
+                try:
+                    self._flush_batch()
+                except OSError:
+                    # Nobody to report to; the next send hits the same error.
+                    pass
+
+    def _flush_batch(self) -> None:
+        self._batch_deadline = None
+        batch = self._batch
+        if not batch:
+            return
+        self._batch = []
+        self._batch_size = 0
+        if len(batch) == 1:
+            flags, payload = batch[0]
+            self._send(payload, b"", flags)
+            return
+        body = b"".join(
+            _SUBFRAME.pack(flags, len(payload)) + payload for flags, payload in batch
         )
-        header = struct.pack("!Q", self.send_seq)
-        self.sock.sendall(header + ciphertext + tag)
+        self._send(body, b"", FLAG_COALESCED)
+
+    def _send(self, payload: bytes, aad: bytes, flags: int) -> None:
+        if self.rekey is not None and self.rekey.due(
+            self.send_seq,
+            self._send_bytes,
+            self._clock() - self._send_epoch_started,
+        ):
+            self._advance_send_epoch()
+        if self.compressor is not None:
+            compressed, payload = self.compressor.compress(payload)
+            if compressed:
+                flags |= FLAG_COMPRESSED
+        if PACKET_OVERHEAD + len(payload) > self.max_datagram:
+            # The peer reads at most max_datagram bytes and would fail the tag.
+            raise ValueError(
+                f"{PACKET_OVERHEAD + len(payload)}-byte packet exceeds the "
+                f"{self.max_datagram}-byte datagram agreed for this session"
+            )
+        header = _HEADER.pack(self.send_epoch, flags, self.send_seq)
+        if not self._instrumented:
+            ciphertext, tag = self._seal(payload, header + aad)
+            self.sock.sendall(header + ciphertext + tag)
+        else:
+            start = time.perf_counter_ns()
+            ciphertext, tag = self._seal(payload, header + aad)
+            sealed = time.perf_counter_ns()
+            self.sock.sendall(header + ciphertext + tag)
+            sent = time.perf_counter_ns()
+            if self.metrics is not None:
+                self.metrics.encrypt_seconds.observe((sealed - start) / 1e9)
+                self.metrics.send_seconds.observe((sent - sealed) / 1e9)
+                self.metrics.packets_sent.inc()
+                self.metrics.bytes_sent.inc(len(payload))
+            if self.tracer is not None:
+                self.tracer.record(SPAN_ENCRYPT, self.send_seq, start, sealed)
+                self.tracer.record(SPAN_SEND, self.send_seq, sealed, sent)
         self.send_seq += 1
+        self._send_bytes += len(payload)
 
     def receive_packet(self, expected_aad: bytes = b"") -> bytes:
         """Read one encrypted packet and return the verified plaintext."""
-        data = self.sock.recv(4096)
-        if len(data) < 8 + 16:
-            raise ValueError("Packet too small")
-        seq = struct.unpack("!Q", data[:8])[0]
-        if seq < self.recv_seq:
-            raise ValueError("Replay detected")
+        return self._receive(expected_aad)[1]
+
+    def receive_frame(self) -> Frame:
+        """Read the next packet, which must be a stream frame."""
+        flags, plaintext = self._receive(b"")
+        if not flags & FLAG_FRAMED:
+            raise ValueError("Expected a stream frame")
+        return decode_frame(plaintext)
+
+    def _reject(self, reason: str, message: str) -> ValueError:
+        """Count a discarded packet and build the error to raise."""
+        if self.metrics is not None:
+            if reason == "replay":
+                self.metrics.replays.inc()
+            else:
+                self.metrics.dropped(reason)
+        return ValueError(message)
+
+    def _decrypt(
+        self, key: bytes, seq: int, ciphertext, aad: bytes, tag, prefetched: bool
+    ) -> bytes:
+        """Verify and decrypt, using prefetched keystream for the current epoch."""
+        if prefetched and self.prefetcher is not None:
+            entry = self.prefetcher.take(LANE_RECV, key, seq, len(ciphertext))
+            try:
+                if entry is not None:
+                    return chacha20_poly1305_open(*entry, ciphertext, aad, tag)
+                nonce = self._derive_nonce(seq)
+                return chacha20_poly1305_decrypt(key, nonce, ciphertext, aad, tag)
+            except ValueError:
+                # A forged header must not drag the window away from real traffic.
+                self.prefetcher.position(LANE_RECV, self._recv_key, self.recv_seq)
+                raise
+            finally:
+                if entry is not None:
+                    wipe(*entry)
         nonce = self._derive_nonce(seq)
-        ciphertext = data[8:-16]
-        tag = data[-16:]
-        plaintext = chacha20_poly1305_decrypt(
-            self.keys.enc_key, nonce, ciphertext, expected_aad, tag
-        )
-        self.recv_seq = seq + 1
-        return plaintext
+        return chacha20_poly1305_decrypt(key, nonce, ciphertext, aad, tag)
+
+    def _open(
+        self, key: bytes, seq: int, ciphertext, aad: bytes, tag, prefetched=True
+    ) -> bytes:
+        """Decrypt one packet, timing it and counting tag failures."""
+        if not self._instrumented:
+            return self._decrypt(key, seq, ciphertext, aad, tag, prefetched)
+        start = time.perf_counter_ns()
+        try:
+            return self._decrypt(key, seq, ciphertext, aad, tag, prefetched)
+        except ValueError:
+            if self.metrics is not None:
+                self.metrics.auth_failures.inc()
+            raise
+        finally:
+            end = time.perf_counter_ns()
+            if self.metrics is not None:
+                self.metrics.decrypt_seconds.observe((end - start) / 1e9)
+            if self.tracer is not None:
+                self.tracer.record(SPAN_DECRYPT, seq, start, end)
+
+    def _receive(self, expected_aad: bytes) -> tuple[int, bytes]:
+        if self._pending:
+            return self._pending.popleft()
+        if self._batch:
+            # The peer may be waiting on what we buffered before it replies.
+            self.flush()
+        flags, plaintext = self._receive_sealed(expected_aad)
+        if flags & FLAG_COALESCED:
+            return self._split(plaintext)
+        return flags, plaintext
+
+    def _split(self, plaintext: bytes) -> tuple[int, bytes]:
+        """Queue the sub-frames of a coalesced packet and return the first."""
+        view = memoryview(plaintext)
+        frames = []
+        offset = 0
+        while offset < len(view):
+            if offset + _SUBFRAME.size > len(view):
+                raise self._reject("coalesced", "Truncated coalesced packet")
+            flags, length = _SUBFRAME.unpack_from(view, offset)
+            offset += _SUBFRAME.size
+            if flags & ~FLAG_FRAMED or offset + length > len(view):
+                raise self._reject("coalesced", "Malformed coalesced packet")
+            frames.append((flags, bytes(view[offset : offset + length])))
+            offset += length
+        if not frames:
+            raise self._reject("coalesced", "Empty coalesced packet")
+        self._pending.extend(frames[1:])
+        return frames[0]
+
+    def _receive_sealed(self, expected_aad: bytes) -> tuple[int, bytes]:
+        if not self._instrumented:
+            data = self.sock.recv(self.max_datagram)
+        else:
+            start = time.perf_counter_ns()
+            data = self.sock.recv(self.max_datagram)
+            end = time.perf_counter_ns()
+            if self.metrics is not None:
+                self.metrics.recv_seconds.observe((end - start) / 1e9)
+        if len(data) < PACKET_OVERHEAD:
+            raise self._reject("too_small", "Packet too small")
+        epoch, flags, seq = _HEADER.unpack_from(data)
+        if self.tracer is not None:
+            self.tracer.record(SPAN_RECV, seq, start, end)
+        if flags & ~_KNOWN_FLAGS:
+            raise self._reject("unknown_flags", "Unknown packet flags")
+        header = data[: _HEADER.size]
+        ciphertext = data[_HEADER.size : -_TAG_SIZE]
+        tag = data[-_TAG_SIZE:]
+        aad = header + expected_aad
+
+        if epoch == self.recv_epoch:
+            if seq < self.recv_seq:
+                raise self._reject("replay", "Replay detected")
+            plaintext = self._open(self._recv_key, seq, ciphertext, aad, tag)
+            self.recv_seq = seq + 1
+        elif self.recv_epoch < epoch <= self.recv_epoch + MAX_EPOCH_SKIP:
+            key = self._recv_key
+            for step in range(self.recv_epoch + 1, epoch + 1):
+                key = ratchet_key(key, step)
+            plaintext = self._open(key, seq, ciphertext, aad, tag)
+            self._prev_recv = (
+                self.recv_epoch,
+                self._recv_key,
+                self.recv_seq,
+                self._clock() + self.epoch_grace,
+            )
+            self._recv_key = key
+            self.recv_epoch = epoch
+            self.recv_seq = seq + 1
+        elif self._prev_recv is not None and epoch == self._prev_recv[0]:
+            _, prev_key, prev_seq, expires_at = self._prev_recv
+            if self._clock() >= expires_at:
+                self._prev_recv = None
+                raise self._reject("expired_epoch", "Packet from expired key epoch")
+            if seq < prev_seq:
+                raise self._reject("replay", "Replay detected")
+            plaintext = self._open(prev_key, seq, ciphertext, aad, tag, False)
+            self._prev_recv = (epoch, prev_key, seq + 1, expires_at)
+        else:
+            raise self._reject("unknown_epoch", "Packet from unknown key epoch")
+        if flags & FLAG_COMPRESSED:
+            if self.compressor is None:
+                raise self._reject(
+                    "compression", "Compressed packet without negotiated compression"
+                )
+            plaintext = self.compressor.decompress(plaintext)
+        if self.metrics is not None:
+            self.metrics.packets_received.inc()
+            self.metrics.bytes_received.inc(len(plaintext))
+        return flags, plaintext
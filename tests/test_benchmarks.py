@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.harness import (
+    Result,
+    compare_reports,
+    load_report,
+    measure,
+    write_report,
+)
+
+
+class TestBenchmarkHarness(unittest.TestCase):
+    def test_report_roundtrip_includes_host_metadata(self):
+        results = [Result("sha256", 1.5, "MB/s", {"size": 64})]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.json")
+            write_report(path, results)
+            report = load_report(path)
+        self.assertIn("python", report["host"])
+        self.assertEqual(report["results"][0]["key"], "sha256[size=64]")
+        self.assertEqual(report["results"][0]["value"], 1.5)
+
+    def test_compare_flags_only_regressions_beyond_threshold(self):
+        def report(*entries):
+            return {"results": [dict(vars(r), key=r.key) for r in entries]}
+
+        baseline = report(
+            Result("aead", 10.0, "MB/s", {"size": 64}),
+            Result("handshake", 100.0, "handshakes/s"),
+            Result("latency", 1.0, "ms", higher_is_better=False),
+        )
+        current = report(
+            Result("aead", 9.5, "MB/s", {"size": 64}),
+            Result("handshake", 80.0, "handshakes/s"),
+            Result("latency", 1.5, "ms", higher_is_better=False),
+            Result("new", 1.0, "MB/s"),
+        )
+        rows = {row["key"]: row for row in compare_reports(baseline, current)}
+        self.assertEqual(set(rows), {"aead[size=64]", "handshake", "latency"})
+        self.assertFalse(rows["aead[size=64]"]["regression"])
+        self.assertTrue(rows["handshake"]["regression"])
+        self.assertTrue(rows["latency"]["regression"])
+
+    def test_measure_returns_positive_time_per_call(self):
+        self.assertGreater(measure(lambda: sum(range(100)), min_time=0.01), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,18 @@
+import os
 import unittest
 
 from src.crypto.chacha20 import chacha20_encrypt
 from src.crypto.chacha20_poly1305 import (
     chacha20_poly1305_decrypt,
     chacha20_poly1305_encrypt,
+    chacha20_poly1305_keystream,
+    chacha20_poly1305_open,
+    chacha20_poly1305_seal,
 )
 from src.crypto.hmac_sha256 import hmac_sha256, hkdf_expand, hkdf_extract
+from src.crypto.merkle import MerkleBuilder, leaf_hash, merkle_root, node_hash
 from src.crypto.poly1305 import poly1305_mac
-from src.crypto.sha256 import sha256
+from src.crypto.sha256 import sha256, sha256_many
 
 
 class TestSHA256(unittest.TestCase):
@@ -27,6 +32,15 @@ class TestSHA256(unittest.TestCase):
             ),
         )
 
+    def test_sha256_many_matches_sha256(self):
+        # Padding boundaries, a group wider than one lane batch, all-ones
+        # words for carries, and lengths with a single message.
+        messages = [os.urandom(n) for n in (0, 1, 55, 56, 63, 64, 119, 200)]
+        messages += [os.urandom(100) for _ in range(70)]
+        messages += [b"\xff" * 64, b"\xff" * 64, b"abc", b""]
+        self.assertEqual(sha256_many(messages), [sha256(m) for m in messages])
+        self.assertEqual(sha256_many([]), [])
+
 
 class TestHMACandHKDF(unittest.TestCase):
     def test_hmac_sha256_rfc4231(self):
@@ -141,6 +155,54 @@ class TestAEADChaCha20Poly1305(unittest.TestCase):
         )
         self.assertEqual(decrypted, plaintext)
 
+    def test_precomputed_keystream_matches_keyed_aead(self):
+        key = bytes(range(32))
+        nonce = bytes(range(12))
+        aad = b"header"
+        plaintext = bytes(range(256)) * 3
+        poly_key, keystream = chacha20_poly1305_keystream(key, nonce, 1024)
+        sealed = chacha20_poly1305_seal(poly_key, keystream, plaintext, aad)
+        self.assertEqual(sealed, chacha20_poly1305_encrypt(key, nonce, plaintext, aad))
+        ciphertext, tag = sealed
+        self.assertEqual(
+            chacha20_poly1305_open(poly_key, keystream, ciphertext, aad, tag),
+            plaintext,
+        )
+        with self.assertRaises(ValueError):
+            chacha20_poly1305_open(poly_key, keystream, ciphertext, b"other", tag)
+        with self.assertRaises(ValueError):
+            chacha20_poly1305_seal(poly_key, keystream[:10], plaintext, aad)
+
+
+class TestMerkle(unittest.TestCase):
+    def _reference_root(self, leaves):
+        level = list(leaves)
+        while len(level) > 1:
+            paired = [
+                node_hash(level[i], level[i + 1])
+                for i in range(0, len(level) - 1, 2)
+            ]
+            if len(level) % 2:
+                paired.append(level[-1])
+            level = paired
+        return level[0]
+
+    def test_incremental_root_matches_level_by_level_tree(self):
+        leaves = [leaf_hash(bytes([i])) for i in range(13)]
+        for count in range(1, len(leaves) + 1):
+            self.assertEqual(
+                merkle_root(leaves[:count]), self._reference_root(leaves[:count])
+            )
+
+    def test_single_chunk_change_changes_root(self):
+        builder = MerkleBuilder()
+        for chunk in (b"a", b"b", b"c"):
+            builder.add_chunk(chunk)
+        self.assertEqual(builder.count, 3)
+        self.assertNotEqual(
+            builder.root(), merkle_root(leaf_hash(c) for c in (b"a", b"x", b"c"))
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
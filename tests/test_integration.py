@@ -1,6 +1,82 @@
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
 
+from src.crypto.sha256 import sha256
+from src.vpn.compression import COMPRESSION_ZLIB, Compressor
+from src.vpn.client_app import send_directory, send_file
+from src.vpn.delta import (
+    block_signatures,
+    compute_delta,
+    receive_file_delta,
+    send_file_delta,
+)
 from src.vpn.demo_runner import demo_transfer
+from src.protocol.handshake import HandshakeClient, HandshakeServer
+from src.protocol.serialization import (
+    decode_handshake_message,
+    encode_handshake_message,
+)
+from src.vpn.fec import FecTunnel, encode_parity, fec_for, parse_fec, recover_blocks
+from src.vpn.forwarder import MAX_PACKET, PacketForwarder
+from src.vpn.handshake_pool import HandshakePool, SessionTable
+from src.vpn.loadgen import LoadConfig, percentile, run_load
+from src.vpn.memory_transport import LinkConditions, memory_socketpair
+from src.vpn.metrics import Histogram, MetricsRegistry, TunnelMetrics
+from src.vpn.pmtu import ChunkSizer, max_chunk_size, probe_path_mtu
+from src.vpn.prefetch import PrefetchPolicy
+from src.vpn.profiling import (
+    SPAN_DECRYPT,
+    SPAN_ENCRYPT,
+    SPAN_RECV,
+    SPAN_SEND,
+    SpanTracer,
+    load_trace,
+    parse_profile_spec,
+    profiling,
+)
+from src.vpn.resumable import receive_file_resumable, send_file_resumable
+from src.vpn.scheduler import CONTROL_FLOW, SendScheduler
+from src.vpn.server_app import receive_directory, receive_file
+from src.vpn.tunnel import (
+    FLAG_COALESCED,
+    FRAME_CLOSE,
+    FRAME_DATA,
+    FRAME_END,
+    FRAME_OPEN,
+    PACKET_OVERHEAD,
+    CoalescePolicy,
+    RekeyPolicy,
+    SecureTunnel,
+    SessionKeys,
+    StreamMetadata,
+    decode_frame,
+    encode_data_body,
+    encode_frame,
+)
+
+
+def _session_keys() -> SessionKeys:
+    return SessionKeys(
+        enc_key=os.urandom(32), mac_key=os.urandom(32), base_nonce=os.urandom(12)
+    )
+
+
+class _CaptureSocket:
+    """Datagram stand-in that lets tests reorder captured packets."""
+
+    def __init__(self):
+        self.sent: list[bytes] = []
+        self.inbox: list[bytes] = []
+
+    def sendall(self, data: bytes) -> None:
+        self.sent.append(bytes(data))
+
+    def recv(self, bufsize: int) -> bytes:
+        return self.inbox.pop(0)
 
 
 class TestIntegration(unittest.TestCase):
@@ -13,5 +89,1148 @@ class TestIntegration(unittest.TestCase):
         self.assertEqual(sum(len(x) for x in outputs), len(b"hello") + len(b"world") + 1024 + len(b"END"))
 
 
+class TestRekeying(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.keys = _session_keys()
+
+    def _clock(self) -> float:
+        return self.now
+
+    def test_packet_threshold_ratchets_epochs(self):
+        sock_a, sock_b = memory_socketpair()
+        sender = SecureTunnel(sock_a, self.keys, rekey=RekeyPolicy(max_packets=3))
+        receiver = SecureTunnel(sock_b, self.keys)
+        for idx in range(10):
+            sender.send_packet(bytes([idx]) * 8)
+            self.assertEqual(receiver.receive_packet(), bytes([idx]) * 8)
+        self.assertEqual(sender.send_epoch, 3)
+        self.assertEqual(receiver.recv_epoch, 3)
+        self.assertNotEqual(sender._send_key, self.keys.enc_key)
+
+    def test_byte_and_age_thresholds(self):
+        policy = RekeyPolicy(max_bytes=100, max_age=5.0)
+        self.assertFalse(policy.due(1, 99, 4.9))
+        self.assertTrue(policy.due(1, 100, 0.0))
+        self.assertTrue(policy.due(1, 0, 5.0))
+
+    def test_previous_epoch_accepted_within_grace(self):
+        send_sock, recv_sock = _CaptureSocket(), _CaptureSocket()
+        sender = SecureTunnel(
+            send_sock, self.keys, rekey=RekeyPolicy(max_packets=2), clock=self._clock
+        )
+        receiver = SecureTunnel(
+            recv_sock, self.keys, epoch_grace=1.0, clock=self._clock
+        )
+        for payload in (b"a", b"b", b"c", b"d"):
+            sender.send_packet(payload)
+        # Epoch 1 packets overtake the last packet of epoch 0.
+        recv_sock.inbox = [send_sock.sent[0], send_sock.sent[2], send_sock.sent[1]]
+        self.assertEqual(receiver.receive_packet(), b"a")
+        self.assertEqual(receiver.receive_packet(), b"c")
+        self.assertEqual(receiver.receive_packet(), b"b")
+
+        # Replays of the old epoch and late packets after the grace are refused.
+        recv_sock.inbox = [send_sock.sent[1], send_sock.sent[3]]
+        with self.assertRaises(ValueError):
+            receiver.receive_packet()
+        self.assertEqual(receiver.receive_packet(), b"d")
+        self.now = 5.0
+        recv_sock.inbox = [send_sock.sent[0]]
+        with self.assertRaises(ValueError):
+            receiver.receive_packet()
+
+    def test_rejects_tampered_epoch(self):
+        send_sock, recv_sock = _CaptureSocket(), _CaptureSocket()
+        SecureTunnel(send_sock, self.keys).send_packet(b"payload")
+        packet = bytearray(send_sock.sent[0])
+        packet[1] ^= 0x01
+        recv_sock.inbox = [bytes(packet)]
+        with self.assertRaises(ValueError):
+            SecureTunnel(recv_sock, self.keys).receive_packet()
+
+
+class TestCompression(unittest.TestCase):
+    def test_compressible_payloads_shrink_on_the_wire(self):
+        keys = _session_keys()
+        send_sock, recv_sock = _CaptureSocket(), _CaptureSocket()
+        sender = SecureTunnel(
+            send_sock, keys, compressor=Compressor(COMPRESSION_ZLIB)
+        )
+        receiver = SecureTunnel(
+            recv_sock, keys, compressor=Compressor(COMPRESSION_ZLIB)
+        )
+        text = b"2024-01-01 INFO request served in 12ms\n" * 50
+        noise = os.urandom(2000)
+        for payload in (text, noise):
+            sender.send_packet(payload)
+        self.assertLess(len(send_sock.sent[0]), len(text) // 4)
+        self.assertGreater(len(send_sock.sent[1]), len(noise))
+
+        recv_sock.inbox = list(send_sock.sent)
+        self.assertEqual(receiver.receive_packet(), text)
+        self.assertEqual(receiver.receive_packet(), noise)
+        stats = sender.compressor.stats
+        self.assertEqual((stats.packets, stats.compressed_packets), (2, 1))
+        self.assertGreater(stats.ratio, 1.5)
+
+    def test_incompressible_sample_triggers_backoff(self):
+        compressor = Compressor(COMPRESSION_ZLIB, backoff=3)
+        self.assertFalse(compressor.compress(os.urandom(4096))[0])
+        text = b"a" * 4096
+        for _ in range(3):
+            self.assertEqual(compressor.compress(text), (False, text))
+        self.assertTrue(compressor.compress(text)[0])
+
+    def test_small_frames_do_not_trigger_backoff(self):
+        compressor = Compressor(COMPRESSION_ZLIB)
+        self.assertEqual(compressor.compress(b"abc"), (False, b"abc"))
+        self.assertFalse(compressor.compress(os.urandom(200))[0])
+        text = b"the quick brown fox jumps over the lazy dog " * 140
+        compressed, payload = compressor.compress(text)
+        self.assertTrue(compressed)
+        self.assertLess(len(payload), len(text) // 10)
+
+    def test_rejects_compressed_packet_without_negotiation(self):
+        keys = _session_keys()
+        send_sock, recv_sock = _CaptureSocket(), _CaptureSocket()
+        SecureTunnel(
+            send_sock, keys, compressor=Compressor(COMPRESSION_ZLIB)
+        ).send_packet(b"z" * 1000)
+        recv_sock.inbox = list(send_sock.sent)
+        with self.assertRaises(ValueError):
+            SecureTunnel(recv_sock, keys).receive_packet()
+
+
+class TestDeltaEncoding(unittest.TestCase):
+    def _apply(self, basis, block_size, steps):
+        out = b""
+        for step in steps:
+            if step[0] == "copy":
+                out += basis[step[1] * block_size : (step[1] + step[2]) * block_size]
+            else:
+                out += step[1]
+        return out
+
+    def test_delta_reconstructs_edits_insertions_and_moves(self):
+        old = os.urandom(4096)
+        new = old[2048:] + b"inserted" + old[:1000] + b"x" + old[1001:2048]
+        steps = list(compute_delta(new, 256, block_signatures(old, 256)))
+        self.assertEqual(self._apply(old, 256, steps), new)
+        literal = sum(len(step[1]) for step in steps if step[0] == "literal")
+        self.assertLess(literal, 3 * 256 + 8)
+
+    def test_signatures_are_streamed_in_hash_batches(self):
+        data = os.urandom(150 * 16 + 7)
+        signatures = block_signatures(data, 16)
+        self.assertIs(iter(signatures), signatures)
+        strong = [digest for _, digest in signatures]
+        blocks = [data[i : i + 16] for i in range(0, 150 * 16, 16)]
+        self.assertEqual(strong, [sha256(block) for block in blocks])
+        self.assertEqual(list(block_signatures(b"short", 16)), [])
+
+    def test_without_basis_everything_is_literal(self):
+        data = os.urandom(5000)
+        steps = list(compute_delta(data, 256, []))
+        self.assertTrue(all(step[0] == "literal" for step in steps))
+        self.assertEqual(b"".join(step[1] for step in steps), data)
+
+
+class TestStreams(unittest.TestCase):
+    def _pair(self):
+        keys = _session_keys()
+        sock_a, sock_b = memory_socketpair()
+        return SecureTunnel(sock_a, keys), SecureTunnel(sock_b, keys)
+
+    def test_file_made_of_end_marker_is_not_truncated(self):
+        sender, receiver = self._pair()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            with open(input_path, "wb") as handle:
+                handle.write(b"END")
+            thread = threading.Thread(
+                target=receive_file, args=(receiver, output_path), daemon=True
+            )
+            thread.start()
+            send_file(sender, input_path)
+            thread.join(timeout=2)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), b"END")
+
+    def test_directory_tree_with_interleaved_streams(self):
+        sender, receiver = self._pair()
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            contents = {
+                "a.txt": b"alpha" * 1000,
+                "empty.bin": b"",
+                "nested/b.bin": os.urandom(5000),
+                "nested/deeper/c.log": b"log line\n" * 300,
+            }
+            for name, data in contents.items():
+                path = os.path.join(src, *name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as handle:
+                    handle.write(data)
+            os.chmod(os.path.join(src, "a.txt"), 0o600)
+
+            frame_types = []
+            original_send = sender.send_frame
+
+            def recording_send(frame_type, stream_id, body=b""):
+                frame_types.append((frame_type, stream_id))
+                original_send(frame_type, stream_id, body)
+
+            sender.send_frame = recording_send
+            result = []
+            thread = threading.Thread(
+                target=lambda: result.extend(receive_directory(receiver, dst)),
+                daemon=True,
+            )
+            thread.start()
+            self.assertEqual(send_directory(sender, src, max_in_flight=3), 4)
+            thread.join(timeout=5)
+
+            self.assertEqual(sorted(result), sorted(contents))
+            for name, data in contents.items():
+                with open(os.path.join(dst, *name.split("/")), "rb") as handle:
+                    self.assertEqual(handle.read(), data)
+            mode = os.stat(os.path.join(dst, "a.txt")).st_mode & 0o777
+            self.assertEqual(mode, 0o600)
+            # Data frames of different streams are interleaved.
+            data_streams = [sid for kind, sid in frame_types if kind == FRAME_DATA]
+            self.assertNotEqual(data_streams, sorted(data_streams))
+
+    def test_directory_streams_split_the_tunnel_by_weight(self):
+        sender, receiver = self._pair()
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            contents = {"a.bin": os.urandom(40960), "b.bin": os.urandom(40960)}
+            for name, data in contents.items():
+                with open(os.path.join(src, name), "wb") as handle:
+                    handle.write(data)
+            frame_types = []
+            original_send = sender.send_frame
+
+            def recording_send(frame_type, stream_id, body=b""):
+                frame_types.append((frame_type, stream_id))
+                original_send(frame_type, stream_id, body)
+
+            sender.send_frame = recording_send
+            result = []
+            thread = threading.Thread(
+                target=lambda: result.extend(receive_directory(receiver, dst)),
+                daemon=True,
+            )
+            thread.start()
+            scheduler = SendScheduler()
+            sent = send_directory(
+                sender, src, scheduler=scheduler, weights={"a.bin": 3.0}
+            )
+            self.assertEqual(sent, 2)
+            thread.join(timeout=5)
+
+            self.assertEqual(sorted(result), sorted(contents))
+            for name, data in contents.items():
+                with open(os.path.join(dst, name), "rb") as handle:
+                    self.assertEqual(handle.read(), data)
+            # Both announcements went first, as control packets.
+            self.assertEqual(frame_types[:2], [(FRAME_OPEN, 1), (FRAME_OPEN, 2)])
+            self.assertEqual(scheduler.stats(CONTROL_FLOW).sent, 2)
+            data_streams = [sid for kind, sid in frame_types if kind == FRAME_DATA]
+            first = data_streams[:20]
+            self.assertGreaterEqual(first.count(1), 14)
+            self.assertGreaterEqual(first.count(2), 4)
+            self.assertEqual(frame_types[-1][0], FRAME_CLOSE)
+
+    def test_out_of_order_chunks_land_at_their_offsets(self):
+        sender, receiver = self._pair()
+        data = os.urandom(5000)
+        sender.send_frame(FRAME_OPEN, 1, StreamMetadata("f", len(data), 0o644).encode())
+        for offset in (4096, 2048, 0):
+            sender.send_data(1, offset, memoryview(data)[offset : offset + 2048])
+        sender.send_frame(FRAME_END, 1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_path = os.path.join(tmpdir, "out.bin")
+            receive_file(receiver, output_path)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), data)
+
+    def test_rejects_data_beyond_announced_size(self):
+        sender, receiver = self._pair()
+        sender.send_frame(FRAME_OPEN, 1, StreamMetadata("f", 10, 0o644).encode())
+        sender.send_data(1, 8, b"abcd")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(ValueError):
+                receive_file(receiver, os.path.join(tmpdir, "out.bin"))
+
+    def test_rejects_path_traversal(self):
+        sender, receiver = self._pair()
+        sender.send_frame(FRAME_OPEN, 1, StreamMetadata("../evil", 1, 0o644).encode())
+        with tempfile.TemporaryDirectory() as dst:
+            with self.assertRaises(ValueError):
+                receive_directory(receiver, dst)
+
+
 if __name__ == "__main__":
     unittest.main()
+
+
+class TestMetrics(unittest.TestCase):
+    def test_tunnel_counts_traffic_replays_and_auth_failures(self):
+        registry = MetricsRegistry()
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender = SecureTunnel(sock, keys, metrics=TunnelMetrics(registry))
+        receiver = SecureTunnel(sock, keys, metrics=TunnelMetrics(registry))
+        sender.send_packet(b"a" * 100)
+        sender.send_packet(b"b" * 50)
+        first, second = sock.sent
+        tampered = second[:-1] + bytes([second[-1] ^ 1])
+        sock.inbox.extend([first, tampered, second, first, b"x"])
+        self.assertEqual(receiver.receive_packet(), b"a" * 100)
+        with self.assertRaises(ValueError):
+            receiver.receive_packet()
+        # After the tampered copy failed, the genuine one is still accepted.
+        self.assertEqual(receiver.receive_packet(), b"b" * 50)
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                receiver.receive_packet()
+
+        metrics = receiver.metrics
+        self.assertEqual(metrics.packets_sent.value, 2)
+        self.assertEqual(metrics.bytes_sent.value, 150)
+        self.assertEqual(metrics.packets_received.value, 2)
+        self.assertEqual(metrics.bytes_received.value, 150)
+        self.assertEqual(metrics.auth_failures.value, 1)
+        self.assertEqual(metrics.replays.value, 1)
+        self.assertEqual(metrics.decrypt_seconds.count, 3)
+        self.assertEqual(metrics.encrypt_seconds.count, 2)
+
+        page = registry.render()
+        self.assertIn("# TYPE cryptotunnel_aead_seconds histogram", page)
+        self.assertIn('cryptotunnel_dropped_packets_total{reason="too_small"} 1', page)
+        self.assertIn('cryptotunnel_aead_seconds_count{op="encrypt"} 2', page)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value)
+        lines = list(histogram.samples("h", (("op", "x"),)))
+        self.assertEqual(lines[0], 'h_bucket{op="x",le="0.1"} 2')
+        self.assertEqual(lines[1], 'h_bucket{op="x",le="1.0"} 3')
+        self.assertEqual(lines[2], 'h_bucket{op="x",le="+Inf"} 4')
+        self.assertEqual(lines[4], 'h_count{op="x"} 4')
+
+    def test_registry_returns_existing_instrument(self):
+        registry = MetricsRegistry()
+        self.assertIs(registry.counter("c_total"), registry.counter("c_total"))
+        with self.assertRaises(ValueError):
+            registry.gauge("c_total")
+
+
+class TestProfiling(unittest.TestCase):
+    def test_tunnel_records_packet_spans(self):
+        tracer = SpanTracer(capacity=16)
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender = SecureTunnel(sock, keys, tracer=tracer)
+        receiver = SecureTunnel(sock, keys, tracer=tracer)
+        for payload in (b"one", b"two"):
+            sender.send_packet(payload)
+            sock.inbox.append(sock.sent[-1])
+            self.assertEqual(receiver.receive_packet(), payload)
+        kinds = [(kind, seq) for kind, seq, _, _ in tracer.records()]
+        self.assertEqual(
+            kinds,
+            [
+                (SPAN_ENCRYPT, 0),
+                (SPAN_SEND, 0),
+                (SPAN_RECV, 0),
+                (SPAN_DECRYPT, 0),
+                (SPAN_ENCRYPT, 1),
+                (SPAN_SEND, 1),
+                (SPAN_RECV, 1),
+                (SPAN_DECRYPT, 1),
+            ],
+        )
+
+    def test_ring_buffer_keeps_newest_spans_and_roundtrips(self):
+        tracer = SpanTracer(capacity=3)
+        for seq in range(5):
+            tracer.record(SPAN_SEND, seq, 1000 * seq, 1000 * seq + 7)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "trace.bin")
+            self.assertEqual(tracer.dump(path), 3)
+            records = load_trace(path)
+        self.assertEqual([seq for _, seq, _, _ in records], [2, 3, 4])
+        self.assertEqual(records[0], (SPAN_SEND, 2, 2000, 7))
+
+    def test_profile_spec_and_stack_output(self):
+        self.assertEqual(parse_profile_spec("out.prof"), ("cprofile", "out.prof"))
+        self.assertEqual(parse_profile_spec("stacks:s.txt"), ("stacks", "s.txt"))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "stacks.txt")
+            with profiling(f"stacks:{path}"):
+                worker = threading.Thread(target=demo_transfer, args=(b"psk",))
+                worker.start()
+                worker.join()
+            with open(path, "r", encoding="utf-8") as handle:
+                lines = handle.read().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn(":", stack)
+
+
+class TestMemoryTransport(unittest.TestCase):
+    def test_datagram_boundaries_are_preserved(self):
+        a, b = memory_socketpair()
+        a.sendall(b"first")
+        a.sendmsg([b"sec", b"ond"])
+        a.sendall(b"x" * 100)
+        self.assertEqual(b.recv(4096), b"first")
+        buffer = bytearray(16)
+        self.assertEqual(b.recv_into(buffer), 6)
+        self.assertEqual(bytes(buffer[:6]), b"second")
+        # Like UDP, a short read truncates the datagram instead of splitting it.
+        self.assertEqual(b.recv(10), b"x" * 10)
+        b.settimeout(0.01)
+        with self.assertRaises(socket.timeout):
+            b.recv(4096)
+
+    def test_full_queue_applies_backpressure(self):
+        a, b = memory_socketpair(capacity=2)
+        a.settimeout(0.05)
+        a.sendall(b"1")
+        a.sendall(b"2")
+        with self.assertRaises(socket.timeout):
+            a.sendall(b"3")
+        a.settimeout(2.0)
+        reader = threading.Timer(0.05, b.recv, args=(4096,))
+        reader.start()
+        a.sendall(b"3")
+        reader.join()
+        self.assertEqual(a.stats.blocked, 1)
+        self.assertEqual([b.recv(4096), b.recv(4096)], [b"2", b"3"])
+
+    def test_impairments_are_reproducible_for_a_seed(self):
+        def run():
+            conditions = LinkConditions(
+                loss=0.2, duplicate=0.1, reorder=0.2, reorder_delay=0.002, seed=7
+            )
+            a, b = memory_socketpair(conditions)
+            for i in range(200):
+                a.sendall(i.to_bytes(2, "big"))
+            time.sleep(0.01)
+            b.settimeout(0)
+            received = []
+            try:
+                while True:
+                    received.append(int.from_bytes(b.recv(16), "big"))
+            except socket.timeout:
+                pass
+            return a.stats, received
+
+        stats, received = run()
+        self.assertEqual(run(), (stats, received))
+        self.assertGreater(stats.dropped, 0)
+        self.assertGreater(stats.duplicated, 0)
+        self.assertNotEqual(received, sorted(received))
+        self.assertEqual(len(received), 200 - stats.dropped + stats.duplicated)
+
+    def test_latency_and_bandwidth_delay_delivery(self):
+        a, b = memory_socketpair(LinkConditions(latency=0.03, bandwidth=10_000))
+        start = time.monotonic()
+        a.sendall(b"x" * 200)  # 20 ms on the wire plus 30 ms latency
+        self.assertEqual(len(b.recv(4096)), 200)
+        self.assertGreaterEqual(time.monotonic() - start, 0.045)
+
+    def test_tunnel_survives_a_lossy_link(self):
+        keys = _session_keys()
+        a, b = memory_socketpair(LinkConditions(loss=0.3, seed=1))
+        sender, receiver = SecureTunnel(a, keys), SecureTunnel(b, keys)
+        for i in range(20):
+            sender.send_packet(b"packet %d" % i)
+        b.settimeout(0.05)
+        received = []
+        with self.assertRaises(socket.timeout):
+            while True:
+                received.append(receiver.receive_packet())
+        self.assertEqual(len(received), 20 - a.stats.dropped)
+        self.assertEqual(received, sorted(received, key=lambda p: int(p.split()[1])))
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def _check(self, report, clients):
+        self.assertEqual(report.clients, clients)
+        self.assertGreaterEqual(report.handshakes, clients)
+        self.assertGreater(report.packets_received, 0)
+        self.assertEqual(report.packets_received, report.packets_sent)
+        self.assertEqual(report.bytes_received, report.packets_received * 64)
+        self.assertEqual(report.errors, {})
+        self.assertGreater(report.handshake_p99, 0)
+
+    def test_thread_clients_over_memory_link(self):
+        config = LoadConfig(
+            clients=3,
+            transport="memory",
+            duration=0.4,
+            send_rate=40,
+            packet_size=64,
+        )
+        self._check(run_load(config), 3)
+
+    def test_asyncio_clients_over_memory_link(self):
+        config = LoadConfig(
+            clients=3,
+            mode="asyncio",
+            transport="memory",
+            duration=0.4,
+            send_rate=40,
+            packet_size=64,
+        )
+        self._check(run_load(config), 3)
+
+    def test_process_mode_requires_udp(self):
+        with self.assertRaises(ValueError):
+            run_load(LoadConfig(mode="process", transport="memory"))
+
+    def test_percentile_nearest_rank(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 50.0)
+        self.assertEqual(percentile(values, 0.99), 99.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+class TestForwardErrorCorrection(unittest.TestCase):
+    def test_reed_solomon_rebuilds_any_erasures(self):
+        blocks = [os.urandom(40) for _ in range(5)]
+        shards = dict(enumerate(blocks + encode_parity(blocks, 3)))
+        for lost in ((0, 1, 2), (4, 5, 7), (1, 3, 6), (2,)):
+            available = {i: b for i, b in shards.items() if i not in lost}
+            rebuilt = recover_blocks(5, 3, available)
+            for index in lost:
+                if index < 5:
+                    self.assertEqual(rebuilt[index], blocks[index])
+
+    def test_single_parity_is_xor(self):
+        blocks = [os.urandom(16) for _ in range(4)]
+        (parity,) = encode_parity(blocks, 1)
+        expected = bytes(a ^ b ^ c ^ d for a, b, c, d in zip(*blocks))
+        self.assertEqual(parity, expected)
+        with self.assertRaises(ValueError):
+            recover_blocks(4, 1, {0: blocks[0], 1: blocks[1]})
+
+    def test_lost_packets_are_rebuilt_in_order(self):
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender = FecTunnel(SecureTunnel(sock, keys), 4, 2)
+        receiver = FecTunnel(SecureTunnel(sock, keys), 4, 2)
+        payloads = [os.urandom(n) for n in (10, 300, 0, 77, 5, 64)]
+        for payload in payloads:
+            sender.send_packet(payload)
+        sender.flush()
+        # Group 0: four data + two parity; group 1: two data + two parity.
+        self.assertEqual(len(sock.sent), 10)
+        sock.inbox = [p for i, p in enumerate(sock.sent) if i not in (0, 2, 7)]
+        received = [receiver.receive_packet() for _ in payloads]
+        self.assertEqual(received, payloads)
+        self.assertEqual(receiver.stats.recovered, 3)
+        self.assertEqual(receiver.stats.lost, 0)
+
+    def test_unrecoverable_group_is_skipped(self):
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender = FecTunnel(SecureTunnel(sock, keys), 3, 1)
+        receiver = FecTunnel(SecureTunnel(sock, keys), 3, 1)
+        for payload in (b"a", b"b", b"c", b"d"):
+            sender.send_packet(payload)
+        sender.flush()
+        # Two losses in group 0 exceed its single parity packet.
+        sock.inbox = [sock.sent[0]] + sock.sent[4:]
+        self.assertEqual([receiver.receive_packet() for _ in range(2)], [b"a", b"d"])
+        self.assertEqual(receiver.stats.lost, 2)
+
+    def test_file_transfer_over_lossy_link(self):
+        keys = _session_keys()
+        sock_a, sock_b = memory_socketpair(LinkConditions(loss=0.1, seed=5))
+        sock_b.settimeout(2)
+        sender = fec_for(SecureTunnel(sock_a, keys), {"fec": parse_fec("8:3")})
+        receiver = fec_for(SecureTunnel(sock_b, keys), {"fec": parse_fec("8:3")})
+        self.assertIsInstance(sender, FecTunnel)
+        data = os.urandom(40000)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            with open(input_path, "wb") as handle:
+                handle.write(data)
+            thread = threading.Thread(
+                target=receive_file, args=(receiver, output_path), daemon=True
+            )
+            thread.start()
+            send_file(sender, input_path)
+            thread.join(timeout=10)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), data)
+        self.assertGreater(sock_a.stats.dropped, 0)
+
+    def test_reordered_packets_count_as_erasures(self):
+        keys = _session_keys()
+        conditions = LinkConditions(
+            reorder=0.03, reorder_delay=0.05, duplicate=0.05, seed=3
+        )
+        sock_a, sock_b = memory_socketpair(conditions)
+        sock_b.settimeout(2)
+        sender = FecTunnel(SecureTunnel(sock_a, keys), 8, 3)
+        receiver = FecTunnel(SecureTunnel(sock_b, keys), 8, 3)
+        data = os.urandom(40000)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            with open(input_path, "wb") as handle:
+                handle.write(data)
+            thread = threading.Thread(
+                target=receive_file, args=(receiver, output_path), daemon=True
+            )
+            thread.start()
+            send_file(sender, input_path)
+            thread.join(timeout=10)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), data)
+        self.assertGreater(sock_a.stats.reordered, 0)
+        self.assertGreater(receiver.stats.rejected, 0)
+        self.assertEqual(receiver.stats.lost, 0)
+        self.assertGreater(receiver.stats.recovered, 0)
+        self.assertEqual(receiver.stats.lost, 0)
+
+    def test_disabled_fec_returns_plain_tunnel(self):
+        tunnel = SecureTunnel(_CaptureSocket(), _session_keys())
+        self.assertIs(fec_for(tunnel, {"fec": parse_fec("0:0")}), tunnel)
+        self.assertIs(fec_for(tunnel, {}), tunnel)
+        with self.assertRaises(ValueError):
+            parse_fec("8")
+
+
+class TestCoalescing(unittest.TestCase):
+    def _pair(self, policy):
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender = SecureTunnel(sock, keys, coalesce=policy)
+        return sock, sender, SecureTunnel(sock, keys)
+
+    def test_small_payloads_share_one_packet(self):
+        sock, sender, receiver = self._pair(CoalescePolicy(max_delay=None))
+        payloads = [os.urandom(n) for n in (1, 20, 0, 300)]
+        for payload in payloads:
+            sender.send_packet(payload)
+        sender.send_frame(FRAME_END, 7)
+        self.assertEqual(sock.sent, [])
+        sender.flush()
+        self.assertEqual(len(sock.sent), 1)
+        sock.inbox = list(sock.sent)
+        self.assertEqual([receiver.receive_packet() for _ in payloads], payloads)
+        frame = receiver.receive_frame()
+        self.assertEqual((frame.frame_type, frame.stream_id), (FRAME_END, 7))
+
+    def test_budget_and_large_payloads_keep_order(self):
+        sock, sender, receiver = self._pair(CoalescePolicy(100, max_delay=None))
+        payloads = [b"a" * 40, b"b" * 40, b"c" * 40, b"d" * 500, b"e" * 10]
+        for payload in payloads:
+            sender.send_packet(payload)
+        # [a, b] filled the budget, c went out alone ahead of the large d.
+        self.assertEqual(len(sock.sent), 3)
+        sender.flush()
+        sock.inbox = list(sock.sent)
+        self.assertEqual([receiver.receive_packet() for _ in payloads], payloads)
+
+    def test_flush_deadline_sends_buffered_payloads(self):
+        keys = _session_keys()
+        sock_a, sock_b = memory_socketpair()
+        sock_b.settimeout(2)
+        sender = SecureTunnel(sock_a, keys, coalesce=CoalescePolicy(max_delay=0.01))
+        receiver = SecureTunnel(sock_b, keys)
+        sender.send_packet(b"ping")
+        sender.send_packet(b"pong")
+        self.assertEqual(receiver.receive_packet(), b"ping")
+        self.assertEqual(receiver.receive_packet(), b"pong")
+        self.assertEqual(sock_a.stats.sent, 1)
+        # Later batches reuse the one flusher thread instead of a timer each.
+        flusher = sender._flusher
+        for _ in range(3):
+            sender.send_packet(b"again")
+            self.assertEqual(receiver.receive_packet(), b"again")
+        self.assertIs(sender._flusher, flusher)
+        self.assertEqual(sock_a.stats.sent, 4)
+        sender.close()
+        self.assertFalse(flusher.is_alive())
+
+    def test_budget_defaults_to_the_agreed_datagram(self):
+        keys = _session_keys()
+        keys.options = {"mtu": 600}
+        sock = _CaptureSocket()
+        sender = SecureTunnel(sock, keys, coalesce=CoalescePolicy(max_delay=None))
+        for _ in range(12):
+            sender.send_packet(bytes(97))
+        sender.flush()
+        # 100 bytes per sub-frame: five fit in a 600-byte datagram.
+        self.assertEqual(len(sock.sent), 3)
+        self.assertTrue(all(len(packet) <= 600 for packet in sock.sent))
+
+    def test_rejects_malformed_sub_frames(self):
+        sock, sender, receiver = self._pair(None)
+        sender._send(b"\x00\x00\x09abc", b"", FLAG_COALESCED)
+        sock.inbox = list(sock.sent)
+        with self.assertRaises(ValueError):
+            receiver.receive_packet()
+
+
+class TestKeystreamPrefetch(unittest.TestCase):
+    def _wait_filled(self, tunnel):
+        prefetcher = tunnel.prefetcher
+        deadline = time.monotonic() + 10
+        while prefetcher.stats.generated < 2 * prefetcher.window:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_prefetched_packets_match_and_survive_rekey(self):
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        policy = PrefetchPolicy(max_bytes=4 * (32 + 256), entry_bytes=256)
+        sender = SecureTunnel(
+            sock, keys, prefetch=policy, rekey=RekeyPolicy(max_packets=3)
+        )
+        receiver = SecureTunnel(sock, keys, prefetch=policy)
+        self.addCleanup(sender.close)
+        self.addCleanup(receiver.close)
+        self._wait_filled(sender)
+        self._wait_filled(receiver)
+        self.assertLessEqual(sender.prefetcher.cached_bytes(), policy.max_bytes)
+
+        payloads = [os.urandom(n) for n in (10, 200, 1000, 0, 64, 255, 3)]
+        for payload in payloads:
+            sender.send_packet(payload)
+        sock.inbox = list(sock.sent)
+        self.assertEqual([receiver.receive_packet() for _ in payloads], payloads)
+        self.assertGreater(sender.prefetcher.stats.hits, 0)
+        self.assertGreater(receiver.prefetcher.stats.hits, 0)
+        # The 1000-byte payload exceeds the cached keystream.
+        self.assertGreaterEqual(sender.prefetcher.stats.misses, 1)
+        self.assertEqual(sender.send_epoch, 2)
+
+    def test_forged_packet_does_not_move_the_window(self):
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender = SecureTunnel(sock, keys)
+        receiver = SecureTunnel(sock, keys, prefetch=PrefetchPolicy())
+        self.addCleanup(receiver.close)
+        sender.send_packet(b"genuine")
+        forged = bytearray(sock.sent[0])
+        forged[5] ^= 0x40  # sequence number far ahead
+        sock.inbox = [bytes(forged), sock.sent[0]]
+        with self.assertRaises(ValueError):
+            receiver.receive_packet()
+        self._wait_filled(receiver)
+        self.assertEqual(receiver.receive_packet(), b"genuine")
+        self.assertEqual(receiver.prefetcher.stats.hits, 1)
+
+    def test_close_wipes_the_cache(self):
+        tunnel = SecureTunnel(_CaptureSocket(), _session_keys(), prefetch=PrefetchPolicy())
+        self._wait_filled(tunnel)
+        entries = [
+            entry
+            for lane in tunnel.prefetcher._lanes
+            for entry in lane.entries.values()
+        ]
+        tunnel.close()
+        self.assertEqual(tunnel.prefetcher.cached_bytes(), 0)
+        for poly_key, keystream in entries:
+            self.assertFalse(any(poly_key) or any(keystream))
+
+
+class TestHandshakePool(unittest.TestCase):
+    PSK = b"pool-test-psk"
+
+    def _hello(self, client):
+        return decode_handshake_message(encode_handshake_message(client.build_hello()))
+
+    def test_sessions_are_installed_before_the_reply(self):
+        registry = MetricsRegistry()
+        table = SessionTable()
+        events = []
+
+        def install(peer, keys, reply):
+            events.append(("install", peer))
+            table.install(peer, keys)
+
+        pool = HandshakePool(
+            lambda: HandshakeServer(self.PSK), install, registry=registry
+        )
+        self.addCleanup(pool.stop)
+        clients = {peer: HandshakeClient(self.PSK) for peer in ("a", "b", "c")}
+        replies = {}
+        for peer, client in clients.items():
+
+            def reply(data, peer=peer):
+                self.assertIsNotNone(table.get(peer))
+                events.append(("reply", peer))
+                replies[peer] = data
+
+            self.assertTrue(pool.submit(peer, self._hello(client), reply))
+        pool.drain()
+        self.assertEqual(len(table), 3)
+        for peer, client in clients.items():
+            keys = client.process_server_hello(decode_handshake_message(replies[peer]))
+            self.assertEqual(keys.client_enc, table.get(peer).recv_key)
+            self.assertLess(events.index(("install", peer)), events.index(("reply", peer)))
+        self.assertEqual(pool.stats.completed, 3)
+        text = registry.render()
+        self.assertIn('cryptotunnel_handshakes_total{result="completed"} 3', text)
+        self.assertIn("cryptotunnel_handshake_queue_depth 0", text)
+        self.assertIn("cryptotunnel_handshake_queue_seconds_count 3", text)
+
+    def test_admission_control_refuses_overload_and_duplicates(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_server():
+            started.set()
+            release.wait(5)
+            return HandshakeServer(self.PSK)
+
+        pool = HandshakePool(
+            slow_server, lambda *args: None, workers=1, queue_size=1
+        )
+        self.addCleanup(pool.stop)
+        self.addCleanup(release.set)
+        replies = {peer: [] for peer in "abc"}
+        hello = self._hello(HandshakeClient(self.PSK))
+        self.assertTrue(pool.submit("a", hello, replies["a"].append))
+        started.wait(5)  # "a" is being processed, the queue is empty again
+        self.assertTrue(pool.submit("b", hello, replies["b"].append))
+        self.assertFalse(pool.submit("b", hello, replies["b"].append))
+        self.assertFalse(pool.submit("c", hello, replies["c"].append))
+        self.assertEqual(pool.depth, 1)
+        self.assertEqual(replies["b"], [])
+        refusal = decode_handshake_message(replies["c"][0])
+        self.assertTrue(refusal["payload"]["reject"])
+        release.set()
+        pool.drain()
+        self.assertEqual(pool.stats.rejected, 2)
+        self.assertEqual(pool.stats.completed, 2)
+        self.assertEqual(len(replies["b"]), 1)
+
+    def test_load_server_uses_the_pool(self):
+        config = LoadConfig(
+            clients=4,
+            transport="memory",
+            duration=0.4,
+            send_rate=40,
+            packet_size=64,
+            handshake_workers=1,
+            handshake_queue=8,
+        )
+        report = run_load(config)
+        self.assertGreaterEqual(report.handshakes, 4)
+        self.assertEqual(report.errors, {})
+
+
+class _NarrowPath:
+    """Wraps a link endpoint, silently dropping datagrams above ``limit``."""
+
+    def __init__(self, endpoint, limit):
+        self.endpoint = endpoint
+        self.limit = limit
+        self.largest = 0
+
+    def sendall(self, data):
+        if len(data) <= self.limit:
+            self.largest = max(self.largest, len(data))
+            self.endpoint.sendall(data)
+
+    def __getattr__(self, name):
+        return getattr(self.endpoint, name)
+
+
+class TestPathMTU(unittest.TestCase):
+    def test_probe_finds_path_limit_and_chunks_fit(self):
+        self._probe_and_send()
+
+    def test_compression_does_not_shrink_probes(self):
+        self._probe_and_send(lambda: Compressor(COMPRESSION_ZLIB))
+
+    def _probe_and_send(self, compressor=lambda: None):
+        keys = _session_keys()
+        keys.options["mtu"] = 9000
+        sock_a, sock_b = memory_socketpair()
+        path = _NarrowPath(sock_a, 1400)
+        sender = SecureTunnel(path, keys, compressor=compressor())
+        receiver = SecureTunnel(sock_b, keys, compressor=compressor())
+        self.assertEqual(sender.max_datagram, 9000)
+        data = os.urandom(30000)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            with open(input_path, "wb") as handle:
+                handle.write(data)
+            thread = threading.Thread(
+                target=receive_file, args=(receiver, output_path), daemon=True
+            )
+            thread.start()
+            probe = probe_path_mtu(sender, timeout=0.2, attempts=1)
+            self.assertEqual(probe.datagram_size, 1400)
+            self.assertEqual(probe.loss, 0.0)
+            sizer = ChunkSizer(max_chunk_size(sender, probe.datagram_size), window=4)
+            send_file(sender, input_path, sizer)
+            thread.join(timeout=10)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), data)
+        self.assertLessEqual(path.largest, 1400)
+
+    def _narrow_pair(self, limit):
+        keys = _session_keys()
+        keys.options["mtu"] = limit
+        sock_a, sock_b = memory_socketpair()
+        sock_a.settimeout(5)
+        sock_b.settimeout(5)
+        path_a, path_b = _NarrowPath(sock_a, limit), _NarrowPath(sock_b, limit)
+        return SecureTunnel(path_a, keys), SecureTunnel(path_b, keys), path_a, path_b
+
+    def test_resumable_and_delta_fit_the_agreed_datagram(self):
+        old = os.urandom(20000)
+        new = old[:5000] + os.urandom(3000) + old[8000:]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            with open(input_path, "wb") as handle:
+                handle.write(old)
+            sender, receiver, path_a, path_b = self._narrow_pair(1400)
+            thread = threading.Thread(
+                target=receive_file_resumable,
+                args=(receiver, output_path),
+                daemon=True,
+            )
+            thread.start()
+            send_file_resumable(sender, input_path, 2048)
+            thread.join(timeout=10)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), old)
+            self.assertLessEqual(max(path_a.largest, path_b.largest), 1400)
+
+            with open(input_path, "wb") as handle:
+                handle.write(new)
+            sender, receiver, path_a, path_b = self._narrow_pair(1400)
+            thread = threading.Thread(
+                target=receive_file_delta,
+                args=(receiver, output_path),
+                kwargs={"block_size": 256},
+                daemon=True,
+            )
+            thread.start()
+            stats = send_file_delta(sender, input_path)
+            thread.join(timeout=10)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), new)
+            self.assertGreaterEqual(stats.literal_bytes, 3000)
+            self.assertLessEqual(max(path_a.largest, path_b.largest), 1400)
+
+    def test_oversized_packet_fails_on_the_sending_side(self):
+        keys = _session_keys()
+        keys.options["mtu"] = 600
+        sock = _CaptureSocket()
+        tunnel = SecureTunnel(sock, keys)
+        tunnel.send_packet(bytes(600 - PACKET_OVERHEAD))
+        with self.assertRaises(ValueError):
+            tunnel.send_packet(bytes(601 - PACKET_OVERHEAD))
+        self.assertEqual((len(sock.sent), tunnel.send_seq), (1, 1))
+
+    def test_small_agreed_datagram_bounds_probe_and_chunks(self):
+        keys = _session_keys()
+        keys.options["mtu"] = 250
+        sock_a, sock_b = memory_socketpair()
+        sender = SecureTunnel(_NarrowPath(sock_a, 200), keys)
+        SecureTunnel(sock_b, keys)
+        probe = probe_path_mtu(sender, timeout=0.05, attempts=1)
+        self.assertEqual(probe.datagram_size, 250)
+        sizer = ChunkSizer(max_chunk_size(sender, probe.datagram_size))
+        self.assertEqual((sizer.min_size, sizer.size), (210, 210))
+
+    def test_chunk_sizer_climbs_and_backs_off(self):
+        sizer = ChunkSizer(4000, min_size=500, initial=1000, window=1)
+        sizer.record(1000, 0.010)  # 100 kB/s: first sample, grow
+        self.assertEqual(sizer.size, 1250)
+        sizer.record(1250, 0.010)  # faster: keep growing
+        self.assertEqual(sizer.size, 1562)
+        sizer.record(1562, 0.020)  # slower: reverse
+        self.assertEqual(sizer.size, 1249)
+        sizer.record_loss(lost=1, sent=10)
+        self.assertEqual(sizer.size, 624)
+        sizer.record_loss(lost=0, sent=10)
+        self.assertEqual(sizer.size, 624)
+        for _ in range(20):
+            sizer.record_loss(lost=5, sent=10)
+        self.assertEqual(sizer.size, 500)
+
+
+class TestPacketForwarder(unittest.TestCase):
+    def _side(self, keys, link, **kwargs):
+        device, app = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        tunnel = SecureTunnel(link, keys, coalesce=CoalescePolicy(max_delay=None))
+        forwarder = PacketForwarder(tunnel, device.fileno(), **kwargs)
+        thread = threading.Thread(
+            target=forwarder.run, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(forwarder.stop)
+        for sock in (device, app, link):
+            self.addCleanup(sock.close)
+        app.settimeout(5)
+        return forwarder, thread, app
+
+    def test_packets_cross_both_ways_in_order(self):
+        a_key, b_key, mac, nonce = (os.urandom(n) for n in (32, 32, 32, 12))
+        link_a, link_b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        a, a_thread, app_a = self._side(
+            SessionKeys(a_key, mac, nonce, recv_key=b_key), link_a, batch=8
+        )
+        b, b_thread, app_b = self._side(
+            SessionKeys(b_key, mac, nonce, recv_key=a_key), link_b, batch=8
+        )
+        outbound = [os.urandom(20 + i * 7) for i in range(40)]
+        inbound = [os.urandom(60 + i) for i in range(25)]
+        # Queue the bursts before the forwarders start so reads are batched.
+        for packet in outbound:
+            app_a.send(packet)
+        for packet in inbound:
+            app_b.send(packet)
+        app_a.send(os.urandom(a.max_packet + 1))
+        a_thread.start()
+        b_thread.start()
+        self.assertEqual([app_b.recv(MAX_PACKET) for _ in outbound], outbound)
+        self.assertEqual([app_a.recv(MAX_PACKET) for _ in inbound], inbound)
+        for forwarder, thread in ((a, a_thread), (b, b_thread)):
+            forwarder.stop()
+            thread.join(timeout=5)
+        self.assertEqual((a.stats.packets_out, b.stats.packets_in), (40, 40))
+        self.assertEqual((b.stats.packets_out, a.stats.packets_in), (25, 25))
+        self.assertEqual(a.stats.dropped_oversize, 1)
+        # 41 reads in bursts of at most 8.
+        self.assertLessEqual(a.stats.batches, 6)
+        self.assertEqual(b.stats.dropped_invalid, 0)
+
+    def test_coalesced_leftovers_are_delivered_at_device_eof(self):
+        keys = _session_keys()
+        link_a, link_b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(link_a.close)
+        peer = SecureTunnel(link_a, keys, coalesce=CoalescePolicy(max_delay=None))
+        packets = [os.urandom(40 + i) for i in range(5)]
+        for packet in packets:
+            peer.send_packet(packet)
+        peer.flush()
+        forwarder, thread, app = self._side(keys, link_b, batch=2)
+        app.shutdown(socket.SHUT_WR)
+        thread.start()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([app.recv(MAX_PACKET) for _ in packets], packets)
+        self.assertEqual(forwarder.stats.packets_in, 5)
+
+    def test_device_close_stops_the_forwarder(self):
+        link_a, link_b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(link_b.close)
+        forwarder, thread, app = self._side(_session_keys(), link_a)
+        thread.start()
+        app.close()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+
+class TestSendScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.wire: list[tuple[str, bytes]] = []
+
+    def _sender(self, name):
+        return lambda payload: self.wire.append((name, payload))
+
+    def _scheduler(self, **kwargs):
+        return SendScheduler(clock=lambda: self.now, **kwargs)
+
+    def test_weights_split_packets(self):
+        scheduler = self._scheduler(quantum=500)
+        scheduler.add_flow("bulk", self._sender("bulk"), weight=3)
+        scheduler.add_flow("interactive", self._sender("interactive"))
+        for _ in range(40):
+            scheduler.submit("bulk", bytes(500))
+            scheduler.submit("interactive", bytes(500))
+        self.assertEqual(scheduler.dispatch(20), 20)
+        names = [name for name, _ in self.wire]
+        self.assertEqual((names.count("bulk"), names.count("interactive")), (15, 5))
+        self.assertEqual(names[:4], ["bulk"] * 3 + ["interactive"])
+        self.assertEqual(scheduler.dispatch(), 60)
+        self.assertEqual(scheduler.pending, 0)
+
+    def test_deficit_evens_out_packet_sizes(self):
+        scheduler = self._scheduler(quantum=1000)
+        scheduler.add_flow("large", self._sender("large"))
+        scheduler.add_flow("small", self._sender("small"))
+        for _ in range(10):
+            scheduler.submit("large", bytes(1000))
+        for _ in range(40):
+            scheduler.submit("small", bytes(100))
+        scheduler.dispatch(22)
+        self.assertEqual(scheduler.stats("large").bytes_sent, 2000)
+        self.assertEqual(scheduler.stats("small").bytes_sent, 2000)
+
+    def test_control_packets_have_strict_priority(self):
+        scheduler = self._scheduler()
+        scheduler.add_flow("bulk", self._sender("bulk"), limit=2)
+        self.assertTrue(scheduler.submit("bulk", b"data-1"))
+        self.assertTrue(scheduler.submit("bulk", b"data-2"))
+        self.assertFalse(scheduler.submit("bulk", b"data-3"))
+        scheduler.dispatch(1)
+        scheduler.submit_control(b"ack", self._sender("control"))
+        scheduler.dispatch()
+        self.assertEqual(
+            [payload for _, payload in self.wire], [b"data-1", b"ack", b"data-2"]
+        )
+        self.assertEqual(scheduler.stats("bulk").dropped, 1)
+        self.assertEqual(scheduler.stats(CONTROL_FLOW).sent, 1)
+        with self.assertRaises(ValueError):
+            scheduler.add_flow(CONTROL_FLOW, self._sender("x"))
+
+    def test_queueing_delay_is_reported_per_flow(self):
+        registry = MetricsRegistry()
+        scheduler = self._scheduler(registry=registry)
+        scheduler.add_flow("bulk", self._sender("bulk"))
+        scheduler.submit("bulk", b"a")
+        self.now = 0.5
+        scheduler.submit("bulk", b"b")
+        self.now = 0.75
+        scheduler.dispatch()
+        stats = scheduler.stats("bulk")
+        self.assertEqual(stats.delay_max, 0.75)
+        self.assertEqual(stats.mean_delay, 0.5)
+        page = registry.render()
+        self.assertIn('cryptotunnel_flow_queue_seconds_count{flow="bulk"} 2', page)
+        self.assertIn('cryptotunnel_flow_queue_seconds_sum{flow="bulk"} 1', page)
+
+    def test_streams_share_one_tunnel_in_dispatch_order(self):
+        keys = _session_keys()
+        sock = _CaptureSocket()
+        sender, receiver = SecureTunnel(sock, keys), SecureTunnel(sock, keys)
+        scheduler = SendScheduler(quantum=100)
+        for stream_id in (1, 2):
+            scheduler.add_flow(f"stream-{stream_id}", sender.send_packet)
+        for offset in range(0, 400, 100):
+            body = encode_data_body(offset, bytes(100))
+            scheduler.submit("stream-1", encode_frame(FRAME_DATA, 1, body))
+        scheduler.submit("stream-2", encode_frame(FRAME_END, 2))
+        scheduler.dispatch()
+        sock.inbox = list(sock.sent)
+        frames = [decode_frame(receiver.receive_packet()) for _ in range(5)]
+        self.assertEqual(
+            [(frame.frame_type, frame.stream_id) for frame in frames],
+            # Each data frame outgrows one quantum, so the small frame of
+            # stream 2 leaves first.
+            [(FRAME_END, 2)] + [(FRAME_DATA, 1)] * 4,
+        )
@@ -1,10 +1,24 @@
 import os
 import socket
+import struct
+import sys
 import tempfile
 import threading
 import unittest
+import urllib.request
 
 from src.vpn.client_app import perform_handshake, send_file, load_psk
+from src.vpn.delta import receive_file_delta, send_file_delta
+from src.vpn.loadgen import LoadConfig, run_load
+from src.vpn.metrics import CONTENT_TYPE, MetricsRegistry, serve_metrics
+from src.vpn.pmtu import ChunkSizer, max_chunk_size, probe_path_mtu
+from src.vpn.resumable import (
+    Manifest,
+    _TransferState,
+    build_manifest,
+    receive_file_resumable,
+    send_file_resumable,
+)
 from src.vpn.server_app import receive_file, receive_handshake
 from src.vpn.tunnel import SecureTunnel, SessionKeys
 
@@ -58,5 +72,213 @@ class TestUDPTransfer(unittest.TestCase):
             self.assertEqual(received, original)
 
 
+class TestResumableTransfer(unittest.TestCase):
+    CHUNK = 512
+
+    def _run(self, psk, input_path, output_path):
+        """Transfer input_path resumably and return the sender's tunnel."""
+        try:
+            server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except PermissionError:
+            self.skipTest("Socket operations not permitted in this environment")
+        server_sock.bind(("127.0.0.1", 0))
+        errors = []
+
+        def server_thread():
+            try:
+                session_keys, client_addr = receive_handshake(server_sock, psk)
+                server_sock.connect(client_addr)
+                tunnel = SecureTunnel(server_sock, session_keys)
+                receive_file_resumable(tunnel, output_path, timeout=0.5)
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                server_sock.close()
+
+        thread = threading.Thread(target=server_thread, daemon=True)
+        thread.start()
+        client_sock.connect(server_sock.getsockname())
+        tunnel = SecureTunnel(client_sock, perform_handshake(client_sock, psk))
+        send_file_resumable(tunnel, input_path, self.CHUNK, timeout=0.5)
+        client_sock.close()
+        thread.join(timeout=5)
+        self.assertEqual(errors, [])
+        return tunnel
+
+    def test_resumes_missing_and_corrupted_chunks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            psk = os.urandom(32)
+            original = os.urandom(self.CHUNK * 10 + 100)
+            with open(input_path, "wb") as handle:
+                handle.write(original)
+
+            # A previous run stored chunks 0-5, but chunk 2 was corrupted.
+            manifest = build_manifest(input_path, self.CHUNK)
+            partial = bytearray(original[: self.CHUNK * 6])
+            partial[self.CHUNK * 2] ^= 0xFF
+            with open(output_path, "wb") as handle:
+                handle.write(partial)
+            with open(output_path + ".state", "wb") as handle:
+                handle.write(struct.pack("!4sI32s", b"CTR1", 11, manifest.root))
+                handle.write(b"\x01" * 6 + b"\x00" * 5)
+
+            tunnel = self._run(psk, input_path, output_path)
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), original)
+            self.assertFalse(os.path.exists(output_path + ".state"))
+            # Manifest + one leaves packet + chunks 2, 6-10 + DONE.
+            self.assertEqual(tunnel.send_seq, 2 + 6 + 1)
+
+
+    def test_state_saves_rewrite_only_changed_entries(self):
+        manifest = Manifest(4096 * 2048, 2048, [bytes(32)] * 4096, os.urandom(32))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "output.state")
+            state = _TransferState(path, manifest)
+            for index in (5, 6, 7, 4000):
+                state.mark(index)
+            state.save()
+            size = os.path.getsize(path)
+            self.assertEqual(size, 40 + 4096)
+            # Entries outside the marked runs were never written.
+            with open(path, "r+b") as handle:
+                handle.seek(40 + 100)
+                handle.write(b"\x01")
+            state.mark(6, False)
+            state.save()
+            reloaded = _TransferState(path, manifest)
+            done = [index for index, flag in enumerate(reloaded.bitmap) if flag]
+            self.assertEqual(done, [5, 7, 100, 4000])
+            self.assertEqual(os.path.getsize(path), size)
+
+            other = Manifest(manifest.file_size, 2048, manifest.leaves, bytes(32))
+            self.assertFalse(any(_TransferState(path, other).bitmap))
+
+
+class TestDeltaTransfer(unittest.TestCase):
+    def test_sends_only_changed_regions(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "input.bin")
+            output_path = os.path.join(tmpdir, "output.bin")
+            psk = os.urandom(32)
+            old = os.urandom(8192)
+            new = old[:3000] + b"patched!" + old[3010:7000] + b"appended"
+            with open(input_path, "wb") as handle:
+                handle.write(new)
+            with open(output_path, "wb") as handle:
+                handle.write(old)
+
+            try:
+                server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            except PermissionError:
+                self.skipTest("Socket operations not permitted in this environment")
+            server_sock.bind(("127.0.0.1", 0))
+            results = []
+
+            def server_thread():
+                session_keys, client_addr = receive_handshake(server_sock, psk)
+                server_sock.connect(client_addr)
+                tunnel = SecureTunnel(server_sock, session_keys)
+                results.append(
+                    receive_file_delta(tunnel, output_path, block_size=1024)
+                )
+                server_sock.close()
+
+            thread = threading.Thread(target=server_thread, daemon=True)
+            thread.start()
+            client_sock.connect(server_sock.getsockname())
+            tunnel = SecureTunnel(client_sock, perform_handshake(client_sock, psk))
+            stats = send_file_delta(tunnel, input_path)
+            client_sock.close()
+            thread.join(timeout=5)
+
+            with open(output_path, "rb") as handle:
+                self.assertEqual(handle.read(), new)
+            self.assertEqual(results[0].literal_bytes, stats.literal_bytes)
+            self.assertEqual(stats.copied_bytes, 5 * 1024)
+            self.assertLess(stats.literal_bytes, 3 * 1024)
+
+
 if __name__ == "__main__":
     unittest.main()
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def test_prometheus_page_is_served(self):
+        registry = MetricsRegistry()
+        registry.counter("cryptotunnel_test_total", "Test counter").inc(3)
+        try:
+            server = serve_metrics(registry, "127.0.0.1", 0)
+        except PermissionError:
+            self.skipTest("Socket operations not permitted in this environment")
+        try:
+            port = server.server_address[1]
+            url = f"http://127.0.0.1:{port}/metrics"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual(response.headers["Content-Type"], CONTENT_TYPE)
+                page = response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn("# TYPE cryptotunnel_test_total counter", page)
+        self.assertIn("cryptotunnel_test_total 3", page)
+
+
+class TestLoadGeneratorUDP(unittest.TestCase):
+    def test_thread_clients_over_loopback(self):
+        config = LoadConfig(clients=2, duration=0.4, send_rate=40, packet_size=64)
+        try:
+            report = run_load(config)
+        except PermissionError:
+            self.skipTest("Socket operations not permitted in this environment")
+        self.assertEqual(report.handshakes, 2)
+        self.assertGreater(report.packets_received, 0)
+        self.assertEqual(report.errors, {})
+
+
+class TestPathMTUDiscovery(unittest.TestCase):
+    def test_probe_over_loopback_with_df_bit(self):
+        psk = os.urandom(32)
+        try:
+            server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except PermissionError:
+            self.skipTest("Socket operations not permitted in this environment")
+        self.addCleanup(server_sock.close)
+        self.addCleanup(client_sock.close)
+        server_sock.bind(("127.0.0.1", 0))
+        data = os.urandom(20000)
+        received = []
+
+        def server_thread():
+            keys, addr = receive_handshake(server_sock, psk, options={"mtu": 8000})
+            server_sock.connect(addr)
+            tunnel = SecureTunnel(server_sock, keys)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                output_path = os.path.join(tmpdir, "out.bin")
+                receive_file(tunnel, output_path)
+                with open(output_path, "rb") as handle:
+                    received.append(handle.read())
+
+        thread = threading.Thread(target=server_thread, daemon=True)
+        thread.start()
+        client_sock.connect(server_sock.getsockname())
+        keys = perform_handshake(client_sock, psk, options={"mtu": 9000})
+        self.assertEqual(keys.options, {"mtu": 8000})
+        tunnel = SecureTunnel(client_sock, keys)
+        probe = probe_path_mtu(tunnel)
+        self.assertEqual(probe.datagram_size, 8000)
+        if sys.platform.startswith("linux"):
+            self.assertGreaterEqual(probe.kernel_mtu, 8000)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_path = os.path.join(tmpdir, "in.bin")
+            with open(input_path, "wb") as handle:
+                handle.write(data)
+            sizer = ChunkSizer(max_chunk_size(tunnel, probe.datagram_size))
+            send_file(tunnel, input_path, sizer)
+        thread.join(timeout=10)
+        self.assertEqual(received, [data])
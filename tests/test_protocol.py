@@ -1,6 +1,14 @@
+import random
 import unittest
 
 from src.protocol.handshake import HandshakeClient, HandshakeServer
+from src.protocol.options import decode_options, encode_options, negotiate
+from src.protocol.resumption import TicketIssuer
+from src.protocol.serialization import (
+    decode_handshake_message,
+    encode_handshake_message,
+    encode_handshake_reject,
+)
 
 
 class TestHandshake(unittest.TestCase):
@@ -55,5 +63,189 @@ class TestHandshake(unittest.TestCase):
             client.process_server_hello(server_hello)
 
 
+class TestSessionResumption(unittest.TestCase):
+    def setUp(self):
+        self.psk = b"unit-test-pre-shared-key"
+        self.now = 1000.0
+        self.issuer = TicketIssuer(lifetime=60.0, clock=lambda: self.now)
+
+    def _full_handshake(self):
+        client = HandshakeClient(self.psk, private_key=0x5555, nonce=b"\x07" * 12)
+        server = HandshakeServer(
+            self.psk, private_key=0x6666, ticket_issuer=self.issuer
+        )
+        server_hello, _ = server.process_client_hello(client.build_hello())
+        client.process_server_hello(server_hello)
+        self.assertIsNotNone(client.ticket)
+        return client.ticket
+
+    def _resume(self, ticket):
+        client = HandshakeClient(self.psk)
+        server = HandshakeServer(self.psk, ticket_issuer=self.issuer)
+        hello = decode_handshake_message(
+            encode_handshake_message(client.build_resume_hello(ticket))
+        )
+        server_hello, server_keys = server.process_client_hello(hello)
+        client_keys = client.process_server_hello(
+            decode_handshake_message(encode_handshake_message(server_hello))
+        )
+        return client, server, client_keys, server_keys
+
+    def test_resumed_keys_match_without_modexp(self):
+        ticket = self._full_handshake()
+        client, server, client_keys, server_keys = self._resume(ticket)
+
+        self.assertEqual(client_keys, server_keys)
+        self.assertIsNone(client._pub)
+        self.assertIsNone(server._pub)
+        self.assertIsNotNone(client.ticket)
+        self.assertNotEqual(client.ticket.ticket, ticket.ticket)
+
+        # The fresh ticket can be chained into another resumption.
+        _, _, again_client, again_server = self._resume(client.ticket)
+        self.assertEqual(again_client, again_server)
+        self.assertNotEqual(again_client.client_enc, client_keys.client_enc)
+
+    def test_rejects_replayed_ticket(self):
+        ticket = self._full_handshake()
+        self._resume(ticket)
+        with self.assertRaises(ValueError):
+            self._resume(ticket)
+
+    def test_rejects_expired_ticket(self):
+        ticket = self._full_handshake()
+        self.now += 61.0
+        with self.assertRaises(ValueError):
+            self._resume(ticket)
+
+    def test_bounded_replay_cache_rejects_evicted_tickets(self):
+        self.issuer = TicketIssuer(
+            lifetime=60.0, replay_cache_size=1, clock=lambda: self.now
+        )
+        first = self._full_handshake()
+        self.now += 1.0
+        second = self._full_handshake()
+        self._resume(first)
+        self._resume(second)
+        self.assertEqual(len(self.issuer._seen), 1)
+        with self.assertRaises(ValueError):
+            self._resume(first)
+
+    def test_rejects_forged_binder(self):
+        ticket = self._full_handshake()
+        client = HandshakeClient(self.psk)
+        server = HandshakeServer(self.psk, ticket_issuer=self.issuer)
+        hello = client.build_resume_hello(ticket)
+        hello["mac"] = b"\x00" * 32
+        with self.assertRaises(ValueError):
+            server.process_client_hello(hello)
+        # The forgery did not spend the ticket for its real owner.
+        _, _, client_keys, server_keys = self._resume(ticket)
+        self.assertEqual(client_keys, server_keys)
+
+
+class TestHandshakeSerialization(unittest.TestCase):
+    def setUp(self):
+        self.psk = b"unit-test-pre-shared-key"
+        client = HandshakeClient(self.psk, private_key=0x7777, nonce=b"\x08" * 12)
+        server = HandshakeServer(
+            self.psk, private_key=0x8888, ticket_issuer=TicketIssuer()
+        )
+        self.client_hello = client.build_hello()
+        self.server_hello, _ = server.process_client_hello(self.client_hello)
+        client.process_server_hello(self.server_hello)
+        self.resume_hello = HandshakeClient(self.psk).build_resume_hello(
+            client.ticket
+        )
+
+    def test_binary_roundtrip(self):
+        for msg in (self.client_hello, self.server_hello, self.resume_hello):
+            blob = encode_handshake_message(msg)
+            self.assertEqual(decode_handshake_message(blob), msg)
+        reject = decode_handshake_message(encode_handshake_reject())
+        self.assertTrue(reject["payload"]["reject"])
+
+    def test_binary_is_smaller_than_legacy_json(self):
+        binary = encode_handshake_message(self.client_hello)
+        legacy = encode_handshake_message(self.client_hello, legacy_json=True)
+        self.assertLess(len(binary), len(legacy) // 2)
+        self.assertEqual(
+            decode_handshake_message(legacy, legacy_json=True), self.client_hello
+        )
+
+    def test_rejects_truncated_and_trailing_bytes(self):
+        blob = encode_handshake_message(self.client_hello)
+        for cut in range(len(blob)):
+            with self.assertRaises(ValueError):
+                decode_handshake_message(blob[:cut])
+        with self.assertRaises(ValueError):
+            decode_handshake_message(blob + b"\x00")
+
+    def test_rejects_degenerate_public_value(self):
+        msg = dict(self.client_hello)
+        msg["payload"] = dict(msg["payload"], pub=1)
+        with self.assertRaises(ValueError):
+            decode_handshake_message(encode_handshake_message(msg))
+
+    def test_fuzzed_input_only_raises_value_error(self):
+        rng = random.Random(1234)
+        seeds = [
+            encode_handshake_message(msg)
+            for msg in (self.client_hello, self.server_hello, self.resume_hello)
+        ]
+        for _ in range(2000):
+            blob = bytearray(rng.choice(seeds))
+            for _ in range(rng.randint(1, 4)):
+                blob[rng.randrange(len(blob))] = rng.randrange(256)
+            if rng.random() < 0.2:
+                blob = bytearray(rng.randbytes(rng.randint(0, 64)))
+            try:
+                decode_handshake_message(bytes(blob))
+            except ValueError:
+                pass
+
+
+class TestHandshakeOptions(unittest.TestCase):
+    def setUp(self):
+        self.psk = b"unit-test-pre-shared-key"
+
+    def test_compression_is_negotiated_and_authenticated(self):
+        client = HandshakeClient(
+            self.psk, private_key=0x9999, options={"compression": 0b110}
+        )
+        server = HandshakeServer(
+            self.psk, private_key=0xAAAA, options={"compression": 0b011}
+        )
+        hello = decode_handshake_message(encode_handshake_message(client.build_hello()))
+        server_hello, server_keys = server.process_client_hello(hello)
+        client_keys = client.process_server_hello(
+            decode_handshake_message(encode_handshake_message(server_hello))
+        )
+        self.assertEqual(server_keys.options, {"compression": 0b010})
+        self.assertEqual(client_keys.options, server_keys.options)
+
+        # Tampering with the agreed options breaks the ServerHello MAC.
+        server_hello["payload"]["options"] = {"compression": 0b100}
+        with self.assertRaises(ValueError):
+            client.process_server_hello(server_hello)
+
+    def test_fec_agrees_on_the_smaller_group(self):
+        offered = {"fec": (8 << 8) | 2}
+        self.assertEqual(negotiate(offered, {"fec": (16 << 8) | 1}), {"fec": (8 << 8) | 1})
+        self.assertEqual(negotiate(offered, {"fec": 0}), {"fec": 0})
+        self.assertEqual(negotiate(offered, {}), {})
+
+    def test_mtu_agrees_on_the_smaller_limit(self):
+        self.assertEqual(negotiate({"mtu": 9000}, {"mtu": 1472}), {"mtu": 1472})
+        self.assertEqual(negotiate({"mtu": 1200}, {"mtu": 65507}), {"mtu": 1200})
+
+    def test_options_encoding_is_strict(self):
+        blob = encode_options({"compression": 3, "mtu": 1400})
+        self.assertEqual(decode_options(blob), {"compression": 3, "mtu": 1400})
+        for bad in (blob[:-1], b"\x00", b"\x01a\x00\x00\x00\x01" * 2):
+            with self.assertRaises(ValueError):
+                decode_options(bad)
+
+
 if __name__ == "__main__":
     unittest.main()